@@ -1,14 +1,19 @@
 import os
-import httpx
 import asyncio
 import random
-import json
-import gspread
 import itertools
 from dotenv import load_dotenv
+import fast_json
+from tg_router import Router, Update
+from update_dedup import RecentUpdates
+from tg_polling import UpdatePoller, INGESTION
+from update_queue import UpdateQueue, ESSENTIAL_ONLY
+from tg_dispatch import TelegramDispatcher, BULK
+from tg_payloads import StaticMessage
+from tg_http import create_client, pool_stats
+from media_cache import MediaCache
 from fastapi import FastAPI, Request, BackgroundTasks
 from contextlib import asynccontextmanager
-from oauth2client.service_account import ServiceAccountCredentials
 load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(",")))
@@ -24,6 +29,9 @@ BUY_URL = os.getenv("BUY_URL")
 SELL_URL = os.getenv("SELL_URL")
 
 client = None
+tg_dispatcher = TelegramDispatcher()
+recent_updates = RecentUpdates()
+signal_photos = MediaCache(tg_dispatcher, API_BASE, "1r1s-signal-photos")
 
 
 otc_pairs = [
@@ -53,7 +61,9 @@ expiry_options = ["5 Seconds", "10 Seconds", "15 Seconds"]
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global client
-    client = httpx.AsyncClient(timeout=10)
+    client = create_client()
+    tg_dispatcher.client = client
+    update_queue.start()
     async def self_ping_loop():
         await asyncio.sleep(5)
         while True:
@@ -63,13 +73,23 @@ async def lifespan(app: FastAPI):
             except Exception as e:
                 print(f"❌ Ping failed: {e}")
             await asyncio.sleep(300)
-    asyncio.create_task(self_ping_loop())
+    if INGESTION == "polling":
+        update_poller.start()
+    else:
+        asyncio.create_task(self_ping_loop())  # Keeps the webhook host awake; nothing to keep awake when polling
     yield
+    await update_poller.stop()
+    await update_queue.stop()  # Finish acknowledged updates before the client closes
     await client.aclose()  # Clean up
 app = FastAPI(lifespan=lifespan)
 @app.api_route("/", methods=["GET", "HEAD"])
 async def healthcheck(request: Request):
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "duplicate_updates": recent_updates.duplicates,
+        "http_pool": pool_stats(client),
+        "telegram_failures": tg_dispatcher.failure_counts(),
+    }
 
 
 
@@ -77,120 +97,151 @@ async def simulate_analysis(chat_id: int, pair: str, expiry: str):
     direction = random.choice(["⬆️⬆️", "⬇️⬇️"])
     photo_url = BUY_URL if "⬆️" in direction else SELL_URL
 
-    await client.post(SEND_PHOTO, json={
-        "chat_id": chat_id,
-        "photo": photo_url
-    })
+    await signal_photos.send_photo(chat_id, photo_url)
+
+
+# Static replies, serialized once; only chat_id is added per request
+PAIR_MENU = StaticMessage(
+    text="Select an OTC pair:",
+    parse_mode="Markdown",
+    reply_markup={"keyboard": otc_pairs, "resize_keyboard": True},
+)
+EXPIRY_MENU = StaticMessage(
+    text="Choose time to trade:",
+    parse_mode="Markdown",
+    reply_markup={"keyboard": otc_pairs2, "resize_keyboard": True},
+)
+UNKNOWN_COMMAND_REPLY = StaticMessage(
+    text=f"Unknown command. \nUse /start to get started.",
+)
 
-@app.post("/webhook")
-async def webhook(request: Request, background_tasks: BackgroundTasks):
-    data = await request.json()
-    # --- HANDLE NORMAL TEXT MESSAGES ---
-    if msg := data.get("message"):
-        text = msg.get("text", "")
-        chat_id = msg["chat"]["id"]
-        user = msg["from"]
-        user_id = user["id"]
-        if user_id in ADMIN_IDS:
-            media_type = None
-            media_file_id = None
-            # Check if message has photo or video
-            if "photo" in msg and "caption" in msg:
-                media_type = "photo"
-                media_file_id = msg["photo"][-1]["file_id"]  # highest resolution photo
-                caption = msg["caption"]
-            elif "video" in msg and "caption" in msg:
-                media_type = "video"
-                media_file_id = msg["video"]["file_id"]
-                caption = msg["caption"]
-            if media_type and media_file_id and caption:
-                inline_keyboard = {
-                    "inline_keyboard": [[
-                        {
-                            "text": "Access",
-                            "url": f"https://t.me/{os.getenv('BOT_USERNAME')}?start=register"
-                        }
-                    ]]
-                }
-                payload = {
-                    "chat_id": -1002713918801,  # channel hub
-                    "caption": caption,
-                    "reply_markup": inline_keyboard,
-                    "parse_mode": "HTML"
-                }
-                if media_type == "photo":
-                    payload["photo"] = media_file_id
-                    send_method = "sendPhoto"
-                else:  # video
-                    payload["video"] = media_file_id
-                    send_method = "sendVideo"
-                send_url = f"{API_BASE}/{send_method}"
-                background_tasks.add_task(client.post, send_url, json=payload)
-                return {"ok": True}
-        if text.startswith("/start"):
-            parts = text.split()
-            param = parts[1] if len(parts) > 1 else None
-            
-            keyboard = otc_pairs
-            payload = {
-                "chat_id": chat_id,
-                "text": (
-                    "Select an OTC pair:"),
-                "parse_mode": "Markdown",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        
-
-        # Handle OTC Pair Selection
-        if text in PAIR_SET:
-            keyboard = otc_pairs2
-            payload = {
-                "chat_id": chat_id,
-                "text": (
-                    "Choose time to trade:"
-                ),
-                "parse_mode": "Markdown",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-            
-        if text in PAIR_SET2:
-            direction = random.choice(["⬆️⬆️", "⬇️⬇️"])
-            photo_url = BUY_URL if "⬆️" in direction else SELL_URL
-            
-            reply_kb = {
-                "keyboard": otc_pairs,
-                "resize_keyboard": True,
-                "one_time_keyboard": False
-            }
-            await client.post(SEND_PHOTO, json={
-                "chat_id": chat_id,
-                "photo": photo_url,
-                "reply_markup": reply_kb
-            })
-            return {"ok": True}
 
+router = Router()
+
+
+@router.message(when=lambda update: update.user_id in ADMIN_IDS)
+async def forward_admin_media(update, background_tasks):
+    msg = update.message
+    media_type = None
+    media_file_id = None
+    # Check if message has photo or video
+    if "photo" in msg and "caption" in msg:
+        media_type = "photo"
+        media_file_id = msg["photo"][-1]["file_id"]  # highest resolution photo
+        caption = msg["caption"]
+    elif "video" in msg and "caption" in msg:
+        media_type = "video"
+        media_file_id = msg["video"]["file_id"]
+        caption = msg["caption"]
+    if media_type and media_file_id and caption:
+        inline_keyboard = {
+            "inline_keyboard": [[
+                {
+                    "text": "Access",
+                    "url": f"https://t.me/{os.getenv('BOT_USERNAME')}?start=register"
+                }
+            ]]
+        }
         payload = {
-            "chat_id": chat_id,
-            "text": f"Unknown command. \nUse /start to get started."}
-        background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
+            "chat_id": -1002713918801,  # channel hub
+            "caption": caption,
+            "reply_markup": inline_keyboard,
+            "parse_mode": "HTML"
+        }
+        if media_type == "photo":
+            payload["photo"] = media_file_id
+            send_method = "sendPhoto"
+        else:  # video
+            payload["video"] = media_file_id
+            send_method = "sendVideo"
+        send_url = f"{API_BASE}/{send_method}"
+        background_tasks.add_task(tg_dispatcher.post, send_url, json=payload, priority=BULK)
         return {"ok": True}
 
-    # --- HANDLE CALLBACKS ---
-    if cq := data.get("callback_query"):
-        data_str = cq.get("data", "")
-        chat_id = cq["message"]["chat"]["id"]
-        message_id = cq["message"]["message_id"]
-        cq_id = cq.get("id")
-        background_tasks.add_task(client.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": cq_id})
-        background_tasks.add_task(client.post, DELETE_MESSAGE, json={"chat_id": chat_id, "message_id": message_id})
-        _, pair, expiry = data_str.split("|", 2)
-        background_tasks.add_task(simulate_analysis, chat_id, pair, expiry)
+
+@router.message(prefix="/start")
+async def start(update, background_tasks):
+    text, chat_id = update.text, update.chat_id
+    parts = text.split()
+    param = parts[1] if len(parts) > 1 else None
+
+    payload = PAIR_MENU.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(text=PAIR_SET)
+async def choose_pair(update, background_tasks):
+    chat_id = update.chat_id
+    payload = EXPIRY_MENU.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(text=PAIR_SET2)
+async def send_signal(update, background_tasks):
+    chat_id = update.chat_id
+    direction = random.choice(["⬆️⬆️", "⬇️⬇️"])
+    photo_url = BUY_URL if "⬆️" in direction else SELL_URL
+
+    reply_kb = {
+        "keyboard": otc_pairs,
+        "resize_keyboard": True,
+        "one_time_keyboard": False
+    }
+    await signal_photos.send_photo(chat_id, photo_url, reply_markup=reply_kb)
+    return {"ok": True}
+
+
+@router.message(fallback=True)
+async def unknown_command(update, background_tasks):
+    if update_queue.mode >= ESSENTIAL_ONLY:
         return {"ok": True}
+    chat_id = update.chat_id
+    payload = UNKNOWN_COMMAND_REPLY.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.callback(fallback=True)
+async def choose_expiry(update, background_tasks):
+    chat_id, data_str = update.chat_id, update.callback_data
+    _, pair, expiry = data_str.split("|", 2)
+    background_tasks.add_task(simulate_analysis, chat_id, pair, expiry)
     return {"ok": True}
+
+
+async def handle_update(update):
+    background_tasks = BackgroundTasks()
+    if update.callback_query:
+        # Acknowledge the button press and remove the menu it came from
+        background_tasks.add_task(tg_dispatcher.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": update.callback_query.get("id")})
+        background_tasks.add_task(tg_dispatcher.post, DELETE_MESSAGE, json={"chat_id": update.chat_id, "message_id": update.message_id})
+    await router.dispatch(update, background_tasks)
+    await background_tasks()  # Here rather than after a response, so the chat's next update waits for these sends
+
+
+update_queue = UpdateQueue(handle_update)
+
+
+def receive(data):
+    # Queues an update for the worker pool, which handles it in order within its chat
+    if recent_updates.seen(data):
+        return  # A redelivery of an update that is already queued or handled
+    update = Update(data)
+    update_queue.put(update.chat_id, update)
+    recent_updates.record(data)
+
+
+update_poller = UpdatePoller(tg_dispatcher, API_BASE, receive, update_queue)
+
+
+@app.post("/webhook")
+async def webhook(request: Request):
+    receive(fast_json.loads(await request.body()))
+    return {"ok": True}  # Acknowledged at once, before the update is handled
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 10000))
@@ -1,14 +1,21 @@
 import os
-import httpx
 import asyncio
 import random
-import json
-import gspread
 import itertools
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, BackgroundTasks
 from contextlib import asynccontextmanager
-from oauth2client.service_account import ServiceAccountCredentials
+from sheets_session import open_worksheet
+from sheets_async import AsyncWorksheet, run_sheets, run_sheets_in_background
+from local_store import load_snapshot, save_snapshot
+import fast_json
+from tg_router import Router, Update
+from update_dedup import RecentUpdates
+from tg_polling import UpdatePoller, INGESTION
+from update_queue import UpdateQueue, ESSENTIAL_ONLY
+from tg_dispatch import TelegramDispatcher, BULK
+from tg_payloads import StaticMessage
+from tg_http import create_client, pool_stats
 load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(",")))
@@ -26,12 +33,11 @@ BUY_URL = os.getenv("BUY_URL")
 SELL_URL = os.getenv("SELL_URL")
 
 client = None
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS2"))
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-spreadsheet = client.open("LyraExclusiveAccess")
-sheet = spreadsheet.worksheet("Sheet5")
+tg_dispatcher = TelegramDispatcher()
+recent_updates = RecentUpdates()
+sheet = open_worksheet("LyraExclusiveAccess", "Sheet5", creds_env="GOOGLE_CREDENTIALS2")
+AUTHORIZED_SNAPSHOT = "LyraExclusiveAccess-Sheet5"
+sheet_async = AsyncWorksheet(sheet)
 
 otc_pairs = [
     ["AUD/CHF OTC", "GBP/JPY OTC", "QAR/CNY OTC"],
@@ -49,15 +55,17 @@ PAIR_SET = {p for row in otc_pairs for p in row}
 expiry_options = ["5 Seconds", "10 Seconds", "15 Seconds"]
 def load_authorized_users():
     global AUTHORIZED_USERS
-    AUTHORIZED_USERS = set()
+    users = set()
     user_ids = sheet.col_values(1)
     print(f"Fetched user IDs from GSheet: {user_ids}")
     for user_id in user_ids[1:]:
         if user_id.strip():
             try:
-                AUTHORIZED_USERS.add(int(user_id))
+                users.add(int(user_id))
             except ValueError:
                 print(f"Skipping invalid ID: {user_id}")
+    AUTHORIZED_USERS = users
+    save_snapshot(AUTHORIZED_SNAPSHOT, sorted(users))
     print(f"Loaded authorized users: {AUTHORIZED_USERS}")
 def save_users():
     user_ids = sheet.col_values(1)
@@ -78,11 +86,18 @@ def save_users():
         else:
             sheet.append_row([user_id, tg_username, tg_name, pocket_option_id])
     print("✅ Users saved successfully!")
-load_authorized_users()
+AUTHORIZED_USERS = set(load_snapshot(AUTHORIZED_SNAPSHOT, []))
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global client
-    client = httpx.AsyncClient(timeout=10)
+    client = create_client()
+    tg_dispatcher.client = client
+    update_queue.start()
+    if AUTHORIZED_USERS:
+        # Serve from the last snapshot right away and reconcile with the sheet in the background
+        run_sheets_in_background(load_authorized_users, "Reconciling authorized users")
+    else:
+        await run_sheets(load_authorized_users)  # First boot: no snapshot yet
     async def self_ping_loop():
         await asyncio.sleep(5)
         while True:
@@ -92,13 +107,23 @@ async def lifespan(app: FastAPI):
             except Exception as e:
                 print(f"❌ Ping failed: {e}")
             await asyncio.sleep(300)
-    asyncio.create_task(self_ping_loop())
+    if INGESTION == "polling":
+        update_poller.start()
+    else:
+        asyncio.create_task(self_ping_loop())  # Keeps the webhook host awake; nothing to keep awake when polling
     yield
+    await update_poller.stop()
+    await update_queue.stop()  # Finish acknowledged updates before the client closes
     await client.aclose()  # Clean up
 app = FastAPI(lifespan=lifespan)
 @app.api_route("/", methods=["GET", "HEAD"])
 async def healthcheck(request: Request):
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "duplicate_updates": recent_updates.duplicates,
+        "http_pool": pool_stats(client),
+        "telegram_failures": tg_dispatcher.failure_counts(),
+    }
 
 
 
@@ -106,230 +131,270 @@ async def simulate_analysis(chat_id: int, pair: str, expiry: str):
     direction = random.choice(["⬆️⬆️", "⬇️⬇️"])
     photo_url = BUY_URL if "⬆️" in direction else SELL_URL
 
-    await client.post(SEND_PHOTO, json={
+    await tg_dispatcher.post(SEND_PHOTO, json={
         "chat_id": chat_id,
         "photo": photo_url
     })
 
 
+# Static replies, serialized once; only chat_id is added per request
+PAIR_MENU = StaticMessage(
+    text="Select a pair to get Signal:",
+    parse_mode="Markdown",
+    reply_markup={"keyboard": otc_pairs, "resize_keyboard": True},
+)
+PAIR_MENU_2 = StaticMessage(
+    text="Select an OTC pair:",
+    parse_mode="Markdown",
+    reply_markup={"keyboard": otc_pairs, "resize_keyboard": True},
+)
+ADDMEMBER_USAGE_REPLY = StaticMessage(
+    text="⚠️ Usage: /addmember <user_id> <pocket_option_id>",
+)
+NOT_AUTHORIZED_REPLY = StaticMessage(
+    text="❌ You are not authorized to use this command.",
+)
+INVALID_USER_ID_REPLY = StaticMessage(
+    text="⚠️ Invalid user ID. Please enter a valid number.",
+)
+UNKNOWN_COMMAND_REPLY = StaticMessage(
+    text=f"Unknown command. \nUse /start to get started.",
+)
 
 
-@app.post("/webhook")
-async def webhook(request: Request, background_tasks: BackgroundTasks):
-    data = await request.json()
-    # --- HANDLE NORMAL TEXT MESSAGES ---
-    if msg := data.get("message"):
-        text = msg.get("text", "")
-        chat_id = msg["chat"]["id"]
-        user = msg["from"]
-        user_id = user["id"]
-        if user_id in ADMIN_IDS:
-            media_type = None
-            media_file_id = None
-            # Check if message has photo or video
-            if "photo" in msg and "caption" in msg:
-                media_type = "photo"
-                media_file_id = msg["photo"][-1]["file_id"]  # highest resolution photo
-                caption = msg["caption"]
-            elif "video" in msg and "caption" in msg:
-                media_type = "video"
-                media_file_id = msg["video"]["file_id"]
-                caption = msg["caption"]
-            if media_type and media_file_id and caption:
-                inline_keyboard = {
-                    "inline_keyboard": [[
-                        {
-                            "text": "Aether IQ Access",
-                            "url": f"https://t.me/{os.getenv('BOT_USERNAME')}?start=register"
-                        }
-                    ]]
-                }
-                payload = {
-                    "chat_id": -1002713918801,  # channel hub
-                    "caption": caption,
-                    "reply_markup": inline_keyboard,
-                    "parse_mode": "HTML"
-                }
-                if media_type == "photo":
-                    payload["photo"] = media_file_id
-                    send_method = "sendPhoto"
-                else:  # video
-                    payload["video"] = media_file_id
-                    send_method = "sendVideo"
-                send_url = f"{API_BASE}/{send_method}"
-                background_tasks.add_task(client.post, send_url, json=payload)
-                return {"ok": True}
-        if text.startswith("/start"):
-            parts = text.split()
-            param = parts[1] if len(parts) > 1 else None
-            if param == "register":
-                if user_id not in AUTHORIZED_USERS:
-                    # User not authorized - send welcome/register instructions
-                    payload = {
-                        "chat_id": chat_id,
-                        "text": (
-                            "⚡ <b>Welcome to AetherIQ</b>\n\n"
-                            "Follow these quick steps to activate your access:\n"
-                            "1️⃣ Sign up using our <a href=\"{pocketlink}\">official link</a>\n"
-                            "2️⃣ Grab your <b>Account ID</b> from Pocket Option\n"
-                            "3️⃣ Send it to our support team for instant activation ✅"
-                        ).replace("{pocketlink}", pocketlink),
-                        "parse_mode": "HTML",
-                        "reply_markup": {
-                            "inline_keyboard": [
-                                [
-                                    {"text": "🚀 Create Your Account", "url": pocketlink},
-                                    {"text": "💬 Contact Support", "url": os.getenv("SUPPORT")}
-                                ]
-                            ]
-                        }
-                    }
-                    background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            
-                elif user_id in AUTHORIZED_USERS:
-                    # Authorized user - show OTC pair keyboard
-                    keyboard = otc_pairs
-                    payload = {
-                        "chat_id": chat_id,
-                        "text": (
-                            "Select a pair to get Signal:"
-                        ),
-                        "parse_mode": "Markdown",
-                        "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-                    }
-                    background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            # Default /start behavior
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": (
-                        "⚡ <b>Welcome to AetherIQ</b>\n\n"
-                        "Follow these quick steps to activate your access:\n"
-                        "1️⃣ Sign up using our <a href=\"{pocketlink}\">official link</a>\n"
-                        "2️⃣ Grab your <b>Account ID</b> from Pocket Option\n"
-                        "3️⃣ Send it to our support team for instant activation ✅"
-                    ).replace("{pocketlink}", pocketlink),
-                    "parse_mode": "HTML",
-                    "reply_markup": {
-                        "inline_keyboard": [
-                            [
-                                {"text": "🚀 Create Your Account", "url": pocketlink},
-                                {"text": "💬 Contact Support", "url": os.getenv("SUPPORT")}
-                            ]
-                        ]
-                    }
+router = Router()
+
+
+@router.message(when=lambda update: update.user_id in ADMIN_IDS)
+async def forward_admin_media(update, background_tasks):
+    msg = update.message
+    media_type = None
+    media_file_id = None
+    # Check if message has photo or video
+    if "photo" in msg and "caption" in msg:
+        media_type = "photo"
+        media_file_id = msg["photo"][-1]["file_id"]  # highest resolution photo
+        caption = msg["caption"]
+    elif "video" in msg and "caption" in msg:
+        media_type = "video"
+        media_file_id = msg["video"]["file_id"]
+        caption = msg["caption"]
+    if media_type and media_file_id and caption:
+        inline_keyboard = {
+            "inline_keyboard": [[
+                {
+                    "text": "Aether IQ Access",
+                    "url": f"https://t.me/{os.getenv('BOT_USERNAME')}?start=register"
                 }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            keyboard = otc_pairs
+            ]]
+        }
+        payload = {
+            "chat_id": -1002713918801,  # channel hub
+            "caption": caption,
+            "reply_markup": inline_keyboard,
+            "parse_mode": "HTML"
+        }
+        if media_type == "photo":
+            payload["photo"] = media_file_id
+            send_method = "sendPhoto"
+        else:  # video
+            payload["video"] = media_file_id
+            send_method = "sendVideo"
+        send_url = f"{API_BASE}/{send_method}"
+        background_tasks.add_task(tg_dispatcher.post, send_url, json=payload, priority=BULK)
+        return {"ok": True}
+
+
+@router.message(prefix="/start")
+async def start(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    parts = text.split()
+    param = parts[1] if len(parts) > 1 else None
+    if param == "register":
+        if user_id not in AUTHORIZED_USERS:
+            # User not authorized - send welcome/register instructions
             payload = {
                 "chat_id": chat_id,
                 "text": (
-                    "Select an OTC pair:"),
-                "parse_mode": "Markdown",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        
-
-        # Handle OTC Pair Selection
-        if text in PAIR_SET:
-            if user_id not in AUTHORIZED_USERS:
-                keyboard = {
+                    "⚡ <b>Welcome to AetherIQ</b>\n\n"
+                    "Follow these quick steps to activate your access:\n"
+                    "1️⃣ Sign up using our <a href=\"{pocketlink}\">official link</a>\n"
+                    "2️⃣ Grab your <b>Account ID</b> from Pocket Option\n"
+                    "3️⃣ Send it to our support team for instant activation ✅"
+                ).replace("{pocketlink}", pocketlink),
+                "parse_mode": "HTML",
+                "reply_markup": {
                     "inline_keyboard": [
-                        [{"text": "Join Channel", "url": channel_link}],]}
-                payload = {
-                    "chat_id": chat_id,
-                    "text": (
-                        "❌ You are not authorized to use this command yet.\n\nPlease Join my Channel to get access, just click the button below."),
-                    "reply_markup": keyboard}
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            inline_kb = [
-                [{"text": expiry_options[i], "callback_data": f"expiry|{text}|{expiry_options[i]}"} 
-                 for i in range(len(expiry_options))]]
-            payload = {
-                "chat_id": chat_id,
-                "text": f"Please Choose Time to Trade for {text}",
-                "reply_markup": {"inline_keyboard": inline_kb}}
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-
-        if text.startswith(("/addmember", "/add")):
-            parts = text.strip().split()
-            if len(parts) < 3:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ Usage: /addmember <user_id> <pocket_option_id>"}
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            if user_id not in ADMIN_IDS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "❌ You are not authorized to use this command."}
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            try:
-                new_user_id = int(parts[1])
-                pocket_option_id = parts[2]
-                AUTHORIZED_USERS.add(new_user_id)
-            
-                try:
-                    resp = await client.get(f"{API_BASE}/getChat", params={"chat_id": new_user_id})
-                    user_info = resp.json().get("result", {})
-                    username = user_info.get("username", "Unknown")
-                    first_name = user_info.get("first_name", "Trader")
-                except Exception as e:
-                    print(f"⚠️ Failed to fetch user info: {e}")
-                    username = "Unknown"
-                    first_name = "Trader"
-            
-                # Prepare full name and username display
-                full_name = first_name
-                username_display = f"@{username}" if username != "Unknown" else "No username"
-            
-                user_ids = sheet.col_values(1)
-                user_id_str = str(new_user_id)
-                if user_id_str in user_ids:
-                    row_number = user_ids.index(user_id_str) + 1
-                    sheet.update(f"B{row_number}", [[username]])
-                    sheet.update(f"C{row_number}", [[first_name]])
-                    sheet.update(f"D{row_number}", [[pocket_option_id]])
-                else:
-                    sheet.append_row([new_user_id, username, first_name, pocket_option_id])
-            
-                payload = {
-                    "chat_id": chat_id,
-                    "text": f"✅ Added Successful!\n\n{full_name} | {username_display} | {new_user_id} \nPocket Option ID: {pocket_option_id}"
+                        [
+                            {"text": "🚀 Create Your Account", "url": pocketlink},
+                            {"text": "💬 Contact Support", "url": os.getenv("SUPPORT")}
+                        ]
+                    ]
                 }
-                await client.post(SEND_MESSAGE, json=payload)
+            }
+            background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
 
-            except ValueError:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ Invalid user ID. Please enter a valid number."}
-                await client.post(SEND_MESSAGE, json=payload)
-            return {"ok": True}
+        elif user_id in AUTHORIZED_USERS:
+            # Authorized user - show OTC pair keyboard
+            payload = PAIR_MENU.to(chat_id)
+            background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    # Default /start behavior
+    if user_id not in AUTHORIZED_USERS:
+        payload = {
+            "chat_id": chat_id,
+            "text": (
+                "⚡ <b>Welcome to AetherIQ</b>\n\n"
+                "Follow these quick steps to activate your access:\n"
+                "1️⃣ Sign up using our <a href=\"{pocketlink}\">official link</a>\n"
+                "2️⃣ Grab your <b>Account ID</b> from Pocket Option\n"
+                "3️⃣ Send it to our support team for instant activation ✅"
+            ).replace("{pocketlink}", pocketlink),
+            "parse_mode": "HTML",
+            "reply_markup": {
+                "inline_keyboard": [
+                    [
+                        {"text": "🚀 Create Your Account", "url": pocketlink},
+                        {"text": "💬 Contact Support", "url": os.getenv("SUPPORT")}
+                    ]
+                ]
+            }
+        }
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    payload = PAIR_MENU_2.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(text=PAIR_SET)
+async def choose_pair(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    if user_id not in AUTHORIZED_USERS:
+        keyboard = {
+            "inline_keyboard": [
+                [{"text": "Join Channel", "url": channel_link}],]}
         payload = {
             "chat_id": chat_id,
-            "text": f"Unknown command. \nUse /start to get started."}
-        background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
+            "text": (
+                "❌ You are not authorized to use this command yet.\n\nPlease Join my Channel to get access, just click the button below."),
+            "reply_markup": keyboard}
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    inline_kb = [
+        [{"text": expiry_options[i], "callback_data": f"expiry|{text}|{expiry_options[i]}"} 
+         for i in range(len(expiry_options))]]
+    payload = {
+        "chat_id": chat_id,
+        "text": f"Please Choose Time to Trade for {text}",
+        "reply_markup": {"inline_keyboard": inline_kb}}
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(prefix=("/addmember", "/add"))
+async def add_member(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    parts = text.strip().split()
+    if len(parts) < 3:
+        payload = ADDMEMBER_USAGE_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    if user_id not in ADMIN_IDS:
+        payload = NOT_AUTHORIZED_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
         return {"ok": True}
+    try:
+        new_user_id = int(parts[1])
+        pocket_option_id = parts[2]
+        AUTHORIZED_USERS.add(new_user_id)
+        save_snapshot(AUTHORIZED_SNAPSHOT, sorted(AUTHORIZED_USERS))
+
+        try:
+            resp = await tg_dispatcher.post(f"{API_BASE}/getChat", json={"chat_id": new_user_id})
+            user_info = fast_json.loads(resp.content).get("result", {})
+            username = user_info.get("username", "Unknown")
+            first_name = user_info.get("first_name", "Trader")
+        except Exception as e:
+            print(f"⚠️ Failed to fetch user info: {e}")
+            username = "Unknown"
+            first_name = "Trader"
+
+        # Prepare full name and username display
+        full_name = first_name
+        username_display = f"@{username}" if username != "Unknown" else "No username"
 
-    # --- HANDLE CALLBACKS ---
-    if cq := data.get("callback_query"):
-        data_str = cq.get("data", "")
-        chat_id = cq["message"]["chat"]["id"]
-        message_id = cq["message"]["message_id"]
-        cq_id = cq.get("id")
-        background_tasks.add_task(client.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": cq_id})
-        background_tasks.add_task(client.post, DELETE_MESSAGE, json={"chat_id": chat_id, "message_id": message_id})
-        _, pair, expiry = data_str.split("|", 2)
-        background_tasks.add_task(simulate_analysis, chat_id, pair, expiry)
+        user_ids = await sheet_async.col_values(1)
+        user_id_str = str(new_user_id)
+        if user_id_str in user_ids:
+            row_number = user_ids.index(user_id_str) + 1
+            await sheet_async.update(f"B{row_number}", [[username]])
+            await sheet_async.update(f"C{row_number}", [[first_name]])
+            await sheet_async.update(f"D{row_number}", [[pocket_option_id]])
+        else:
+            await sheet_async.append_row([new_user_id, username, first_name, pocket_option_id])
+
+        payload = {
+            "chat_id": chat_id,
+            "text": f"✅ Added Successful!\n\n{full_name} | {username_display} | {new_user_id} \nPocket Option ID: {pocket_option_id}"
+        }
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+
+    except ValueError:
+        payload = INVALID_USER_ID_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(fallback=True)
+async def unknown_command(update, background_tasks):
+    if update_queue.mode >= ESSENTIAL_ONLY:
         return {"ok": True}
+    chat_id = update.chat_id
+    payload = UNKNOWN_COMMAND_REPLY.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
     return {"ok": True}
+
+
+@router.callback(fallback=True)
+async def choose_expiry(update, background_tasks):
+    chat_id, data_str = update.chat_id, update.callback_data
+    _, pair, expiry = data_str.split("|", 2)
+    background_tasks.add_task(simulate_analysis, chat_id, pair, expiry)
+    return {"ok": True}
+
+
+async def handle_update(update):
+    background_tasks = BackgroundTasks()
+    if update.callback_query:
+        # Acknowledge the button press and remove the menu it came from
+        background_tasks.add_task(tg_dispatcher.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": update.callback_query.get("id")})
+        background_tasks.add_task(tg_dispatcher.post, DELETE_MESSAGE, json={"chat_id": update.chat_id, "message_id": update.message_id})
+    await router.dispatch(update, background_tasks)
+    await background_tasks()  # Here rather than after a response, so the chat's next update waits for these sends
+
+
+update_queue = UpdateQueue(handle_update)
+
+
+def receive(data):
+    # Queues an update for the worker pool, which handles it in order within its chat
+    if recent_updates.seen(data):
+        return  # A redelivery of an update that is already queued or handled
+    update = Update(data)
+    update_queue.put(update.chat_id, update)
+    recent_updates.record(data)
+
+
+update_poller = UpdatePoller(tg_dispatcher, API_BASE, receive, update_queue)
+
+
+@app.post("/webhook")
+async def webhook(request: Request):
+    receive(fast_json.loads(await request.body()))
+    return {"ok": True}  # Acknowledged at once, before the update is handled
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 10000))
@@ -1,13 +1,21 @@
 import os
-import httpx
 import asyncio
 import random
-import json
-import gspread
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, BackgroundTasks
 from contextlib import asynccontextmanager
-from oauth2client.service_account import ServiceAccountCredentials
+from sheets_session import open_worksheet
+from sheets_async import run_sheets, run_sheets_in_background
+from sheet_cache import DepositIndex, AuthorizedUserSync, AuthorizedUserWriter
+from local_store import LocalStore
+import fast_json
+from tg_router import Router, Update
+from update_dedup import RecentUpdates
+from tg_polling import UpdatePoller, INGESTION
+from update_queue import UpdateQueue, NO_ANIMATIONS, ESSENTIAL_ONLY
+from tg_dispatch import TelegramDispatcher, BULK
+from tg_payloads import StaticMessage, static_keyboard
+from tg_http import create_client, pool_stats
 
 load_dotenv()
 
@@ -22,19 +30,13 @@ DELETE_MESSAGE = f"{API_BASE}/deleteMessage"
 RENDER_URL = "https://fourlgosh4rk.onrender.com"
 
 client = None
+tg_dispatcher = TelegramDispatcher()
+recent_updates = RecentUpdates()
 
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive"
-]
-
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-spreadsheet = client.open("TelegramBotMembers")
-sheet = spreadsheet.worksheet("Sheet19")        # Trader data sheet (read-only for deposit)
-authorized_sheet = spreadsheet.worksheet("Sheet14")  # Authorized users sheet
+TRADER_SHEET_NAME = "Sheet19"
+AUTHORIZED_SHEET_NAME = "Sheet14"
+sheet = open_worksheet("TelegramBotMembers", TRADER_SHEET_NAME)        # Trader data sheet (read-only for deposit)
+authorized_sheet = open_worksheet("TelegramBotMembers", AUTHORIZED_SHEET_NAME)  # Authorized users sheet
 pocketlink = os.getenv("POCKET_LINK")
 supportacccount = os.getenv("SUPPORT_LINK")
 otc_pairs = [
@@ -42,44 +44,43 @@ otc_pairs = [
     "NZD/USD OTC", "EUR/JPY OTC", "CAD/JPY OTC", "AUD/USD OTC",  "AUD/CHF OTC", "GBP/AUD OTC"]
 expiry_options = ["S5", "S10", "S15", "S30", "M1", "M2"]
 user_data = {}
+store = LocalStore()
+deposit_index = DepositIndex(sheet, store, TRADER_SHEET_NAME)
+AUTHORIZED_USERS = store.authorized_ids(AUTHORIZED_SHEET_NAME)  # Warm start from the last local copy
 def get_deposit_for_trader(trader_id: str) -> float | None:
-    trader_ids = sheet.col_values(1)
-    deposits = sheet.col_values(2)
-    for idx, tid in enumerate(trader_ids[1:], start=1):
-        if tid.strip() == trader_id:
-            try:
-                return float(deposits[idx])
-            except (ValueError, IndexError):
-                return None
-    return None
+    return deposit_index.get(trader_id)
+authorized_sync = AuthorizedUserSync(authorized_sheet, store, AUTHORIZED_SHEET_NAME)
 def load_authorized_users():
+    # Pull the sheet into the local store, then serve membership from the store's copy
     global AUTHORIZED_USERS
-    AUTHORIZED_USERS = set()
-    user_ids = authorized_sheet.col_values(1)
+    authorized_sync.load()
     print(f"Fetched user IDs from GSheet done.")
-    for user_id in user_ids[1:]:
-        if user_id.strip():
-            try:
-                AUTHORIZED_USERS.add(int(user_id))
-            except ValueError:
-                print(f"Skipping invalid ID: {user_id}")
+    AUTHORIZED_USERS = store.authorized_ids(AUTHORIZED_SHEET_NAME)
     print(f"Loaded authorized users done.")
-def save_authorized_user(tg_id: int, po_id: str, username: str = None, first_name: str = None):
-    tg_ids = authorized_sheet.col_values(1)
-    if str(tg_id) in tg_ids:
-        row = tg_ids.index(str(tg_id)) + 1
-        authorized_sheet.update(f"B{row}", [[username or "Unknown"]])
-        authorized_sheet.update(f"C{row}", [[first_name or "Trader"]])
-        authorized_sheet.update(f"D{row}", [[po_id]])
+def refresh_authorized_users(added):
+    global AUTHORIZED_USERS
+    if added is None:
+        AUTHORIZED_USERS = store.authorized_ids(AUTHORIZED_SHEET_NAME)  # Edits or deletions: rebuild
     else:
-        authorized_sheet.append_row([tg_id, username or "Unknown", first_name or "Trader", po_id])
+        AUTHORIZED_USERS.update(added)
+authorized_writer = AuthorizedUserWriter(authorized_sheet, store, AUTHORIZED_SHEET_NAME)
+def save_authorized_user(tg_id: int, po_id: str, username: str = None, first_name: str = None):
+    authorized_writer.queue(tg_id, po_id, username, first_name)
     AUTHORIZED_USERS.add(tg_id)
     print(f"✅ Authorized user saved: TG ID {tg_id}, PO ID {po_id}")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global client
-    client = httpx.AsyncClient(timeout=10)
-    load_authorized_users()  # Load once on startup
+    client = create_client()
+    tg_dispatcher.client = client
+    update_queue.start()
+    if AUTHORIZED_USERS:
+        # Serve from the local copy right away and reconcile with the sheets in the background
+        run_sheets_in_background(load_authorized_users, "Reconciling authorized users")
+        run_sheets_in_background(deposit_index.load, "Reconciling deposit index")
+    else:
+        await run_sheets(load_authorized_users)  # First boot: nothing stored locally yet
+        await run_sheets(deposit_index.load)
     async def self_ping_loop():
         await asyncio.sleep(5)
         while True:
@@ -88,18 +89,52 @@ async def lifespan(app: FastAPI):
                 print("✅ Self-ping successful!")
             except Exception as e:
                 print(f"❌ Ping failed: {e}")
-            try:
-                load_authorized_users()  # Refresh the authorized users
-                print("🔄 Refreshed authorized users.")
-            except Exception as e:
-                print(f"❌ Failed to load authorized users: {e}")
             await asyncio.sleep(300)  # Wait 5 minutes
-    asyncio.create_task(self_ping_loop())
+    if INGESTION == "polling":
+        update_poller.start()
+    else:
+        asyncio.create_task(self_ping_loop())  # Keeps the webhook host awake; nothing to keep awake when polling
+    asyncio.create_task(authorized_sync.run(refresh_authorized_users))
+    asyncio.create_task(deposit_index.refresh_loop())
+    authorized_writer.requeue_dirty()
+    asyncio.create_task(authorized_writer.run())
     yield
+    await update_poller.stop()
+    await update_queue.stop()  # Finish acknowledged updates before the client closes
+    await authorized_writer.flush()  # Don't lose queued saves on shutdown
     await client.aclose()
+
+
+# Static replies, serialized once; only chat_id is added per request
+VERIFIED_MENU = StaticMessage(
+    text=(
+        "✅ You're verified!\n\n"
+        "👇 Pick a pair to get your signal:"
+    ),
+    reply_markup=static_keyboard(otc_pairs),
+)
+START_MENU = StaticMessage(
+    text="🎯 No guarantees. Just strategy.\n\n👇 Choose an OTC pair to begin:",
+    reply_markup=static_keyboard(otc_pairs),
+)
+NOT_AUTHORIZED_REPLY = StaticMessage(
+    text="❌ You are not authorized to use this command.\nPlease press /start to begin.",
+)
+UNKNOWN_COMMAND_REPLY = StaticMessage(
+    text=f"Unknown command. \n\nType /start.",
+)
+VERIFIED_MENU_2 = StaticMessage(
+    text=(
+        "✅ You are now verified and can access the bot fully.\n\n"
+        "👇 Please choose a pair to get signal:"
+    ),
+    reply_markup=static_keyboard(otc_pairs),
+)
+
+
 async def delayed_verification_check(client, SEND_MESSAGE, chat_id, po_id, user_id, user, save_authorized_user, otc_pairs):
     await asyncio.sleep(0.9)
-    dep = get_deposit_for_trader(po_id)
+    dep = await run_sheets(get_deposit_for_trader, po_id)
     if dep is None:
         keyboard = {
                 "inline_keyboard": [
@@ -115,23 +150,15 @@ async def delayed_verification_check(client, SEND_MESSAGE, chat_id, po_id, user_
             ),
             "reply_markup": keyboard
         }
-        await client.post(SEND_MESSAGE, json=payload)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
         return
     if dep >= 30:
         tg_id = user_id
         username = user.get("username")
         first_name = user.get("first_name")
         save_authorized_user(tg_id, po_id, username, first_name)
-        keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
-        payload = {
-            "chat_id": chat_id,
-            "text": (
-                "✅ You're verified!\n\n"
-                "👇 Pick a pair to get your signal:"
-            ),
-            "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-        }
-        await client.post(SEND_MESSAGE, json=payload)
+        payload = VERIFIED_MENU.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
         return
     keyboard = {
         "inline_keyboard": [
@@ -148,248 +175,248 @@ async def delayed_verification_check(client, SEND_MESSAGE, chat_id, po_id, user_
         ),
         "reply_markup": keyboard
     }
-    await client.post(SEND_MESSAGE, json=payload)
+    await tg_dispatcher.post(SEND_MESSAGE, json=payload)
 
 app = FastAPI(lifespan=lifespan)
 @app.api_route("/", methods=["GET", "HEAD"])
 async def healthcheck(request: Request):
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "duplicate_updates": recent_updates.duplicates,
+        "http_pool": pool_stats(client),
+        "telegram_failures": tg_dispatcher.failure_counts(),
+    }
 
 async def simulate_analysis(chat_id: int, pair: str, expiry: str):
     signal = random.choice(["↗️", "↘️"])  # Up or down signal
     final_text = f"{signal}"
     
-    await client.post(SEND_MESSAGE, json={
+    await tg_dispatcher.post(SEND_MESSAGE, json={
         "chat_id": chat_id,
         "text": final_text
     })
 
 
-@app.post("/webhook")
-async def webhook(request: Request, background_tasks: BackgroundTasks):
-    data = await request.json()
-    if msg := data.get("message"):
-        text = msg.get("text", "")
-        chat_id = msg["chat"]["id"]
-        user = msg["from"]
-        user_id = user["id"]
-        if user_id in ADMIN_IDS:
-            # Check if message contains video and caption
-            if "caption" in msg:
-                caption = msg["caption"]
-                button_options = [
-                    {"text": "🚀 Start Using the Bot", "url": os.getenv("BOT_LINK")},
-                    {"text": "✅ Get the Bot for Free", "url": os.getenv("BOT_LINK")},
-                    {"text": "🔥 Claim Your Free Bot", "url": os.getenv("BOT_LINK")},
-                    {"text": "⚡ Launch the Bot Now", "url": os.getenv("BOT_LINK")},
-                    {"text": "📈 Boost Trades with the Bot", "url": os.getenv("BOT_LINK")},
-                    {"text": "🤖 Try the Bot", "url": os.getenv("BOT_LINK")},
-                    {"text": "💼 Use the Bot Today", "url": os.getenv("BOT_LINK")},
-                    {"text": "🆓 Start Trading with the Bot", "url": os.getenv("BOT_LINK")},
-                    {"text": "👆 Tap Here to Get the Bot", "url": os.getenv("BOT_LINK")},
-                    {"text": "✨ Use the Bot", "url": os.getenv("BOT_LINK")},
-                    {"text": "📲 Grab the Bot", "url": os.getenv("BOT_LINK")},
-                ]
-                chosen_button = random.choice(button_options)
-                inline_keyboard = {
-                    "inline_keyboard": [[chosen_button]]
-                }
-            
-                if "video" in msg:
-                    media_file_id = msg["video"]["file_id"]
-                    media_type = "video"
-                    send_url = f"{API_BASE}/sendVideo"
-                    media_key = "video"
-                elif "photo" in msg:
-                    media_file_id = msg["photo"][-1]["file_id"]  # highest resolution photo
-                    media_type = "photo"
-                    send_url = f"{API_BASE}/sendPhoto"
-                    media_key = "photo"
-                else:
-                    return {"ok": False, "error": "No supported media type found"}
-            
-                payload = {
-                    "chat_id": -1002750311750,
-                    media_key: media_file_id,
-                    "caption": caption,
-                    "reply_markup": inline_keyboard,
-                    "parse_mode": "HTML"
-                }
-            
-                background_tasks.add_task(client.post, send_url, json=payload)
-                return {"ok": True}
-
-        
-        if text and text.startswith("/start"):
-            parts = text.split(" ")
-            start_payload = parts[1] if len(parts) > 1 else None
-            message = data.get("message", {})  
-            from_user = message.get("from", {}) 
-            full_name = from_user.get("first_name", "Trader")
-            username = from_user.get("username", "")
-            username_display = f"@{username}" if username else "No username"
-            user_id = from_user.get("id", "N/A")
-            tg_ids = authorized_sheet.col_values(1)
-            if user_id in AUTHORIZED_USERS:
-                keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
-                payload = {
-                    "chat_id": chat_id,
-                    "text": (
-                        "🎯 No guarantees. Just strategy.\n\n👇 Choose an OTC pair to begin:"
-                    ),
-                    "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-                }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            keyboard = {
-                "inline_keyboard": [
-                    [{"text": "📌 Registration Link", "url": pocketlink}],
-                ]
-            }
-            payload = {
-                "chat_id": chat_id,
-                "text": (
-                    f"👋 Hey {full_name}!\n\n"
-                    "To get started:\n"
-                    "1️⃣ Register using the official link (use a fresh email)\n"
-                    "2️⃣ Copy your Account ID\n"
-                    "3️⃣ Send your ID below to verify ✅"
-                ),
-                "reply_markup": keyboard
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-
-        
-        if text.isdigit() and len(text) > 5:
-            po_id = text.strip()
-            checking_steps = [
-                f"🔍 Checking {po_id}.",
-                f"🔍 Checking {po_id}..",
-                f"🔍 Checking {po_id}...",
-                f"✅ Checking {po_id} Done!"
-            ]
-            # Send first message and store message_id
-            resp = await client.post(SEND_MESSAGE, json={
-                "chat_id": chat_id,
-                "text": checking_steps[0]
-            })
-            message_id = resp.json().get("result", {}).get("message_id")
-            # Edit the message with animation steps
-            for step in checking_steps[1:]:
-                await asyncio.sleep(0.7)
-                await client.post(EDIT_MESSAGE, json={
-                    "chat_id": chat_id,
-                    "message_id": message_id,
-                    "text": step
-                })
-            # Wait briefly then delete the message
-            await asyncio.sleep(1.2)
-            await client.post(DELETE_MESSAGE, json={
+router = Router()
+
+
+@router.message(when=lambda update: update.user_id in ADMIN_IDS)
+async def forward_admin_media(update, background_tasks):
+    msg = update.message
+    if "caption" in msg:
+        caption = msg["caption"]
+        button_options = [
+            {"text": "🚀 Start Using the Bot", "url": os.getenv("BOT_LINK")},
+            {"text": "✅ Get the Bot for Free", "url": os.getenv("BOT_LINK")},
+            {"text": "🔥 Claim Your Free Bot", "url": os.getenv("BOT_LINK")},
+            {"text": "⚡ Launch the Bot Now", "url": os.getenv("BOT_LINK")},
+            {"text": "📈 Boost Trades with the Bot", "url": os.getenv("BOT_LINK")},
+            {"text": "🤖 Try the Bot", "url": os.getenv("BOT_LINK")},
+            {"text": "💼 Use the Bot Today", "url": os.getenv("BOT_LINK")},
+            {"text": "🆓 Start Trading with the Bot", "url": os.getenv("BOT_LINK")},
+            {"text": "👆 Tap Here to Get the Bot", "url": os.getenv("BOT_LINK")},
+            {"text": "✨ Use the Bot", "url": os.getenv("BOT_LINK")},
+            {"text": "📲 Grab the Bot", "url": os.getenv("BOT_LINK")},
+        ]
+        chosen_button = random.choice(button_options)
+        inline_keyboard = {
+            "inline_keyboard": [[chosen_button]]
+        }
+
+        if "video" in msg:
+            media_file_id = msg["video"]["file_id"]
+            media_type = "video"
+            send_url = f"{API_BASE}/sendVideo"
+            media_key = "video"
+        elif "photo" in msg:
+            media_file_id = msg["photo"][-1]["file_id"]  # highest resolution photo
+            media_type = "photo"
+            send_url = f"{API_BASE}/sendPhoto"
+            media_key = "photo"
+        else:
+            return {"ok": False, "error": "No supported media type found"}
+
+        payload = {
+            "chat_id": -1002750311750,
+            media_key: media_file_id,
+            "caption": caption,
+            "reply_markup": inline_keyboard,
+            "parse_mode": "HTML"
+        }
+
+        background_tasks.add_task(tg_dispatcher.post, send_url, json=payload, priority=BULK)
+        return {"ok": True}
+
+
+@router.message(prefix="/start")
+async def start(update, background_tasks):
+    text, chat_id, data = update.text, update.chat_id, update.data
+    parts = text.split(" ")
+    start_payload = parts[1] if len(parts) > 1 else None
+    message = data.get("message", {})  
+    from_user = message.get("from", {}) 
+    full_name = from_user.get("first_name", "Trader")
+    username = from_user.get("username", "")
+    username_display = f"@{username}" if username else "No username"
+    user_id = from_user.get("id", "N/A")
+    if user_id in AUTHORIZED_USERS:
+        payload = START_MENU.to(chat_id)
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    keyboard = {
+        "inline_keyboard": [
+            [{"text": "📌 Registration Link", "url": pocketlink}],
+        ]
+    }
+    payload = {
+        "chat_id": chat_id,
+        "text": (
+            f"👋 Hey {full_name}!\n\n"
+            "To get started:\n"
+            "1️⃣ Register using the official link (use a fresh email)\n"
+            "2️⃣ Copy your Account ID\n"
+            "3️⃣ Send your ID below to verify ✅"
+        ),
+        "reply_markup": keyboard
+    }
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(regex=r"\d{6,}")
+async def check_account_id(update, background_tasks):
+    text, chat_id, user, user_id = update.text, update.chat_id, update.user, update.user_id
+    po_id = text.strip()
+    checking_steps = [
+        f"🔍 Checking {po_id}.",
+        f"🔍 Checking {po_id}..",
+        f"🔍 Checking {po_id}...",
+        f"✅ Checking {po_id} Done!"
+    ]
+    if update_queue.mode < NO_ANIMATIONS:  # Purely cosmetic, so it goes first when shedding load
+        # Send first message and store message_id
+        resp = await tg_dispatcher.post(SEND_MESSAGE, json={
+            "chat_id": chat_id,
+            "text": checking_steps[0]
+        })
+        message_id = fast_json.loads(resp.content).get("result", {}).get("message_id")
+        # Edit the message with animation steps
+        for step in checking_steps[1:]:
+            await asyncio.sleep(0.7)
+            await tg_dispatcher.post(EDIT_MESSAGE, json={
                 "chat_id": chat_id,
-                "message_id": message_id
+                "message_id": message_id,
+                "text": step
             })
-            
-            existing_po_ids = authorized_sheet.col_values(4)
-            if po_id in existing_po_ids:
-                keyboard = {
-                    "inline_keyboard": [
-                        [{"text": "📌 Registration Link", "url": pocketlink}],
-                    ]
-                }
-                payload = {
-                    "chat_id": chat_id,
-                    "text": (
-                        "⚠️ That Account ID is already in use.\n\n"
-                        "To continue:\n"
-                        "1️⃣ Register again with a fresh email using our official link\n"
-                        "2️⃣ Copy your new Account ID\n"
-                        "3️⃣ Send it below to get verified ✅"
-                    ),
-                    "reply_markup": keyboard
-                }
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            background_tasks.add_task(
-                delayed_verification_check,
-                client, SEND_MESSAGE, chat_id, po_id, user_id, user, save_authorized_user, otc_pairs
-            )
-            return {"ok": True}
-            
-
-##############################################################################################################################################
-         # Handle OTC Pair Selection
-        if text in otc_pairs:
-            tg_ids = authorized_sheet.col_values(1)
-            full_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-            username = user.get("username")
-            username_display = f"@{username}" if username else "Not set"
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "❌ You are not authorized to use this command.\nPlease press /start to begin."
-                }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            inline_kb = [
-                [{"text": expiry_options[i], "callback_data": f"expiry|{text}|{expiry_options[i]}"} 
-                 for i in range(row, row + 3)]
-                for row in range(0, len(expiry_options), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": f"Please Select Time to Trade:",
-                "reply_markup": {"inline_keyboard": inline_kb}}
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-##############################################################################################################################################
+        # Wait briefly then delete the message
+        await asyncio.sleep(1.2)
+        await tg_dispatcher.post(DELETE_MESSAGE, json={
+            "chat_id": chat_id,
+            "message_id": message_id
+        })
+
+    po_id_owner = store.po_id_owner(AUTHORIZED_SHEET_NAME, po_id)
+    if po_id_owner is not None:
+        print(f"⚠️ PO ID {po_id} already claimed by TG ID {po_id_owner} (requested by {user_id})")
+        keyboard = {
+            "inline_keyboard": [
+                [{"text": "📌 Registration Link", "url": pocketlink}],
+            ]
+        }
         payload = {
             "chat_id": chat_id,
-            "text": f"Unknown command. \n\nType /start."}
-        background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
+            "text": (
+                "⚠️ That Account ID is already in use.\n\n"
+                "To continue:\n"
+                "1️⃣ Register again with a fresh email using our official link\n"
+                "2️⃣ Copy your new Account ID\n"
+                "3️⃣ Send it below to get verified ✅"
+            ),
+            "reply_markup": keyboard
+        }
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
         return {"ok": True}
-##############################################################################################################################################
-    if cq := data.get("callback_query"):
-        data_str = cq.get("data", "")
-        chat_id = cq["message"]["chat"]["id"]
-        message_id = cq["message"]["message_id"]
-        cq_id = cq.get("id")
-        background_tasks.add_task(client.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": cq_id})
-        background_tasks.add_task(client.post, DELETE_MESSAGE, json={"chat_id": chat_id, "message_id": message_id})
-        
-        if data_str == "check_deposit":
-            payload = {
-                "chat_id": chat_id,
-                "text": "Please send your Account ID (numbers only)."
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-            from_user = cq.get("from", {})
-            tg_id = from_user.get("id")
-            username = from_user.get("username")
-            first_name = from_user.get("first_name")
-            save_authorized_user(tg_id, po_id, username, first_name)
-            keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
-            payload = {
-                    "chat_id": chat_id,
-                    "text": (
-                        "✅ You are now verified and can access the bot fully.\n\n"
-                        "👇 Please choose a pair to get signal:"
-                    ),
-                    "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-             # Schedule delayed check
-            background_tasks.add_task(
-                delayed_verification_check,
-                client, SEND_MESSAGE, chat_id, po_id, user_id, user, save_authorized_user, otc_pairs
-            )
-            return {"ok": True}
-
-        _, pair, expiry = data_str.split("|", 2)
-        background_tasks.add_task(simulate_analysis, chat_id, pair, expiry)
+    background_tasks.add_task(
+        delayed_verification_check,
+        client, SEND_MESSAGE, chat_id, po_id, user_id, user, save_authorized_user, otc_pairs
+    )
+    return {"ok": True}
+
+
+@router.message(text=otc_pairs)
+async def choose_pair(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    if user_id not in AUTHORIZED_USERS:
+        payload = NOT_AUTHORIZED_REPLY.to(chat_id)
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    inline_kb = [
+        [{"text": expiry_options[i], "callback_data": f"expiry|{text}|{expiry_options[i]}"} 
+         for i in range(row, row + 3)]
+        for row in range(0, len(expiry_options), 3)]
+    payload = {
+        "chat_id": chat_id,
+        "text": f"Please Select Time to Trade:",
+        "reply_markup": {"inline_keyboard": inline_kb}}
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(fallback=True)
+async def unknown_command(update, background_tasks):
+    if update_queue.mode >= ESSENTIAL_ONLY:
         return {"ok": True}
+    chat_id = update.chat_id
+    payload = UNKNOWN_COMMAND_REPLY.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.callback(data="check_deposit")
+async def check_deposit(update, background_tasks):
+    chat_id = update.chat_id
+    payload = {
+        "chat_id": chat_id,
+        "text": "Please send your Account ID (numbers only)."
+    }
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
 
-        if __name__ == "__main__":
-            import uvicorn
-            port = int(os.environ.get("PORT", 10000))
-            uvicorn.run("app:app", host="0.0.0.0", port=port)
+@router.callback(fallback=True)
+async def choose_expiry(update, background_tasks):
+    chat_id, data_str = update.chat_id, update.callback_data
+    _, pair, expiry = data_str.split("|", 2)
+    background_tasks.add_task(simulate_analysis, chat_id, pair, expiry)
+    return {"ok": True}
+
+
+async def handle_update(update):
+    background_tasks = BackgroundTasks()
+    if update.callback_query:
+        # Acknowledge the button press and remove the menu it came from
+        background_tasks.add_task(tg_dispatcher.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": update.callback_query.get("id")})
+        background_tasks.add_task(tg_dispatcher.post, DELETE_MESSAGE, json={"chat_id": update.chat_id, "message_id": update.message_id})
+    await router.dispatch(update, background_tasks)
+    await background_tasks()  # Here rather than after a response, so the chat's next update waits for these sends
+
+
+update_queue = UpdateQueue(handle_update)
+
+
+def receive(data):
+    # Queues an update for the worker pool, which handles it in order within its chat
+    if recent_updates.seen(data):
+        return  # A redelivery of an update that is already queued or handled
+    update = Update(data)
+    update_queue.put(update.chat_id, update)
+    recent_updates.record(data)
+
+
+update_poller = UpdatePoller(tg_dispatcher, API_BASE, receive, update_queue)
+
+
+@app.post("/webhook")
+async def webhook(request: Request):
+    receive(fast_json.loads(await request.body()))
+    return {"ok": True}  # Acknowledged at once, before the update is handled
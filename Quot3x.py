@@ -1,11 +1,9 @@
 from fastapi import FastAPI
 from typing import Optional
-import gspread
-import json
 import httpx
 import asyncio
-from oauth2client.service_account import ServiceAccountCredentials
-import os
+from sheets_session import open_worksheet
+from sheet_cache import DepositAccumulator
 
 # Constants
 RENDER_URL = "https://jamespocket2-c99h.onrender.com"
@@ -27,24 +25,16 @@ async def lifespan(app: FastAPI):
             await asyncio.sleep(300)  # every 5 minutes
 
     asyncio.create_task(self_ping_loop())
+    asyncio.create_task(deposit_accumulator.run())
     yield
+    await deposit_accumulator.flush()
     await ping_client.aclose()
 
 # Initialize FastAPI app
 app = FastAPI(lifespan=lifespan)
 
-# Google Sheets authorization
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive"
-]
-
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-gs_creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-gs_client = gspread.authorize(gs_creds)
-spreadsheet = gs_client.open(SPREADSHEET_NAME)
-quotex_sheet = spreadsheet.worksheet(WORKSHEET_NAME)
+quotex_sheet = open_worksheet(SPREADSHEET_NAME, WORKSHEET_NAME)
+deposit_accumulator = DepositAccumulator(quotex_sheet)
 
 @app.get("/")
 def root():
@@ -67,26 +57,17 @@ async def quotex_webhook(
         deposit = 0.0
 
     try:
-        cell = quotex_sheet.find(str(uid))
-
-        if cell is None:
-            raise ValueError("User not found")
-
-        row = cell.row
-        current_total = quotex_sheet.cell(row, 2).value or "0"
-        updated_total = float(current_total) + deposit
-
-        quotex_sheet.update_cell(row, 2, str(updated_total))
+        status, row = await deposit_accumulator.submit(uid, [uid, deposit], increments={2: deposit})
 
-        print(f"✅ Updated Quotex user {uid}: total={updated_total}")
-        return {
-            "status": "updated",
-            "user_id": uid,
-            "total": updated_total
-        }
+        if status == "updated":
+            updated_total = row[1]
+            print(f"✅ Updated Quotex user {uid}: total={updated_total}")
+            return {
+                "status": "updated",
+                "user_id": uid,
+                "total": updated_total
+            }
 
-    except (ValueError, gspread.exceptions.GSpreadException):
-        quotex_sheet.append_row([uid, deposit])
         print(f"🆕 Registered new Quotex user {uid}")
         return {
             "status": "registered",
@@ -1,11 +1,9 @@
 from fastapi import FastAPI
 from typing import Optional
-import gspread
-import json
 import httpx
 import asyncio
-from oauth2client.service_account import ServiceAccountCredentials
-import os
+from sheets_session import open_worksheet
+from sheet_cache import DepositAccumulator
 
 # Constants
 RENDER_URL = "https://jamespocket2.onrender.com"
@@ -27,24 +25,16 @@ async def lifespan(app: FastAPI):
             await asyncio.sleep(300)  # every 5 minutes
 
     asyncio.create_task(self_ping_loop())
+    asyncio.create_task(deposit_accumulator.run())
     yield
+    await deposit_accumulator.flush()
     await ping_client.aclose()
 
 # Initialize FastAPI app
 app = FastAPI(lifespan=lifespan)
 
-# Google Sheets authorization
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive"
-]
-
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-gs_creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-gs_client = gspread.authorize(gs_creds)
-spreadsheet = gs_client.open(SPREADSHEET_NAME)
-sheet = spreadsheet.worksheet(WORKSHEET_NAME)
+sheet = open_worksheet(SPREADSHEET_NAME, WORKSHEET_NAME)
+deposit_accumulator = DepositAccumulator(sheet)
 
 @app.get("/")
 def root():
@@ -70,29 +60,18 @@ async def webhook(
         deposit = 0.0
 
     try:
-        # Try to find the trader ID in the sheet
-        cell = sheet.find(str(trader_id))
-
-        if cell is None:
-            raise ValueError("Trader not found")
-
-        row = cell.row
-        current_total = sheet.cell(row, 2).value or "0"
-        updated_total = float(current_total) + deposit
-
-        # Update only total deposit
-        sheet.update_cell(row, 2, str(updated_total))
-
-        print(f"✅ Updated trader {trader_id}: totaldep={updated_total}")
-        return {
-            "status": "updated",
-            "trader_id": trader_id,
-            "totaldep": updated_total
-        }
-
-    except (ValueError, gspread.exceptions.GSpreadException):
-        # Trader not found — register new
-        sheet.append_row([trader_id, deposit])
+        status, row = await deposit_accumulator.submit(trader_id, [trader_id, deposit], increments={2: deposit})
+
+        if status == "updated":
+            updated_total = row[1]
+            print(f"✅ Updated trader {trader_id}: totaldep={updated_total}")
+            return {
+                "status": "updated",
+                "trader_id": trader_id,
+                "totaldep": updated_total
+            }
+
+        # Trader not found — registered new
         print(f"🆕 Registered new trader {trader_id}")
         return {
             "status": "registered",
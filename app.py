@@ -1,13 +1,22 @@
 import os
-import httpx
 import asyncio
 import random
-import json
-import gspread
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, BackgroundTasks
 from contextlib import asynccontextmanager
-from oauth2client.service_account import ServiceAccountCredentials
+from sheets_session import open_worksheet
+from sheets_async import AsyncWorksheet, run_sheets, run_sheets_in_background
+from local_store import load_snapshot, save_snapshot
+import fast_json
+from tg_router import Router, Update
+from update_dedup import RecentUpdates
+from tg_polling import UpdatePoller, INGESTION
+from update_queue import UpdateQueue, NO_ANIMATIONS, NO_LOGS, ESSENTIAL_ONLY
+from tg_dispatch import TelegramDispatcher
+from tg_payloads import StaticMessage, static_keyboard
+from tg_http import create_client, pool_stats
+from log_digest import LogDigest
+from tg_animation import EditAnimation
 load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(",")))
@@ -19,24 +28,26 @@ EDIT_MESSAGE = f"{API_BASE}/editMessageText"
 DELETE_MESSAGE = f"{API_BASE}/deleteMessage"
 RENDER_URL = "https://jamespocket2-k9lz.onrender.com"
 client = None
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-spreadsheet = client.open("TelegramBotMembers")
-sheet = spreadsheet.worksheet("Sheet5")
+tg_dispatcher = TelegramDispatcher()
+recent_updates = RecentUpdates()
+log_digest = LogDigest(tg_dispatcher, SEND_MESSAGE)
+sheet = open_worksheet("TelegramBotMembers", "Sheet5")
+AUTHORIZED_SNAPSHOT = "TelegramBotMembers-Sheet5"
+sheet_async = AsyncWorksheet(sheet)
 tg_channel = "t.me/ZentraAiRegister"
 def load_authorized_users():
     global AUTHORIZED_USERS
-    AUTHORIZED_USERS = set()
+    users = set()
     user_ids = sheet.col_values(1)
     print(f"Fetched user IDs from GSheet: {user_ids}")
     for user_id in user_ids[1:]:
         if user_id.strip():
             try:
-                AUTHORIZED_USERS.add(int(user_id))
+                users.add(int(user_id))
             except ValueError:
                 print(f"Skipping invalid ID: {user_id}")
+    AUTHORIZED_USERS = users
+    save_snapshot(AUTHORIZED_SNAPSHOT, sorted(users))
     print(f"Loaded authorized users: {AUTHORIZED_USERS}")
 def save_users():
     user_ids = sheet.col_values(1)
@@ -57,7 +68,7 @@ def save_users():
         else:
             sheet.append_row([user_id, tg_username, tg_name, pocket_option_id])
     print("✅ Users saved successfully!")
-load_authorized_users()
+AUTHORIZED_USERS = set(load_snapshot(AUTHORIZED_SNAPSHOT, []))
 otc_pairs = [
     "AED/CNY OTC", "AUD/CAD OTC", "BHD/CNY OTC", "EUR/USD OTC", "GBP/USD OTC", "AUD/NZD OTC",
     "NZD/USD OTC", "EUR/JPY OTC", "CAD/JPY OTC", "AUD/USD OTC",  "AUD/CHF OTC", "GBP/AUD OTC"]
@@ -65,7 +76,15 @@ expiry_options = ["S5", "S10", "S15", "S30", "M1", "M2"]
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global client
-    client = httpx.AsyncClient(timeout=10)
+    client = create_client()
+    tg_dispatcher.client = client
+    update_queue.start()
+    asyncio.create_task(log_digest.run())
+    if AUTHORIZED_USERS:
+        # Serve from the last snapshot right away and reconcile with the sheet in the background
+        run_sheets_in_background(load_authorized_users, "Reconciling authorized users")
+    else:
+        await run_sheets(load_authorized_users)  # First boot: no snapshot yet
     async def self_ping_loop():
         await asyncio.sleep(5)
         while True:
@@ -75,13 +94,24 @@ async def lifespan(app: FastAPI):
             except Exception as e:
                 print(f"❌ Ping failed: {e}")
             await asyncio.sleep(300)
-    asyncio.create_task(self_ping_loop())
+    if INGESTION == "polling":
+        update_poller.start()
+    else:
+        asyncio.create_task(self_ping_loop())  # Keeps the webhook host awake; nothing to keep awake when polling
     yield
+    await update_poller.stop()
+    await update_queue.stop()  # Finish acknowledged updates before the client closes
+    await log_digest.flush()  # Send whatever is still buffered
     await client.aclose()  # Clean up
 app = FastAPI(lifespan=lifespan)
 @app.api_route("/", methods=["GET", "HEAD"])
 async def healthcheck(request: Request):
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "duplicate_updates": recent_updates.duplicates,
+        "http_pool": pool_stats(client),
+        "telegram_failures": tg_dispatcher.failure_counts(),
+    }
 
 
 
@@ -98,221 +128,268 @@ async def simulate_analysis(chat_id: int, pair: str, expiry: str):
         f"🤖 You selected {pair} ☑️\n\n⌛ Time: {expiry}\n\n📉 Calculating signal..",
         f"🤖 You selected {pair} ☑️\n\n⏳ Time: {expiry}\n\n📈 Calculating signal...",
         f"🤖 You selected {pair} ✅\n\n⌛ Time: {expiry}\n\n✅ Analysis complete."]
-    resp = await client.post(SEND_MESSAGE, json={"chat_id": chat_id, "text": analysis_steps[0]})
-    message_id = resp.json().get("result", {}).get("message_id")
-    for step in analysis_steps[1:]:
-        await client.post(EDIT_MESSAGE, json={
-            "chat_id": chat_id,
-            "message_id": message_id,
-            "text": step})
     signal = random.choice(["↗️", "↘️"])
     final_text = f"{signal}"
-    await client.post(EDIT_MESSAGE, json={
+    if update_queue.mode >= NO_ANIMATIONS:
+        # Shedding load: skip the animation and send only the result
+        await tg_dispatcher.post(SEND_MESSAGE, json={"chat_id": chat_id, "text": final_text})
+        return
+    resp = await tg_dispatcher.post(SEND_MESSAGE, json={"chat_id": chat_id, "text": analysis_steps[0]})
+    message_id = fast_json.loads(resp.content).get("result", {}).get("message_id")
+    animation = EditAnimation(tg_dispatcher, EDIT_MESSAGE, chat_id, message_id, final_in=0.2 * len(analysis_steps))
+    for step in analysis_steps[1:]:
+        await asyncio.sleep(0.2)
+        await animation.frame(step)
+    await asyncio.sleep(0.2)
+    await animation.finish(final_text)
+
+
+# Static replies, serialized once; only chat_id is added per request
+REGISTRATION_REPLY = StaticMessage(
+    text=(
+        "You don't have access to use this bot yet.\n\n"
+        f"To get verified:\n\nJoin {tg_channel} and tap the 📌 Pinned message to register."
+    ),
+    parse_mode="Markdown",
+)
+START_MENU = StaticMessage(
+    text=(
+        "⚠️ Not financial advice. ⚠️ \n\nTrading is risky - play smart, play sharp.\n"
+        "If you’re here to win, let’s make it worth it.\n\n"
+        "👇 Pick an OTC pair and let’s go get it:"
+    ),
+    parse_mode="Markdown",
+    reply_markup=static_keyboard(otc_pairs),
+)
+NOT_VERIFIED_REPLY = StaticMessage(
+    text="⚠️ You need to get verified to use this bot.\nMessage my support to gain access!",
+)
+ADDMEMBER_USAGE_REPLY = StaticMessage(
+    text="⚠️ Usage: /addmember <user_id> <pocket_option_id>",
+)
+NOT_AUTHORIZED_REPLY = StaticMessage(
+    text="❌ You are not authorized to use this command.",
+)
+INVALID_USER_ID_REPLY = StaticMessage(
+    text="⚠️ Invalid user ID. Please enter a valid number.",
+)
+REMOVEMEMBER_USAGE_REPLY = StaticMessage(
+    text="⚠️ Usage: /removemember <user_id>",
+)
+USER_NOT_FOUND_REPLY = StaticMessage(
+    text="⚠️ User ID not found in the list.",
+)
+UNKNOWN_COMMAND_REPLY = StaticMessage(
+    text=f"Unknown command. \nClick this 👉 /start.",
+)
+
+
+router = Router()
+
+
+@router.message(text="/start")
+async def start(update, background_tasks):
+    chat_id, user, user_id = update.chat_id, update.user, update.user_id
+    full_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
+    username = user.get("username")
+    username_display = f"@{username}" if username else "Not set"
+    if user_id not in AUTHORIZED_USERS:
+        payload = REGISTRATION_REPLY.to(chat_id)
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        admin_payload = {
+        "chat_id": -1002294677733, 
+        "text": f"✅ User Started\n\n"
+                f"*Full Name:* {full_name}\n"
+                f"*Username:* {username_display}\n"
+                f"*Telegram ID:* `{user_id}`",
+        "parse_mode": "Markdown"}
+        log_digest.add(admin_payload)
+        return {"ok": True}
+    payload = START_MENU.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    admin_payload = {
+        "chat_id": -1002294677733, 
+        "text": f"✅ User Started\n\n"
+                f"*Full Name:* {full_name}\n"
+                f"*Username:* {username_display}\n"
+                f"*Telegram ID:* `{user_id}`",
+        "parse_mode": "Markdown"}
+    log_digest.add(admin_payload)
+    return {"ok": True}
+
+
+@router.message(text=otc_pairs)
+async def choose_pair(update, background_tasks):
+    text, chat_id, user, user_id = update.text, update.chat_id, update.user, update.user_id
+    full_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
+    username = user.get("username")
+    username_display = f"@{username}" if username else "Not set"
+    if user_id not in AUTHORIZED_USERS:
+        payload = NOT_VERIFIED_REPLY.to(chat_id)
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    inline_kb = [
+        [{"text": expiry_options[i], "callback_data": f"expiry|{text}|{expiry_options[i]}"} 
+         for i in range(row, row + 3)]
+        for row in range(0, len(expiry_options), 3)]
+    payload = {
         "chat_id": chat_id,
-        "message_id": message_id,
-        "text": final_text})
+        "text": f"🤖 You selected {text} ☑️\n\n⌛ Select Time:",
+        "reply_markup": {"inline_keyboard": inline_kb}}
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    pair_payload = {
+        "chat_id": -1002294677733, 
+        "text": (
+            "📊 *User Trade Action*\n\n"
+            f"*Full Name:* {full_name}\n"
+            f"*Username:* {username_display}\n"
+            f"*Telegram ID:* `{user_id}`\n"
+            f"*Selected Pair:* {text}"
+        ),
+        "parse_mode": "Markdown"}
+    log_digest.add(pair_payload)
 
+    return {"ok": True}
 
 
+@router.message(prefix=("/addmember", "/add"))
+async def add_member(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    parts = text.strip().split()
+    if len(parts) < 3:
+        payload = ADDMEMBER_USAGE_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    if user_id not in ADMIN_IDS:
+        payload = NOT_AUTHORIZED_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    try:
+        new_user_id = int(parts[1])
+        pocket_option_id = parts[2]
+        AUTHORIZED_USERS.add(new_user_id)
+        save_snapshot(AUTHORIZED_SNAPSHOT, sorted(AUTHORIZED_USERS))
 
-@app.post("/webhook")
-async def webhook(request: Request, background_tasks: BackgroundTasks):
-    data = await request.json()
-    # --- HANDLE NORMAL TEXT MESSAGES ---
-    if msg := data.get("message"):
-        text = msg.get("text", "")
-        chat_id = msg["chat"]["id"]
-        user = msg["from"]
-        user_id = user["id"]
-        # Handle /start
-        if text == "/start":
-            full_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-            username = user.get("username")
-            username_display = f"@{username}" if username else "Not set"
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": (
-                        "You don't have access to use this bot yet.\n\n"
-                        f"To get verified:\n\nJoin {tg_channel} and tap the 📌 Pinned message to register."),
-                    "parse_mode": "Markdown"}
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                admin_payload = {
-                "chat_id": -1002294677733, 
-                "text": f"✅ User Started\n\n"
-                        f"*Full Name:* {full_name}\n"
-                        f"*Username:* {username_display}\n"
-                        f"*Telegram ID:* `{user_id}`",
-                "parse_mode": "Markdown"}
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=admin_payload)
-                return {"ok": True}
-            keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": (
-                    "⚠️ Not financial advice. ⚠️ \n\nTrading is risky - play smart, play sharp.\n"
-                    "If you’re here to win, let’s make it worth it.\n\n"
-                    "👇 Pick an OTC pair and let’s go get it:"),
-                "parse_mode": "Markdown",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}}
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            admin_payload = {
-                "chat_id": -1002294677733, 
-                "text": f"✅ User Started\n\n"
-                        f"*Full Name:* {full_name}\n"
-                        f"*Username:* {username_display}\n"
-                        f"*Telegram ID:* `{user_id}`",
-                "parse_mode": "Markdown"}
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=admin_payload)
-            return {"ok": True}
-
-        # Handle OTC Pair Selection
-        if text in otc_pairs:
-            full_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-            username = user.get("username")
-            username_display = f"@{username}" if username else "Not set"
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nMessage my support to gain access!"}
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            inline_kb = [
-                [{"text": expiry_options[i], "callback_data": f"expiry|{text}|{expiry_options[i]}"} 
-                 for i in range(row, row + 3)]
-                for row in range(0, len(expiry_options), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": f"🤖 You selected {text} ☑️\n\n⌛ Select Time:",
-                "reply_markup": {"inline_keyboard": inline_kb}}
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            pair_payload = {
-                "chat_id": -1002294677733, 
-                "text": (
-                    "📊 *User Trade Action*\n\n"
-                    f"*Full Name:* {full_name}\n"
-                    f"*Username:* {username_display}\n"
-                    f"*Telegram ID:* `{user_id}`\n"
-                    f"*Selected Pair:* {text}"
-                ),
-                "parse_mode": "Markdown"}
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=pair_payload)
-
-            return {"ok": True}
-
-        # Handle /addmember
-        if text.startswith(("/addmember", "/add")):
-            parts = text.strip().split()
-            if len(parts) < 3:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ Usage: /addmember <user_id> <pocket_option_id>"}
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            if user_id not in ADMIN_IDS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "❌ You are not authorized to use this command."}
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            try:
-                new_user_id = int(parts[1])
-                pocket_option_id = parts[2]
-                AUTHORIZED_USERS.add(new_user_id)
-            
-                try:
-                    resp = await client.get(f"{API_BASE}/getChat", params={"chat_id": new_user_id})
-                    user_info = resp.json().get("result", {})
-                    username = user_info.get("username", "Unknown")
-                    first_name = user_info.get("first_name", "Trader")
-                except Exception as e:
-                    print(f"⚠️ Failed to fetch user info: {e}")
-                    username = "Unknown"
-                    first_name = "Trader"
-            
-                # Prepare full name and username display
-                full_name = first_name
-                username_display = f"@{username}" if username != "Unknown" else "No username"
-            
-                user_ids = sheet.col_values(1)
-                user_id_str = str(new_user_id)
-                if user_id_str in user_ids:
-                    row_number = user_ids.index(user_id_str) + 1
-                    sheet.update(f"B{row_number}", [[username]])
-                    sheet.update(f"C{row_number}", [[first_name]])
-                    sheet.update(f"D{row_number}", [[pocket_option_id]])
-                else:
-                    sheet.append_row([new_user_id, username, first_name, pocket_option_id])
-            
-                payload = {
-                    "chat_id": chat_id,
-                    "text": f"✅ Added Successful!\n\n{full_name} | {username_display} | {new_user_id} \n added with Pocket Option ID: {pocket_option_id}"
-                }
-                await client.post(SEND_MESSAGE, json=payload)
+        try:
+            resp = await tg_dispatcher.post(f"{API_BASE}/getChat", json={"chat_id": new_user_id})
+            user_info = fast_json.loads(resp.content).get("result", {})
+            username = user_info.get("username", "Unknown")
+            first_name = user_info.get("first_name", "Trader")
+        except Exception as e:
+            print(f"⚠️ Failed to fetch user info: {e}")
+            username = "Unknown"
+            first_name = "Trader"
+
+        # Prepare full name and username display
+        full_name = first_name
+        username_display = f"@{username}" if username != "Unknown" else "No username"
+
+        user_ids = await sheet_async.col_values(1)
+        user_id_str = str(new_user_id)
+        if user_id_str in user_ids:
+            row_number = user_ids.index(user_id_str) + 1
+            await sheet_async.update(f"B{row_number}", [[username]])
+            await sheet_async.update(f"C{row_number}", [[first_name]])
+            await sheet_async.update(f"D{row_number}", [[pocket_option_id]])
+        else:
+            await sheet_async.append_row([new_user_id, username, first_name, pocket_option_id])
 
-            except ValueError:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ Invalid user ID. Please enter a valid number."}
-                await client.post(SEND_MESSAGE, json=payload)
-            return {"ok": True}
-
-        # Handle /removemember
-        if text.startswith(("/removemember", "/remove")):
-            if user_id not in ADMIN_IDS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nMessage my support to gain access!"}
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            parts = text.strip().split()
-            if len(parts) < 2:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ Usage: /removemember <user_id>"}
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            try:
-                remove_user_id = str(parts[1])
-                user_ids = sheet.col_values(1)
-                if remove_user_id in user_ids:
-                    row = user_ids.index(remove_user_id) + 1
-                    sheet.delete_rows(row)
-                    AUTHORIZED_USERS.discard(int(remove_user_id))
-                    payload = {
-                        "chat_id": chat_id,
-                        "text": f"✅ User {remove_user_id} has been removed successfully."}
-                else:
-                    payload = {
-                        "chat_id": chat_id,
-                        "text": "⚠️ User ID not found in the list."}
-            except ValueError:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ Invalid user ID. Please enter a valid number."}
-            await client.post(SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        
-        # Fallback for any other message
         payload = {
             "chat_id": chat_id,
-            "text": f"Unknown command. \nClick this 👉 /start."}
-        background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
+            "text": f"✅ Added Successful!\n\n{full_name} | {username_display} | {new_user_id} \n added with Pocket Option ID: {pocket_option_id}"
+        }
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+
+    except ValueError:
+        payload = INVALID_USER_ID_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(prefix=("/removemember", "/remove"))
+async def remove_member(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    if user_id not in ADMIN_IDS:
+        payload = NOT_VERIFIED_REPLY.to(chat_id)
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    parts = text.strip().split()
+    if len(parts) < 2:
+        payload = REMOVEMEMBER_USAGE_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
         return {"ok": True}
+    try:
+        remove_user_id = str(parts[1])
+        user_ids = await sheet_async.col_values(1)
+        if remove_user_id in user_ids:
+            row = user_ids.index(remove_user_id) + 1
+            await sheet_async.delete_rows(row)
+            AUTHORIZED_USERS.discard(int(remove_user_id))
+            save_snapshot(AUTHORIZED_SNAPSHOT, sorted(AUTHORIZED_USERS))  # Or a restart would authorize them again
+            payload = {
+                "chat_id": chat_id,
+                "text": f"✅ User {remove_user_id} has been removed successfully."}
+        else:
+            payload = USER_NOT_FOUND_REPLY.to(chat_id)
+    except ValueError:
+        payload = INVALID_USER_ID_REPLY.to(chat_id)
+    await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
 
-    # --- HANDLE CALLBACKS ---
-    if cq := data.get("callback_query"):
-        data_str = cq.get("data", "")
-        chat_id = cq["message"]["chat"]["id"]
-        message_id = cq["message"]["message_id"]
-        cq_id = cq.get("id")
-        background_tasks.add_task(client.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": cq_id})
-        background_tasks.add_task(client.post, DELETE_MESSAGE, json={"chat_id": chat_id, "message_id": message_id})
-        _, pair, expiry = data_str.split("|", 2)
-        background_tasks.add_task(simulate_analysis, chat_id, pair, expiry)
+@router.message(fallback=True)
+async def unknown_command(update, background_tasks):
+    if update_queue.mode >= ESSENTIAL_ONLY:
         return {"ok": True}
+    chat_id = update.chat_id
+    payload = UNKNOWN_COMMAND_REPLY.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.callback(fallback=True)
+async def choose_expiry(update, background_tasks):
+    chat_id, data_str = update.chat_id, update.callback_data
+    _, pair, expiry = data_str.split("|", 2)
+    background_tasks.add_task(simulate_analysis, chat_id, pair, expiry)
     return {"ok": True}
 
+
+async def handle_update(update):
+    background_tasks = BackgroundTasks()
+    if update.callback_query:
+        # Acknowledge the button press and remove the menu it came from
+        background_tasks.add_task(tg_dispatcher.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": update.callback_query.get("id")})
+        background_tasks.add_task(tg_dispatcher.post, DELETE_MESSAGE, json={"chat_id": update.chat_id, "message_id": update.message_id})
+    await router.dispatch(update, background_tasks)
+    await background_tasks()  # Here rather than after a response, so the chat's next update waits for these sends
+
+
+def shed_load(mode):
+    log_digest.paused = mode >= NO_LOGS
+
+
+update_queue = UpdateQueue(handle_update, on_mode_change=shed_load)
+
+
+def receive(data):
+    # Queues an update for the worker pool, which handles it in order within its chat
+    if recent_updates.seen(data):
+        return  # A redelivery of an update that is already queued or handled
+    update = Update(data)
+    update_queue.put(update.chat_id, update)
+    recent_updates.record(data)
+
+
+update_poller = UpdatePoller(tg_dispatcher, API_BASE, receive, update_queue)
+
+
+@app.post("/webhook")
+async def webhook(request: Request):
+    receive(fast_json.loads(await request.body()))
+    return {"ok": True}  # Acknowledged at once, before the update is handled
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 10000))
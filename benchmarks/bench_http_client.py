@@ -0,0 +1,155 @@
+"""Compare the default httpx client with the tuned Bot API client from tg_http.
+
+Starts a local stub Bot API (HTTP/1.1 and cleartext HTTP/2 on separate ports) that answers every
+sendMessage after a fixed delay, then fires a burst of concurrent posts through each client and
+reports throughput, latency percentiles and how many sockets the server saw.
+
+    python benchmarks/bench_http_client.py [--requests 1000] [--concurrency 200] [--latency 0.03]
+
+HTTP/2 needs the optional h2 package (pip install "httpx[http2]").
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from tg_http import create_client, pool_stats
+
+RESPONSE = json.dumps({"ok": True, "result": {"message_id": 1}}).encode()
+
+
+class StubBotAPI:
+    def __init__(self, latency):
+        self.latency = latency
+        self.connections = 0
+
+    async def handle_http1(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                await asyncio.sleep(self.latency)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                    + f"content-length: {len(RESPONSE)}\r\n\r\n".encode() + RESPONSE
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_http2(self, reader, writer):
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        self.connections += 1
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+
+        async def respond(stream_id):
+            await asyncio.sleep(self.latency)
+            conn.send_headers(stream_id, [
+                (":status", "200"), ("content-type", "application/json"), ("content-length", str(len(RESPONSE))),
+            ])
+            conn.send_data(stream_id, RESPONSE, end_stream=True)
+            writer.write(conn.data_to_send())
+
+        try:
+            while True:
+                data = await reader.read(65535)
+                if not data:
+                    break
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.DataReceived):
+                        conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        asyncio.create_task(respond(event.stream_id))
+                writer.write(conn.data_to_send())
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def burst(client, url, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(url, json={"chat_id": i, "text": "⏳ Scanning market... ⠋"})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return time.perf_counter() - started, sorted(latencies)
+
+
+async def run_case(name, client, stub, url, args):
+    stub.connections = 0
+    async with client:
+        await burst(client, url, min(50, args.requests), args.concurrency)  # Warm the pool
+        elapsed, latencies = await burst(client, url, args.requests, args.concurrency)
+        stats = pool_stats(client)
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(
+        f"{name:<22} {args.requests / elapsed:8.0f} req/s   p50 {p50:6.1f} ms   p99 {p99:6.1f} ms   "
+        f"sockets {stub.connections:4d}   peak in flight {stats.get('peak_in_flight', '-')}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.03, help="stub server delay per request, seconds")
+    args = parser.parse_args()
+
+    stub = StubBotAPI(args.latency)
+    http1_server = await asyncio.start_server(stub.handle_http1, "127.0.0.1", 0)
+    http1_url = f"http://127.0.0.1:{http1_server.sockets[0].getsockname()[1]}/bot123:abc/sendMessage"
+    print(f"{args.requests} sendMessage posts, {args.concurrency} concurrent, {args.latency * 1000:.0f} ms server latency\n")
+
+    await run_case("default AsyncClient", httpx.AsyncClient(timeout=10), stub, http1_url, args)
+    await run_case("tuned HTTP/1.1", create_client(http2=False), stub, http1_url, args)
+
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("h2 not installed; skipping the HTTP/2 case")
+    else:
+        http2_server = await asyncio.start_server(stub.handle_http2, "127.0.0.1", 0)
+        http2_url = f"http://127.0.0.1:{http2_server.sockets[0].getsockname()[1]}/bot123:abc/sendMessage"
+        # Cleartext stub, so HTTP/2 with prior knowledge instead of ALPN
+        await run_case("tuned HTTP/2", create_client(http2=True, http1=False), stub, http2_url, args)
+        http2_server.close()
+
+    http1_server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
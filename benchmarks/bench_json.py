@@ -0,0 +1,86 @@
+"""Compare the JSON codecs fast_json can use on webhook traffic.
+
+Decodes the recorded updates in benchmarks/samples/updates.jsonl (start commands, pair picks,
+callback queries, a chat-member change) and encodes the outbound Bot API bodies the bots build
+most often, with every backend that is installed.
+
+    python benchmarks/bench_json.py [--rounds 20000] [--samples benchmarks/samples/updates.jsonl]
+
+Install orjson and/or msgspec to see them next to the stdlib codec.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fast_json
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples", "updates.jsonl")
+
+OTC_PAIRS = [
+    "AED/CNY OTC", "AUD/CAD OTC", "BHD/CNY OTC", "EUR/USD OTC", "GBP/USD OTC", "AUD/NZD OTC",
+    "NZD/USD OTC", "EUR/JPY OTC", "CAD/JPY OTC", "AUD/USD OTC", "AUD/CHF OTC", "GBP/AUD OTC"]
+EXPIRY_OPTIONS = ["S5", "S10", "S15", "S30", "M1", "M2"]
+
+OUTBOUND = [
+    {
+        "chat_id": 5123456789,
+        "text": "⚠️ Not financial advice. ⚠️ \n\nTrading is risky - play smart, play sharp.\n"
+                "👇 Pick an OTC pair and let’s go get it:",
+        "reply_markup": {"keyboard": [OTC_PAIRS[i:i + 3] for i in range(0, len(OTC_PAIRS), 3)], "resize_keyboard": True},
+    },
+    {
+        "chat_id": 5123456789,
+        "text": "🤖 You selected EUR/USD OTC ☑️\n\n⌛ Select Time:",
+        "reply_markup": {"inline_keyboard": [
+            [{"text": e, "callback_data": f"expiry|EUR/USD OTC|{e}"} for e in EXPIRY_OPTIONS[i:i + 3]]
+            for i in range(0, len(EXPIRY_OPTIONS), 3)]},
+    },
+    {"chat_id": 5123456789, "message_id": 1206, "text": "🔄 Analyzing...\n▓▓▓▓▓▓░░░░ 60%"},
+    {
+        "chat_id": -1002676665035,
+        "text": "👤 User: @alex_trades\n🆔 ID: `5123456789`\n💱 Pair: EUR/USD OTC\n⏱ Expiry: S15",
+        "parse_mode": "Markdown",
+    },
+]
+
+
+def timed(func, items, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for item in items:
+            func(item)
+    return (time.perf_counter() - started) / (rounds * len(items)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20000)
+    parser.add_argument("--samples", default=SAMPLES)
+    args = parser.parse_args()
+
+    with open(args.samples, "rb") as f:
+        updates = [line.strip() for line in f if line.strip()]
+    size = sum(len(u) for u in updates) / len(updates)
+    print(f"{len(updates)} recorded updates (avg {size:.0f} bytes), {len(OUTBOUND)} outbound bodies, "
+          f"{args.rounds} rounds; default backend: {fast_json.BACKEND}\n")
+
+    baseline = None
+    for name in ("stdlib", "msgspec", "orjson"):
+        if name not in fast_json.BACKENDS:
+            print(f"{name:<8} not installed")
+            continue
+        loads, dumps = fast_json.BACKENDS[name]
+        decode = timed(loads, updates, args.rounds)
+        encode = timed(dumps, OUTBOUND, args.rounds)
+        baseline = baseline or (decode, encode)
+        print(
+            f"{name:<8} decode {decode:6.2f} µs/update ({baseline[0] / decode:4.1f}x)   "
+            f"encode {encode:6.2f} µs/body ({baseline[1] / encode:4.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 
 import os
-import httpx
 import asyncio
 import random
-import json
-import gspread
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, BackgroundTasks
 from contextlib import asynccontextmanager
-from oauth2client.service_account import ServiceAccountCredentials
+from sheets_session import open_worksheet
+from sheets_async import run_sheets, run_sheets_in_background
+from sheet_cache import DepositIndex, AuthorizedUserSync, AuthorizedUserWriter
+from local_store import LocalStore
+import fast_json
+from tg_router import Router, Update
+from update_dedup import RecentUpdates
+from tg_polling import UpdatePoller, INGESTION
+from update_queue import UpdateQueue, NO_LOGS, ESSENTIAL_ONLY
+from tg_dispatch import TelegramDispatcher, BULK
+from tg_payloads import StaticMessage, static_keyboard
+from tg_http import create_client, pool_stats
+from log_digest import LogDigest
 
 load_dotenv()
 
@@ -23,19 +32,14 @@ DELETE_MESSAGE = f"{API_BASE}/deleteMessage"
 RENDER_URL = "https://jamespocket2-n04b.onrender.com"
 
 client = None
+tg_dispatcher = TelegramDispatcher()
+recent_updates = RecentUpdates()
+log_digest = LogDigest(tg_dispatcher, SEND_MESSAGE)
 
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive"
-]
-
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-spreadsheet = client.open("TelegramBotMembers")
-sheet = spreadsheet.worksheet("Sheet7")        # Trader data sheet (read-only for deposit)
-authorized_sheet = spreadsheet.worksheet("Sheet8")  # Authorized users sheet
+TRADER_SHEET_NAME = "Sheet7"
+AUTHORIZED_SHEET_NAME = "Sheet8"
+sheet = open_worksheet("TelegramBotMembers", TRADER_SHEET_NAME)        # Trader data sheet (read-only for deposit)
+authorized_sheet = open_worksheet("TelegramBotMembers", AUTHORIZED_SHEET_NAME)  # Authorized users sheet
 pocketlink = os.getenv("POCKET_LINK")
 quotexlink = os.getenv("QUOTEX_LINK")
 botlink = os.getenv("BOT_LINK")
@@ -56,34 +60,50 @@ stocks = [
     "Apple OTC", "FACEBOOK INC OTC", "Intel OTC", "American Express OTC", "Johnson & Johnson OTC", "McDonald's OTC", "Tesla OTC", "Amazon OTC",
     "GameStop Corp OTC", "Netflix OTC", "VIX OTC", "VISA OTC", "🔄 Change Category"]
 user_data = {}
+store = LocalStore()
+deposit_index = DepositIndex(sheet, store, TRADER_SHEET_NAME)
+AUTHORIZED_USERS = store.authorized_ids(AUTHORIZED_SHEET_NAME)  # Warm start from the last local copy
 def get_deposit_for_trader(trader_id: str) -> float | None:
-    trader_ids = sheet.col_values(1)
-    deposits = sheet.col_values(2)
-    for idx, tid in enumerate(trader_ids[1:], start=1):
-        if tid.strip() == trader_id:
-            try:
-                return float(deposits[idx])
-            except (ValueError, IndexError):
-                return None
-    return None
+    return deposit_index.get(trader_id)
 
 
-def save_authorized_user(tg_id: int, po_id: str, username: str = None, first_name: str = None):
-    tg_ids = authorized_sheet.col_values(1)
-    if str(tg_id) in tg_ids:
-        row = tg_ids.index(str(tg_id)) + 1
-        authorized_sheet.update(f"B{row}", [[username or "Unknown"]])
-        authorized_sheet.update(f"C{row}", [[first_name or "Trader"]])
-        authorized_sheet.update(f"D{row}", [[po_id]])
+authorized_sync = AuthorizedUserSync(authorized_sheet, store, AUTHORIZED_SHEET_NAME)
+def load_authorized_users():
+    # Pull the sheet into the local store, then serve membership from the store's copy
+    global AUTHORIZED_USERS
+    authorized_sync.load()
+    print(f"Fetched user IDs from GSheet done.")
+    AUTHORIZED_USERS = store.authorized_ids(AUTHORIZED_SHEET_NAME)
+    print(f"Loaded authorized users done.")
+def refresh_authorized_users(added):
+    global AUTHORIZED_USERS
+    if added is None:
+        AUTHORIZED_USERS = store.authorized_ids(AUTHORIZED_SHEET_NAME)  # Edits or deletions: rebuild
     else:
-        authorized_sheet.append_row([tg_id, username or "Unknown", first_name or "Trader", po_id])
+        AUTHORIZED_USERS.update(added)
+
+
+authorized_writer = AuthorizedUserWriter(authorized_sheet, store, AUTHORIZED_SHEET_NAME)
+def save_authorized_user(tg_id: int, po_id: str, username: str = None, first_name: str = None):
+    authorized_writer.queue(tg_id, po_id, username, first_name)
+    AUTHORIZED_USERS.add(tg_id)
     print(f"✅ Authorized user saved: TG ID {tg_id}, PO ID {po_id}")
 @asynccontextmanager
 
 
 async def lifespan(app: FastAPI):
     global client
-    client = httpx.AsyncClient(timeout=10)
+    client = create_client()
+    tg_dispatcher.client = client
+    update_queue.start()
+    asyncio.create_task(log_digest.run())
+    if AUTHORIZED_USERS:
+        # Serve from the local copy right away and reconcile with the sheets in the background
+        run_sheets_in_background(load_authorized_users, "Reconciling authorized users")
+        run_sheets_in_background(deposit_index.load, "Reconciling deposit index")
+    else:
+        await run_sheets(load_authorized_users)  # First boot: nothing stored locally yet
+        await run_sheets(deposit_index.load)
     async def self_ping_loop():
         await asyncio.sleep(5)
         while True:
@@ -94,13 +114,80 @@ async def lifespan(app: FastAPI):
                 print(f"❌ Ping failed: {e}")
             await asyncio.sleep(300)  # Every 4 minutes
 
-    asyncio.create_task(self_ping_loop())
+    if INGESTION == "polling":
+        update_poller.start()
+    else:
+        asyncio.create_task(self_ping_loop())  # Keeps the webhook host awake; nothing to keep awake when polling
+    asyncio.create_task(authorized_sync.run(refresh_authorized_users))
+    asyncio.create_task(deposit_index.refresh_loop())
+    authorized_writer.requeue_dirty()
+    asyncio.create_task(authorized_writer.run())
     yield
+    await update_poller.stop()
+    await update_queue.stop()  # Finish acknowledged updates before the client closes
+    for task in list(verification_checks):
+        task.cancel()
+    await log_digest.flush()  # Send whatever is still buffered
+    await authorized_writer.flush()  # Don't lose queued saves on shutdown
     await client.aclose()
 
+
+# Static replies, serialized once; only chat_id is added per request
+VERIFIED_MENU = StaticMessage(
+    text=(
+        "✅ You are now verified and can access the bot fully.\n\n"
+        "👇 Please choose a pair to get signal:"
+    ),
+    reply_markup=static_keyboard(otc_pairs),
+)
+REGISTERED_REPLY = StaticMessage(
+    text=(
+        "✅ Your account is registered!\n\n"
+        "🔓 You're just one step away from full access.\n\n"
+        "💰 Final Step:\nFund your account with any amount.\n\n"
+        "Once you’ve made the deposit, simply send your Account ID again to complete verification."
+    ),
+)
+PAIR_MENU = StaticMessage(
+    text="👇 Please choose a pair to get signal:",
+    reply_markup=static_keyboard(otc_pairs),
+)
+VERIFYING_REPLY = StaticMessage(
+    text="✅ Thank you! We're currently verifying your account. Please wait a few minutes... ⏳\n\n📬 We'll notify you once the process is complete!",
+)
+NOT_VERIFIED_REPLY = StaticMessage(
+    text="⚠️ You need to get verified to use this bot.\nPlease press /start to begin.",
+)
+CATEGORY_MENU = StaticMessage(
+    text="🔄 Select a Category you prefer:",
+    reply_markup={"keyboard": [["Currencies", "Stocks", "Crypto"]], "resize_keyboard": True},
+)
+CURRENCIES_MENU = StaticMessage(
+    text="You chose the Currencies category. 🕒 Choose an OTC pair to trade:",
+    reply_markup=static_keyboard(otc_pairs),
+)
+STOCKS_MENU = StaticMessage(
+    text="You chose the Stocks category. 🕒 Choose a stock to trade:",
+    reply_markup=static_keyboard(stocks),
+)
+CRYPTO_MENU = StaticMessage(
+    text="You chose the Cryptocurrencies category. 💰 Choose a crypto currency to trade:",
+    reply_markup=static_keyboard(crypto_pairs),
+)
+CATEGORY_MENUS = {
+    "🔄 Change Category": CATEGORY_MENU,
+    "Currencies": CURRENCIES_MENU,
+    "Stocks": STOCKS_MENU,
+    "Crypto": CRYPTO_MENU,
+}
+UNKNOWN_COMMAND_REPLY = StaticMessage(
+    text="Unknown command. Please press /start to begin.",
+)
+
+
 async def delayed_verification_check(client, SEND_MESSAGE, chat_id, po_id, user_id, user, save_authorized_user, otc_pairs):
     await asyncio.sleep(60)
-    dep = get_deposit_for_trader(po_id)
+    dep = await run_sheets(get_deposit_for_trader, po_id)
     if dep is None:
         keyboard = {
             "inline_keyboard": [
@@ -116,7 +203,7 @@ async def delayed_verification_check(client, SEND_MESSAGE, chat_id, po_id, user_
             ),
             "reply_markup": keyboard
         }
-        await client.post(SEND_MESSAGE, json=payload)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
         return
     if dep >= 5:
         tg_id = user_id
@@ -124,365 +211,320 @@ async def delayed_verification_check(client, SEND_MESSAGE, chat_id, po_id, user_
         first_name = user.get("first_name")
         save_authorized_user(tg_id, po_id, username, first_name)
 
-        keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
+        payload = VERIFIED_MENU.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+        return
+    payload = REGISTERED_REPLY.to(chat_id)
+    await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+
+
+verification_checks = set()  # Delayed checks still waiting, kept referenced until they finish
+
+
+def start_verification_check(*args):
+    # Runs beside the update workers rather than on one: its 60s wait would hold a worker and the user's chat
+    task = asyncio.create_task(delayed_verification_check(*args))
+    verification_checks.add(task)
+    task.add_done_callback(finish_verification_check)
+
+
+def finish_verification_check(task):
+    verification_checks.discard(task)
+    if not task.cancelled() and task.exception():
+        print(f"❌ Delayed verification check failed: {task.exception()}")
+
+
+app = FastAPI(lifespan=lifespan)
+@app.api_route("/", methods=["GET", "HEAD"])
+async def healthcheck(request: Request):
+    return {
+        "status": "ok",
+        "duplicate_updates": recent_updates.duplicates,
+        "http_pool": pool_stats(client),
+        "telegram_failures": tg_dispatcher.failure_counts(),
+    }
+
+
+router = Router()
+
+
+@router.message(when=lambda update: update.user_id in ADMIN_IDS)
+async def forward_admin_media(update, background_tasks):
+    msg = update.message
+    if "video" in msg and "caption" in msg:
+        video_file_id = msg["video"]["file_id"]
+        caption = msg["caption"]
+        button_options = [
+            {"text": "🚀 Start Using the Bot for Free", "url": os.getenv("BOT_LINK")},
+            {"text": "🤖 Launch the Free Trading Bot Now", "url": os.getenv("BOT_LINK")},
+            {"text": "✅ Click Here to Get the Bot for Free", "url": os.getenv("BOT_LINK")},
+            {"text": "🚀 Start the Bot – No Cost!", "url": os.getenv("BOT_LINK")},
+            {"text": "🔥 Grab Your Free Bot Access!", "url": os.getenv("BOT_LINK")},
+            {"text": "⚡ Activate Your Trading Bot Today", "url": os.getenv("BOT_LINK")},
+            {"text": "🎯 Get the Bot and Start Winning!", "url": os.getenv("BOT_LINK")},
+            {"text": "💥 Don’t Miss Out – Get the Bot Now", "url": os.getenv("BOT_LINK")},
+            {"text": "📈 Boost Your Trades with This Bot!", "url": os.getenv("BOT_LINK")},
+            {"text": "🚀 Ready to Trade? Get Your Bot Here!", "url": os.getenv("BOT_LINK")},
+        ]
+        chosen_button = random.choice(button_options)
+        inline_keyboard = {
+            "inline_keyboard": [[chosen_button]]
+        }
         payload = {
-            "chat_id": chat_id,
+            "chat_id": -1002549064084,
+            "video": video_file_id,
+            "caption": caption,
+            "reply_markup": inline_keyboard,
+            "parse_mode": "HTML"}
+        send_video_url = f"{API_BASE}/sendVideo"
+        background_tasks.add_task(tg_dispatcher.post, send_video_url, json=payload, priority=BULK)
+        return {"ok": True}
+
+
+@router.message(text="/start")
+async def start(update, background_tasks):
+    chat_id, data = update.chat_id, update.data
+    message = data.get("message", {})  
+    from_user = message.get("from", {}) 
+    full_name = from_user.get("first_name", "Trader")
+    username = from_user.get("username", "")
+    username_display = f"@{username}" if username else "No username"
+    user_id = from_user.get("id", "N/A")
+    if user_id in AUTHORIZED_USERS:
+        payload = PAIR_MENU.to(chat_id)
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        pair_payload = {
+            "chat_id": -1002676665035,
             "text": (
-                "✅ You are now verified and can access the bot fully.\n\n"
-                "👇 Please choose a pair to get signal:"
+                f"✅ User Started\n\n"
+                f"*Full Name:* {full_name}\n"
+                f"*Username:* {username_display}\n"
+                f"*Telegram ID:* `{user_id}`"
             ),
-            "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
+            "parse_mode": "Markdown"
         }
-        await client.post(SEND_MESSAGE, json=payload)
-        return
+        log_digest.add(pair_payload)
+        return {"ok": True}
+
+
+    keyboard = {
+        "inline_keyboard": [
+            [{"text": "Pocket Broker", "callback_data": "broker_pocket"}]
+        ]
+    }
     payload = {
         "chat_id": chat_id,
         "text": (
-            "✅ Your account is registered!\n\n"
-            "🔓 You're just one step away from full access.\n\n"
-            "💰 Final Step:\nFund your account with any amount.\n\n"
-            "Once you’ve made the deposit, simply send your Account ID again to complete verification."
-        )
+            f"Hey {full_name}, welcome! 🙌\n\n"
+            "Which broker do you want to use?"
+        ),
+        "reply_markup": keyboard
     }
-    await client.post(SEND_MESSAGE, json=payload)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    pair_payload = {
+        "chat_id": -1002676665035,
+        "text": (
+            f"✅ User Started\n\n"
+            f"*Full Name:* {full_name}\n"
+            f"*Username:* {username_display}\n"
+            f"*Telegram ID:* `{user_id}`"
+        ),
+        "parse_mode": "Markdown"
+    }
+    log_digest.add(pair_payload)
+    return {"ok": True}
 
 
-app = FastAPI(lifespan=lifespan)
-@app.api_route("/", methods=["GET", "HEAD"])
-async def healthcheck(request: Request):
-    return {"status": "ok"}
+@router.message(regex=r"\d{6,}")
+async def check_account_id(update, background_tasks):
+    text, chat_id, user, user_id = update.text, update.chat_id, update.user, update.user_id
+    po_id = text.strip()
 
+    payload = VERIFYING_REPLY.to(chat_id)
+    await tg_dispatcher.post(SEND_MESSAGE, json=payload)
 
-@app.post("/webhook")
-async def webhook(request: Request, background_tasks: BackgroundTasks):
-    data = await request.json()
-
-    if msg := data.get("message"):
-        text = msg.get("text", "")
-        chat_id = msg["chat"]["id"]
-        user = msg["from"]
-        user_id = user["id"]
-
-        if user_id in ADMIN_IDS:
-            # Check if message contains video and caption
-            if "video" in msg and "caption" in msg:
-                video_file_id = msg["video"]["file_id"]
-                caption = msg["caption"]
-                button_options = [
-                    {"text": "🚀 Start Using the Bot for Free", "url": os.getenv("BOT_LINK")},
-                    {"text": "🤖 Launch the Free Trading Bot Now", "url": os.getenv("BOT_LINK")},
-                    {"text": "✅ Click Here to Get the Bot for Free", "url": os.getenv("BOT_LINK")},
-                    {"text": "🚀 Start the Bot – No Cost!", "url": os.getenv("BOT_LINK")},
-                    {"text": "🔥 Grab Your Free Bot Access!", "url": os.getenv("BOT_LINK")},
-                    {"text": "⚡ Activate Your Trading Bot Today", "url": os.getenv("BOT_LINK")},
-                    {"text": "🎯 Get the Bot and Start Winning!", "url": os.getenv("BOT_LINK")},
-                    {"text": "💥 Don’t Miss Out – Get the Bot Now", "url": os.getenv("BOT_LINK")},
-                    {"text": "📈 Boost Your Trades with This Bot!", "url": os.getenv("BOT_LINK")},
-                    {"text": "🚀 Ready to Trade? Get Your Bot Here!", "url": os.getenv("BOT_LINK")},
-                ]
-                chosen_button = random.choice(button_options)
-                inline_keyboard = {
-                    "inline_keyboard": [[chosen_button]]
-                }
-                payload = {
-                    "chat_id": -1002549064084,
-                    "video": video_file_id,
-                    "caption": caption,
-                    "reply_markup": inline_keyboard,
-                    "parse_mode": "HTML"}
-                send_video_url = f"{API_BASE}/sendVideo"
-                background_tasks.add_task(client.post, send_video_url, json=payload)
-                return {"ok": True}
-        
-        if text == "/start":
-            message = data.get("message", {})  
-            from_user = message.get("from", {}) 
-            full_name = from_user.get("first_name", "Trader")
-            username = from_user.get("username", "")
-            username_display = f"@{username}" if username else "No username"
-            user_id = from_user.get("id", "N/A")
-            tg_ids = authorized_sheet.col_values(1)
-            if str(user_id) in tg_ids:
-                keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
-                payload = {
-                    "chat_id": chat_id,
-                    "text": (
-                        "👇 Please choose a pair to get signal:"
-                    ),
-                    "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-                }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                pair_payload = {
-                    "chat_id": -1002676665035,
-                    "text": (
-                        f"✅ User Started\n\n"
-                        f"*Full Name:* {full_name}\n"
-                        f"*Username:* {username_display}\n"
-                        f"*Telegram ID:* `{user_id}`"
-                    ),
-                    "parse_mode": "Markdown"
-                }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=pair_payload)
-                return {"ok": True}
-
-    
-            keyboard = {
-                "inline_keyboard": [
-                    [{"text": "Pocket Broker", "callback_data": "broker_pocket"}]
-                ]
-            }
-            payload = {
-                "chat_id": chat_id,
-                "text": (
-                    f"Hey {full_name}, welcome! 🙌\n\n"
-                    "Which broker do you want to use?"
-                ),
-                "reply_markup": keyboard
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            pair_payload = {
-                "chat_id": -1002676665035,
-                "text": (
-                    f"✅ User Started\n\n"
-                    f"*Full Name:* {full_name}\n"
-                    f"*Username:* {username_display}\n"
-                    f"*Telegram ID:* `{user_id}`"
-                ),
-                "parse_mode": "Markdown"
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=pair_payload)
-            return {"ok": True}
-
-        if text.isdigit() and len(text) > 5:
-            po_id = text.strip()
-        
-            payload = {
-                "chat_id": chat_id,
-                "text": "✅ Thank you! We're currently verifying your account. Please wait a few minutes... ⏳\n\n📬 We'll notify you once the process is complete!"
-            }
-            await client.post(SEND_MESSAGE, json=payload)
-        
-            # Schedule delayed check
-            background_tasks.add_task(
-                delayed_verification_check,
-                client, SEND_MESSAGE, chat_id, po_id, user_id, user, save_authorized_user, otc_pairs
-            )
-        
-            return {"ok": True}
-
-##############################################################################################################################################
-        if text == "🔄 Change Category":
-            tg_ids = authorized_sheet.col_values(1)
-            if str(user_id) not in tg_ids:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."
-                }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            keyboard = [["Currencies", "Stocks", "Crypto"]]
-            payload = {
-                "chat_id": chat_id,
-                "text": "🔄 Select a Category you prefer:",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        elif text == "Currencies":
-            tg_ids = authorized_sheet.col_values(1)
-            if str(user_id) not in tg_ids:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."
-                }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": "You chose the Currencies category. 🕒 Choose an OTC pair to trade:",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        elif text == "Stocks":
-            tg_ids = authorized_sheet.col_values(1)
-            if str(user_id) not in tg_ids:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."
-                }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            keyboard = [stocks[i:i+3] for i in range(0, len(stocks), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": "You chose the Stocks category. 🕒 Choose a stock to trade:",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        elif text == "Crypto":
-            tg_ids = authorized_sheet.col_values(1)
-            if str(user_id) not in tg_ids:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."
-                }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            keyboard = [crypto_pairs[i:i+3] for i in range(0, len(crypto_pairs), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": "You chose the Cryptocurrencies category. 💰 Choose a crypto currency to trade:",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-##############################################################################################################################################
-        if text in crypto_pairs or text in otc_pairs or text in stocks:
-            tg_ids = authorized_sheet.col_values(1)
-            if str(user_id) not in tg_ids:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."
-                }
-                background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            inline_kb = [
-                [{"text": expiry_options[i], "callback_data": f"expiry|{text}|{expiry_options[i]}"} 
-                 for i in range(len(expiry_options))]
-            ]
-            payload = {
-                "chat_id": chat_id,
-                "text": f"Choose your expiry time.",
-                "reply_markup": {"inline_keyboard": inline_kb}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-##############################################################################################################################################
-        payload = {
-            "chat_id": chat_id,
-            "text": "Unknown command. Please press /start to begin."}
-        background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
+    # Schedule delayed check
+    start_verification_check(
+        client, SEND_MESSAGE, chat_id, po_id, user_id, user, save_authorized_user, otc_pairs
+    )
+
+    return {"ok": True}
+
+
+@router.message(text=CATEGORY_MENUS)
+async def category_menu(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    if user_id not in AUTHORIZED_USERS:
+        payload = NOT_VERIFIED_REPLY.to(chat_id)
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
         return {"ok": True}
+    payload = CATEGORY_MENUS[text].to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
 
-    
-    if cq := data.get("callback_query"):
-        data_str = cq.get("data", "")
-        chat_id = cq["message"]["chat"]["id"]
-        message_id = cq["message"]["message_id"]
-        cq_id = cq.get("id")
-        background_tasks.add_task(client.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": cq_id})
-        background_tasks.add_task(client.post, DELETE_MESSAGE, json={"chat_id": chat_id, "message_id": message_id})
-
-        if data_str in ["broker_pocket", "broker_quotex"]:
-            broker_name = "Pocket Broker" if data_str == "broker_pocket" else "Quotex"
-            register_link = pocketlink if data_str == "broker_pocket" else quotexlink
-        
-            keyboard = {
-                "inline_keyboard": [
-                    [{"text": "📌 Registration Link", "url": register_link}],
-                    [{"text": "✅ Check ID", "callback_data": "check_id"}]
-                ]
-            }
-            payload = {
-                "chat_id": chat_id,
-                "text": (
-                    f"Great choice! Let's set you up with {broker_name} 🛠️\n\n"
-                    "Just follow these 4 quick steps:\n\n"
-                    "1️⃣ Create an Account\nTap the “📌 Registration Link” and sign up with a new, unused email.\n\n"
-                    "2️⃣ Copy Your Account ID\nAfter registration, head to your profile and copy your account ID.\n\n"
-                    "3️⃣ Verify Your ID\nClick the “✅ Check ID” button and send your account ID (numbers only).\n\n"
-                    "4️⃣ Fund Your Account\nDeposit any amount to unlock full access to the bot features.\n\n"
-                ),
-                "reply_markup": keyboard
-            }
-        
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-
-        
-        
-        if data_str == "check_id":
-            payload = {
-                "chat_id": chat_id,
-                "text": "Please send your Account ID (numbers only).\n❌ : id 123123123\n✅ : 123123123"
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        
-            from_user = cq.get("from", {})
-            tg_id = from_user.get("id")
-            username = from_user.get("username")
-            first_name = from_user.get("first_name")
-            save_authorized_user(tg_id, po_id, username, first_name)
-            keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
-            payload = {
-                    "chat_id": chat_id,
-                    "text": (
-                        "✅ You are now verified and can access the bot fully.\n\n"
-                        "👇 Please choose a pair to get signal:"
-                    ),
-                    "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-
-        if data_str == "restart_process":
-            message = cq.get("message", {})
-            from_user = cq.get("from", {})
-            full_name = from_user.get("first_name", "Trader")
-            keyboard = {
-                "inline_keyboard": [
-                    [{"text": "Pocket Broker", "callback_data": "broker_pocket"}]
-                ]
-            }
-            payload = {
-                "chat_id": chat_id,
-                "text": (
-                    f"Hey {full_name}, welcome back! 🙌\n\n"
-                    "Which broker do you want to use?"
-                ),
-                "reply_markup": keyboard
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        
-        if data_str.startswith("expiry|"):
-            _, pair, expiry = data_str.split("|", 2)
-            signals = ["⬆️", "⬇️"]
-            signal = random.choice(signals)
-            
-            # Send signal to user
-            signal_message = f"{signal}"
-            payload = {
-                "chat_id": chat_id,
-                "text": signal_message
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-        
-            # Safe user info extraction
-            message = cq.get("message", {})
-            from_user = cq.get("from", {})
-            full_name = from_user.get("first_name", "Unknown")
-            username = from_user.get("username", "")
-            username_display = f"@{username}" if username else "No username"
-            user_id = from_user.get("id", "N/A")
-        
-            # Send user trade log to channel/group
-            pair_payload = {
-                "chat_id": -1002676665035,
-                "text": (
-                    "📊 *User Trade Action*\n\n"
-                    f"*Full Name:* {full_name}\n"
-                    f"*Username:* {username_display}\n"
-                    f"*Telegram ID:* `{user_id}`\n"
-                    f"*Selected Pair:* {pair}\n"
-                    f"*Selected Time:* {expiry}\n"
-                    f"*Signal:* {signal}"
-                ),
-                "parse_mode": "Markdown"
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=pair_payload)
-            return {"ok": True}
+@router.message(text=crypto_pairs + otc_pairs + stocks)
+async def choose_pair(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    if user_id not in AUTHORIZED_USERS:
+        payload = NOT_VERIFIED_REPLY.to(chat_id)
+        background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    inline_kb = [
+        [{"text": expiry_options[i], "callback_data": f"expiry|{text}|{expiry_options[i]}"} 
+         for i in range(len(expiry_options))]
+    ]
+    payload = {
+        "chat_id": chat_id,
+        "text": f"Choose your expiry time.",
+        "reply_markup": {"inline_keyboard": inline_kb}
+    }
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(fallback=True)
+async def unknown_command(update, background_tasks):
+    if update_queue.mode >= ESSENTIAL_ONLY:
+        return {"ok": True}
+    chat_id = update.chat_id
+    payload = UNKNOWN_COMMAND_REPLY.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.callback(data=["broker_pocket", "broker_quotex"])
+async def choose_broker(update, background_tasks):
+    chat_id, data_str = update.chat_id, update.callback_data
+    broker_name = "Pocket Broker" if data_str == "broker_pocket" else "Quotex"
+    register_link = pocketlink if data_str == "broker_pocket" else quotexlink
+
+    keyboard = {
+        "inline_keyboard": [
+            [{"text": "📌 Registration Link", "url": register_link}],
+            [{"text": "✅ Check ID", "callback_data": "check_id"}]
+        ]
+    }
+    payload = {
+        "chat_id": chat_id,
+        "text": (
+            f"Great choice! Let's set you up with {broker_name} 🛠️\n\n"
+            "Just follow these 4 quick steps:\n\n"
+            "1️⃣ Create an Account\nTap the “📌 Registration Link” and sign up with a new, unused email.\n\n"
+            "2️⃣ Copy Your Account ID\nAfter registration, head to your profile and copy your account ID.\n\n"
+            "3️⃣ Verify Your ID\nClick the “✅ Check ID” button and send your account ID (numbers only).\n\n"
+            "4️⃣ Fund Your Account\nDeposit any amount to unlock full access to the bot features.\n\n"
+        ),
+        "reply_markup": keyboard
+    }
+
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.callback(data="check_id")
+async def check_id(update, background_tasks):
+    chat_id = update.chat_id
+    payload = {
+        "chat_id": chat_id,
+        "text": "Please send your Account ID (numbers only).\n❌ : id 123123123\n✅ : 123123123"
+    }
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.callback(data="restart_process")
+async def restart_process(update, background_tasks):
+    chat_id, cq = update.chat_id, update.callback_query
+    from_user = cq.get("from", {})
+    full_name = from_user.get("first_name", "Trader")
+    keyboard = {
+        "inline_keyboard": [
+            [{"text": "Pocket Broker", "callback_data": "broker_pocket"}]
+        ]
+    }
+    payload = {
+        "chat_id": chat_id,
+        "text": (
+            f"Hey {full_name}, welcome back! 🙌\n\n"
+            "Which broker do you want to use?"
+        ),
+        "reply_markup": keyboard
+    }
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.callback(prefix="expiry|")
+async def send_signal(update, background_tasks):
+    chat_id, cq, data_str = update.chat_id, update.callback_query, update.callback_data
+    _, pair, expiry = data_str.split("|", 2)
+    signals = ["⬆️", "⬇️"]
+    signal = random.choice(signals)
+
+    # Send signal to user
+    signal_message = f"{signal}"
+    payload = {
+        "chat_id": chat_id,
+        "text": signal_message
+    }
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+
+    # Safe user info extraction
+    from_user = cq.get("from", {})
+    full_name = from_user.get("first_name", "Unknown")
+    username = from_user.get("username", "")
+    username_display = f"@{username}" if username else "No username"
+    user_id = from_user.get("id", "N/A")
+
+    # Send user trade log to channel/group
+    pair_payload = {
+        "chat_id": -1002676665035,
+        "text": (
+            "📊 *User Trade Action*\n\n"
+            f"*Full Name:* {full_name}\n"
+            f"*Username:* {username_display}\n"
+            f"*Telegram ID:* `{user_id}`\n"
+            f"*Selected Pair:* {pair}\n"
+            f"*Selected Time:* {expiry}\n"
+            f"*Signal:* {signal}"
+        ),
+        "parse_mode": "Markdown"
+    }
+    log_digest.add(pair_payload)
+    return {"ok": True}
+
+
+async def handle_update(update):
+    background_tasks = BackgroundTasks()
+    if update.callback_query:
+        # Acknowledge the button press and remove the menu it came from
+        background_tasks.add_task(tg_dispatcher.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": update.callback_query.get("id")})
+        background_tasks.add_task(tg_dispatcher.post, DELETE_MESSAGE, json={"chat_id": update.chat_id, "message_id": update.message_id})
+    await router.dispatch(update, background_tasks)
+    await background_tasks()  # Here rather than after a response, so the chat's next update waits for these sends
+
+
+def shed_load(mode):
+    log_digest.paused = mode >= NO_LOGS
+
+
+update_queue = UpdateQueue(handle_update, on_mode_change=shed_load)
+
+
+def receive(data):
+    # Queues an update for the worker pool, which handles it in order within its chat
+    if recent_updates.seen(data):
+        return  # A redelivery of an update that is already queued or handled
+    update = Update(data)
+    update_queue.put(update.chat_id, update)
+    recent_updates.record(data)
+
+
+update_poller = UpdatePoller(tg_dispatcher, API_BASE, receive, update_queue)
+
+
+@app.post("/webhook")
+async def webhook(request: Request):
+    receive(fast_json.loads(await request.body()))
+    return {"ok": True}  # Acknowledged at once, before the update is handled
@@ -1,14 +1,22 @@
 
 import os
-import httpx
 import asyncio
 import random
-import json
-import gspread
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, BackgroundTasks
 from contextlib import asynccontextmanager
-from oauth2client.service_account import ServiceAccountCredentials
+from sheets_session import open_worksheet
+from sheets_async import AsyncWorksheet, run_sheets, run_sheets_in_background
+from local_store import load_snapshot, save_snapshot
+import fast_json
+from tg_router import Router, Update
+from update_dedup import RecentUpdates
+from tg_polling import UpdatePoller, INGESTION
+from update_queue import UpdateQueue, NO_ANIMATIONS, ESSENTIAL_ONLY
+from tg_dispatch import TelegramDispatcher, BULK
+from tg_payloads import StaticMessage, static_keyboard
+from tg_http import create_client, pool_stats
+from tg_animation import EditAnimation
 load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(",")))
@@ -23,12 +31,11 @@ channel_link = os.getenv("CHANNEL_LINK")
 pocketlink = os.getenv("POCKET_LINK")
 
 client = None
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS2"))
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-spreadsheet = client.open("LyraExclusiveAccess")
-sheet = spreadsheet.worksheet("Sheet2")
+tg_dispatcher = TelegramDispatcher()
+recent_updates = RecentUpdates()
+sheet = open_worksheet("LyraExclusiveAccess", "Sheet2", creds_env="GOOGLE_CREDENTIALS2")
+AUTHORIZED_SNAPSHOT = "LyraExclusiveAccess-Sheet2"
+sheet_async = AsyncWorksheet(sheet)
 
 
 otc_pairs = [
@@ -51,15 +58,17 @@ stocks = [
 ]
 def load_authorized_users():
     global AUTHORIZED_USERS
-    AUTHORIZED_USERS = set()
+    users = set()
     user_ids = sheet.col_values(1)
     print(f"Fetched user IDs from GSheet: {user_ids}")
     for user_id in user_ids[1:]:
         if user_id.strip():
             try:
-                AUTHORIZED_USERS.add(int(user_id))
+                users.add(int(user_id))
             except ValueError:
                 print(f"Skipping invalid ID: {user_id}")
+    AUTHORIZED_USERS = users
+    save_snapshot(AUTHORIZED_SNAPSHOT, sorted(users))
     print(f"Loaded authorized users: {AUTHORIZED_USERS}")
 def save_users():
     user_ids = sheet.col_values(1)
@@ -80,15 +89,18 @@ def save_users():
         else:
             sheet.append_row([user_id, tg_username, tg_name, pocket_option_id])
     print("✅ Users saved successfully!")
-load_authorized_users()
+AUTHORIZED_USERS = set(load_snapshot(AUTHORIZED_SNAPSHOT, []))
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global client
-    client = httpx.AsyncClient(timeout=10)
-
-    # Load authorized users when the app starts
-    load_authorized_users()
-    print("✅ Authorized users loaded on startup.")
+    client = create_client()
+    tg_dispatcher.client = client
+    update_queue.start()
+    if AUTHORIZED_USERS:
+        # Serve from the last snapshot right away and reconcile with the sheet in the background
+        run_sheets_in_background(load_authorized_users, "Reconciling authorized users")
+    else:
+        await run_sheets(load_authorized_users)  # First boot: no snapshot yet
 
     async def self_ping_loop():
         await asyncio.sleep(5)
@@ -100,13 +112,23 @@ async def lifespan(app: FastAPI):
                 print(f"❌ Ping failed: {e}")
             await asyncio.sleep(300)
 
-    asyncio.create_task(self_ping_loop())
+    if INGESTION == "polling":
+        update_poller.start()
+    else:
+        asyncio.create_task(self_ping_loop())  # Keeps the webhook host awake; nothing to keep awake when polling
     yield
+    await update_poller.stop()
+    await update_queue.stop()  # Finish acknowledged updates before the client closes
     await client.aclose()
 app = FastAPI(lifespan=lifespan)
 @app.api_route("/", methods=["GET", "HEAD"])
 async def healthcheck(request: Request):
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "duplicate_updates": recent_updates.duplicates,
+        "http_pool": pool_stats(client),
+        "telegram_failures": tg_dispatcher.failure_counts(),
+    }
 
 async def handle_analysis_flow(pair, chat_id, client):
     analysis_steps = [
@@ -118,244 +140,251 @@ async def handle_analysis_flow(pair, chat_id, client):
         f"✅ Analysis complete!"
     ]
 
-    resp = await client.post(SEND_MESSAGE, json={"chat_id": chat_id, "text": analysis_steps[0]})
-    message_id = resp.json().get("result", {}).get("message_id")
+    signal = random.choice(["↗️↗️↗️", "↘️↘️↘️"])
+    final_text = f"{pair}:\n\n{signal}"
+    if update_queue.mode >= NO_ANIMATIONS:
+        # Shedding load: skip the animation and send only the result
+        await tg_dispatcher.post(SEND_MESSAGE, json={"chat_id": chat_id, "text": final_text})
+        return
+
+    resp = await tg_dispatcher.post(SEND_MESSAGE, json={"chat_id": chat_id, "text": analysis_steps[0]})
+    message_id = fast_json.loads(resp.content).get("result", {}).get("message_id")
+    animation = EditAnimation(tg_dispatcher, EDIT_MESSAGE, chat_id, message_id, final_in=0.7 * (len(analysis_steps) - 1) + 0.5)
 
     for step in analysis_steps[1:]:
         await asyncio.sleep(0.7)
-        await client.post(EDIT_MESSAGE, json={
-            "chat_id": chat_id,
-            "message_id": message_id,
-            "text": step
-        })
+        await animation.frame(step)
 
-    signal = random.choice(["↗️↗️↗️", "↘️↘️↘️"])
-    final_text = f"{pair}:\n\n{signal}"
     await asyncio.sleep(0.5)
-    await client.post(EDIT_MESSAGE, json={
-        "chat_id": chat_id,
-        "message_id": message_id,
-        "text": final_text
-    })
+    await animation.finish(final_text)
 
-@app.post("/webhook")
-async def webhook(request: Request, background_tasks: BackgroundTasks):
-    data = await request.json()
-    if msg := data.get("message"):
-        text = msg.get("text", "")
-        chat_id = msg["chat"]["id"]
-        user = msg["from"]
-        user_id = user["id"]
-
-        if user_id in ADMIN_IDS:
-            media_type = None
-            media_file_id = None
-            # Check if message has photo or video
-            if "photo" in msg and "caption" in msg:
-                media_type = "photo"
-                media_file_id = msg["photo"][-1]["file_id"]  # highest resolution photo
-                caption = msg["caption"]
-            elif "video" in msg and "caption" in msg:
-                media_type = "video"
-                media_file_id = msg["video"]["file_id"]
-                caption = msg["caption"]
-            if media_type and media_file_id and caption:
-                inline_keyboard = {
-                    "inline_keyboard": [[
-                        {
-                            "text": "📌 Get Access",
-                            "url": os.getenv("BOT_LINK")
-                        }
-                    ]]
-                }
-                payload = {
-                    "chat_id": -1002774394321,  # channel hub
-                    "caption": caption,
-                    "reply_markup": inline_keyboard,
-                    "parse_mode": "HTML"
-                }
-                if media_type == "photo":
-                    payload["photo"] = media_file_id
-                    send_method = "sendPhoto"
-                else:  # video
-                    payload["video"] = media_file_id
-                    send_method = "sendVideo"
-                send_url = f"{API_BASE}/{send_method}"
-                background_tasks.add_task(client.post, send_url, json=payload)
-                return {"ok": True}
-                
-        if text == "/start":
-            parts = text.split()
-            param = parts[1] if len(parts) > 1 else None
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": (
-                        "🚫 You’re not verified yet!\n\n"
-                        "✅ To get access, join my channel and tap the pinned message 📌\n"
-                        "Follow the simple steps there to get started 💼"
-                    ),
-                    "reply_markup": {
-                        "inline_keyboard": [[
-                            {"text": "📢 Join Channel", "url": channel_link}
-                        ]]
-                    }
-                }
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-                
-            keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": (
-                    "👇 Please choose a pair to get signal:"
-                ),
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-
-    
-        
-##############################################################################################################################################
-        if text == "⏱️ Change Time Expiry":
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."}
-                await client.post(SEND_MESSAGE, json=payload)
-            keyboard = [["S5"], ["S10", "S15"]]
-            payload = {
-                "chat_id": chat_id,
-                "text": "What Time Expiry you want to use?",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        elif text == "S5":
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."}
-                await client.post(SEND_MESSAGE, json=payload)
-            keyboard = [otc_pairs[i:i+3] for i in range(0, len(otc_pairs), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": "You’ve successfully changed the Time Expiry to S5!",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        elif text == "S10":
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."}
-                await client.post(SEND_MESSAGE, json=payload)
-            keyboard = [crypto_pairs[i:i+3] for i in range(0, len(stocks), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": "You’ve successfully changed the Time Expiry to S10!",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-        elif text == "S15":
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."}
-                await client.post(SEND_MESSAGE, json=payload)
-            keyboard = [stocks[i:i+3] for i in range(0, len(crypto_pairs), 3)]
-            payload = {
-                "chat_id": chat_id,
-                "text": "You’ve successfully changed the Time Expiry to S15!",
-                "reply_markup": {"keyboard": keyboard, "resize_keyboard": True}
-            }
-            background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
-            return {"ok": True}
-##############################################################################################################################################
-        if text in crypto_pairs or text in otc_pairs or text in stocks:
-            if user_id not in AUTHORIZED_USERS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ You need to get verified to use this bot.\nPlease press /start to begin."
-                }
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-        
-            # Run analysis in background without waiting
-            asyncio.create_task(handle_analysis_flow(text, chat_id, client))
-            return {"ok": True}
-
-
-        if text.startswith(("/addmember", "/add")):
-            parts = text.strip().split()
-            if len(parts) < 3:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ Usage: /addmember <user_id> <pocket_option_id>"}
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            if user_id not in ADMIN_IDS:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "❌ You are not authorized to use this command."}
-                await client.post(SEND_MESSAGE, json=payload)
-                return {"ok": True}
-            try:
-                new_user_id = int(parts[1])
-                pocket_option_id = parts[2]
-                AUTHORIZED_USERS.add(new_user_id)
-            
-                try:
-                    resp = await client.get(f"{API_BASE}/getChat", params={"chat_id": new_user_id})
-                    user_info = resp.json().get("result", {})
-                    username = user_info.get("username", "Unknown")
-                    first_name = user_info.get("first_name", "Trader")
-                except Exception as e:
-                    print(f"⚠️ Failed to fetch user info: {e}")
-                    username = "Unknown"
-                    first_name = "Trader"
-            
-                # Prepare full name and username display
-                full_name = first_name
-                username_display = f"@{username}" if username != "Unknown" else "No username"
-            
-                user_ids = sheet.col_values(1)
-                user_id_str = str(new_user_id)
-                if user_id_str in user_ids:
-                    row_number = user_ids.index(user_id_str) + 1
-                    sheet.update(f"B{row_number}", [[username]])
-                    sheet.update(f"C{row_number}", [[first_name]])
-                    sheet.update(f"D{row_number}", [[pocket_option_id]])
-                else:
-                    sheet.append_row([new_user_id, username, first_name, pocket_option_id])
-                payload = {
-                    "chat_id": chat_id,
-                    "text": f"✅ Added Successful!\n\n{full_name} | {username_display} | {new_user_id} \nPocket Option ID: {pocket_option_id}"
+
+# Static replies, serialized once; only chat_id is added per request
+REGISTRATION_MENU = StaticMessage(
+    text=(
+        "🚫 You’re not verified yet!\n\n"
+        "✅ To get access, join my channel and tap the pinned message 📌\n"
+        "Follow the simple steps there to get started 💼"
+    ),
+    reply_markup={
+        "inline_keyboard": [[
+            {"text": "📢 Join Channel", "url": channel_link}
+        ]]
+    },
+)
+PAIR_MENU = StaticMessage(
+    text="👇 Please choose a pair to get signal:",
+    reply_markup=static_keyboard(otc_pairs),
+)
+NOT_VERIFIED_REPLY = StaticMessage(
+    text="⚠️ You need to get verified to use this bot.\nPlease press /start to begin.",
+)
+EXPIRY_MENU = StaticMessage(
+    text="What Time Expiry you want to use?",
+    reply_markup={"keyboard": [["S5"], ["S10", "S15"]], "resize_keyboard": True},
+)
+EXPIRY_S5_MENU = StaticMessage(
+    text="You’ve successfully changed the Time Expiry to S5!",
+    reply_markup=static_keyboard(otc_pairs),
+)
+EXPIRY_S10_MENU = StaticMessage(
+    text="You’ve successfully changed the Time Expiry to S10!",
+    reply_markup={"keyboard": [crypto_pairs[i:i+3] for i in range(0, len(stocks), 3)], "resize_keyboard": True},
+)
+EXPIRY_S15_MENU = StaticMessage(
+    text="You’ve successfully changed the Time Expiry to S15!",
+    reply_markup={"keyboard": [stocks[i:i+3] for i in range(0, len(crypto_pairs), 3)], "resize_keyboard": True},
+)
+EXPIRY_MENUS = {
+    "⏱️ Change Time Expiry": EXPIRY_MENU,
+    "S5": EXPIRY_S5_MENU,
+    "S10": EXPIRY_S10_MENU,
+    "S15": EXPIRY_S15_MENU,
+}
+ADDMEMBER_USAGE_REPLY = StaticMessage(
+    text="⚠️ Usage: /addmember <user_id> <pocket_option_id>",
+)
+NOT_AUTHORIZED_REPLY = StaticMessage(
+    text="❌ You are not authorized to use this command.",
+)
+INVALID_USER_ID_REPLY = StaticMessage(
+    text="⚠️ Invalid user ID. Please enter a valid number.",
+)
+UNKNOWN_COMMAND_REPLY = StaticMessage(
+    text="Unknown command. Please press /start to begin.",
+)
+
+
+router = Router()
+
+
+@router.message(when=lambda update: update.user_id in ADMIN_IDS)
+async def forward_admin_media(update, background_tasks):
+    msg = update.message
+    media_type = None
+    media_file_id = None
+    # Check if message has photo or video
+    if "photo" in msg and "caption" in msg:
+        media_type = "photo"
+        media_file_id = msg["photo"][-1]["file_id"]  # highest resolution photo
+        caption = msg["caption"]
+    elif "video" in msg and "caption" in msg:
+        media_type = "video"
+        media_file_id = msg["video"]["file_id"]
+        caption = msg["caption"]
+    if media_type and media_file_id and caption:
+        inline_keyboard = {
+            "inline_keyboard": [[
+                {
+                    "text": "📌 Get Access",
+                    "url": os.getenv("BOT_LINK")
                 }
-                await client.post(SEND_MESSAGE, json=payload)
-            except ValueError:
-                payload = {
-                    "chat_id": chat_id,
-                    "text": "⚠️ Invalid user ID. Please enter a valid number."}
-                await client.post(SEND_MESSAGE, json=payload)
-            return {"ok": True}
+            ]]
+        }
+        payload = {
+            "chat_id": -1002774394321,  # channel hub
+            "caption": caption,
+            "reply_markup": inline_keyboard,
+            "parse_mode": "HTML"
+        }
+        if media_type == "photo":
+            payload["photo"] = media_file_id
+            send_method = "sendPhoto"
+        else:  # video
+            payload["video"] = media_file_id
+            send_method = "sendVideo"
+        send_url = f"{API_BASE}/{send_method}"
+        background_tasks.add_task(tg_dispatcher.post, send_url, json=payload, priority=BULK)
+        return {"ok": True}
+
+
+@router.message(text="/start")
+async def start(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    parts = text.split()
+    param = parts[1] if len(parts) > 1 else None
+    if user_id not in AUTHORIZED_USERS:
+        payload = REGISTRATION_MENU.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+        return {"ok": True}
+
+    payload = PAIR_MENU.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
 
 
+@router.message(text=EXPIRY_MENUS)
+async def expiry_menu(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    if user_id not in AUTHORIZED_USERS:
+        payload = NOT_VERIFIED_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+    payload = EXPIRY_MENUS[text].to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
 
+
+@router.message(text=crypto_pairs + otc_pairs + stocks)
+async def choose_pair(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    if user_id not in AUTHORIZED_USERS:
+        payload = NOT_VERIFIED_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+        return {"ok": True}
+
+    # Run analysis in background without waiting
+    asyncio.create_task(handle_analysis_flow(text, chat_id, client))
+    return {"ok": True}
+
+
+@router.message(prefix=("/addmember", "/add"))
+async def add_member(update, background_tasks):
+    text, chat_id, user_id = update.text, update.chat_id, update.user_id
+    parts = text.strip().split()
+    if len(parts) < 3:
+        payload = ADDMEMBER_USAGE_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    if user_id not in ADMIN_IDS:
+        payload = NOT_AUTHORIZED_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+        return {"ok": True}
+    try:
+        new_user_id = int(parts[1])
+        pocket_option_id = parts[2]
+        AUTHORIZED_USERS.add(new_user_id)
+        save_snapshot(AUTHORIZED_SNAPSHOT, sorted(AUTHORIZED_USERS))
+
+        try:
+            resp = await tg_dispatcher.post(f"{API_BASE}/getChat", json={"chat_id": new_user_id})
+            user_info = fast_json.loads(resp.content).get("result", {})
+            username = user_info.get("username", "Unknown")
+            first_name = user_info.get("first_name", "Trader")
+        except Exception as e:
+            print(f"⚠️ Failed to fetch user info: {e}")
+            username = "Unknown"
+            first_name = "Trader"
+
+        # Prepare full name and username display
+        full_name = first_name
+        username_display = f"@{username}" if username != "Unknown" else "No username"
+
+        user_ids = await sheet_async.col_values(1)
+        user_id_str = str(new_user_id)
+        if user_id_str in user_ids:
+            row_number = user_ids.index(user_id_str) + 1
+            await sheet_async.update(f"B{row_number}", [[username]])
+            await sheet_async.update(f"C{row_number}", [[first_name]])
+            await sheet_async.update(f"D{row_number}", [[pocket_option_id]])
+        else:
+            await sheet_async.append_row([new_user_id, username, first_name, pocket_option_id])
         payload = {
             "chat_id": chat_id,
-            "text": "Unknown command. Please press /start to begin."}
-        background_tasks.add_task(client.post, SEND_MESSAGE, json=payload)
+            "text": f"✅ Added Successful!\n\n{full_name} | {username_display} | {new_user_id} \nPocket Option ID: {pocket_option_id}"
+        }
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+    except ValueError:
+        payload = INVALID_USER_ID_REPLY.to(chat_id)
+        await tg_dispatcher.post(SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+@router.message(fallback=True)
+async def unknown_command(update, background_tasks):
+    if update_queue.mode >= ESSENTIAL_ONLY:
         return {"ok": True}
+    chat_id = update.chat_id
+    payload = UNKNOWN_COMMAND_REPLY.to(chat_id)
+    background_tasks.add_task(tg_dispatcher.post, SEND_MESSAGE, json=payload)
+    return {"ok": True}
+
+
+async def handle_update(update):
+    background_tasks = BackgroundTasks()
+    if update.callback_query:
+        # Acknowledge the button press and remove the menu it came from
+        background_tasks.add_task(tg_dispatcher.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": update.callback_query.get("id")})
+        background_tasks.add_task(tg_dispatcher.post, DELETE_MESSAGE, json={"chat_id": update.chat_id, "message_id": update.message_id})
+    await router.dispatch(update, background_tasks)
+    await background_tasks()  # Here rather than after a response, so the chat's next update waits for these sends
+
+
+update_queue = UpdateQueue(handle_update)
 
-    
-    if cq := data.get("callback_query"):
-        data_str = cq.get("data", "")
-        chat_id = cq["message"]["chat"]["id"]
-        message_id = cq["message"]["message_id"]
-        cq_id = cq.get("id")
-        background_tasks.add_task(client.post, f"{API_BASE}/answerCallbackQuery", json={"callback_query_id": cq_id})
-        background_tasks.add_task(client.post, DELETE_MESSAGE, json={"chat_id": chat_id, "message_id": message_id})
+
+def receive(data):
+    # Queues an update for the worker pool, which handles it in order within its chat
+    if recent_updates.seen(data):
+        return  # A redelivery of an update that is already queued or handled
+    update = Update(data)
+    update_queue.put(update.chat_id, update)
+    recent_updates.record(data)
+
+
+update_poller = UpdatePoller(tg_dispatcher, API_BASE, receive, update_queue)
+
+
+@app.post("/webhook")
+async def webhook(request: Request):
+    receive(fast_json.loads(await request.body()))
+    return {"ok": True}  # Acknowledged at once, before the update is handled
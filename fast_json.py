@@ -0,0 +1,39 @@
+import os
+import json
+
+# JSON codec for webhook updates and Bot API bodies. orjson (or msgspec) parses and encodes several
+# times faster than the stdlib; whichever is installed is used, with json as the fallback.
+# JSON_BACKEND=orjson|msgspec|stdlib forces one. dumps() always returns compact UTF-8 bytes.
+BACKENDS = {}
+
+
+def _stdlib_dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+BACKENDS["stdlib"] = (json.loads, _stdlib_dumps)
+
+try:
+    import msgspec
+except ImportError:
+    pass
+else:
+    BACKENDS["msgspec"] = (msgspec.json.decode, msgspec.json.Encoder().encode)
+
+try:
+    import orjson
+except ImportError:
+    pass
+else:
+    def _orjson_dumps(value):
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+    BACKENDS["orjson"] = (orjson.loads, _orjson_dumps)
+
+BACKEND = os.getenv("JSON_BACKEND") or next(name for name in ("orjson", "msgspec", "stdlib") if name in BACKENDS)
+if BACKEND not in BACKENDS:
+    print(f"⚠️ JSON_BACKEND={BACKEND} is not installed; using the stdlib json codec")
+    BACKEND = "stdlib"
+
+# Both raise a ValueError subclass on malformed input, like json.loads
+loads, dumps = BACKENDS[BACKEND]
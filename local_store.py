@@ -0,0 +1,182 @@
+import os
+import json
+import sqlite3
+import threading
+
+# Local primary copy of the TelegramBotMembers tables. Rows are keyed by worksheet name, so
+# one file can hold several bots' sheets: authorized users (A = TG ID, B = username,
+# C = name, D = PO ID) and trader deposits (A = trader ID, B = total deposit).
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "bot_store.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS authorized_users (
+    sheet TEXT NOT NULL,
+    tg_id INTEGER NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    po_id TEXT,
+    dirty INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (sheet, tg_id)
+);
+CREATE INDEX IF NOT EXISTS authorized_users_po_id ON authorized_users (sheet, po_id);
+CREATE TABLE IF NOT EXISTS trader_deposits (
+    sheet TEXT NOT NULL,
+    trader_id TEXT NOT NULL,
+    deposit REAL,
+    PRIMARY KEY (sheet, trader_id)
+);
+"""
+
+
+class LocalStore:
+    def __init__(self, path=LOCAL_DB_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        with self.write_lock:
+            self.conn().executescript(SCHEMA)
+
+    def conn(self):
+        # One connection per thread; WAL lets the event loop read while a sync thread writes
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    # --- authorized users ---
+
+    def authorized_ids(self, sheet):
+        rows = self.conn().execute("SELECT tg_id FROM authorized_users WHERE sheet = ?", (sheet,))
+        return {tg_id for (tg_id,) in rows}
+
+    def is_authorized(self, sheet, tg_id):
+        row = self.conn().execute(
+            "SELECT 1 FROM authorized_users WHERE sheet = ? AND tg_id = ?", (sheet, tg_id)
+        ).fetchone()
+        return row is not None
+
+    def po_id_owner(self, sheet, po_id):
+        # TG ID that already claimed this PO ID, or None
+        row = self.conn().execute(
+            "SELECT tg_id FROM authorized_users WHERE sheet = ? AND po_id = ? LIMIT 1", (sheet, po_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def upsert_user(self, sheet, tg_id, username, first_name, po_id, dirty=1):
+        with self.write_lock:
+            self.conn().execute(
+                "INSERT INTO authorized_users (sheet, tg_id, username, first_name, po_id, dirty) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (sheet, tg_id) DO UPDATE SET username = excluded.username, "
+                "first_name = excluded.first_name, po_id = excluded.po_id, dirty = excluded.dirty",
+                (sheet, tg_id, username, first_name, po_id, dirty),
+            )
+
+    def dirty_users(self, sheet):
+        rows = self.conn().execute(
+            "SELECT tg_id, username, first_name, po_id FROM authorized_users WHERE sheet = ? AND dirty = 1",
+            (sheet,),
+        )
+        return [list(row) for row in rows]
+
+    def mark_clean(self, sheet, users):
+        # Only clear rows that still hold the values that were written
+        with self.write_lock:
+            self.conn().executemany(
+                "UPDATE authorized_users SET dirty = 0 WHERE sheet = ? AND tg_id = ? "
+                "AND username IS ? AND first_name IS ? AND po_id IS ?",
+                [(sheet, *user) for user in users],
+            )
+
+    def replace_users(self, sheet, users):
+        # Mirror the sheet into the table; rows not yet pushed to the sheet are kept
+        conn = self.conn()
+        with self.write_lock:
+            conn.execute("BEGIN")
+            try:
+                conn.execute("DELETE FROM authorized_users WHERE sheet = ? AND dirty = 0", (sheet,))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO authorized_users (sheet, tg_id, username, first_name, po_id) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(sheet, *user) for user in users],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def merge_users(self, sheet, users):
+        # Add rows read from the sheet; rows not yet pushed to the sheet keep their local values
+        with self.write_lock:
+            self.conn().executemany(
+                "INSERT INTO authorized_users (sheet, tg_id, username, first_name, po_id) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (sheet, tg_id) DO UPDATE SET username = excluded.username, "
+                "first_name = excluded.first_name, po_id = excluded.po_id WHERE authorized_users.dirty = 0",
+                [(sheet, *user) for user in users],
+            )
+
+    # --- trader deposits ---
+
+    def deposit(self, sheet, trader_id):
+        row = self.conn().execute(
+            "SELECT deposit FROM trader_deposits WHERE sheet = ? AND trader_id = ?", (sheet, trader_id)
+        ).fetchone()
+        return (True, row[0]) if row else (False, None)
+
+    def replace_deposits(self, sheet, deposits):
+        conn = self.conn()
+        with self.write_lock:
+            conn.execute("BEGIN")
+            try:
+                conn.execute("DELETE FROM trader_deposits WHERE sheet = ?", (sheet,))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO trader_deposits (sheet, trader_id, deposit) VALUES (?, ?, ?)",
+                    [(sheet, trader_id, deposit) for trader_id, deposit in deposits],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+
+def parse_authorized_rows(rows):
+    # A2:D values from an authorized users sheet -> [tg_id, username, first_name, po_id]
+    users = []
+    for row in rows:
+        tg_id = row[0].strip() if row else ""
+        if not tg_id:
+            continue
+        try:
+            tg_id = int(tg_id)
+        except ValueError:
+            print(f"Skipping invalid ID: {tg_id}")
+            continue
+        row = list(row[1:4]) + [None] * (4 - len(row))
+        users.append([tg_id, *row[:3]])
+    return users
+
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+
+
+def save_snapshot(name, data):
+    # Written to a temp file and renamed, so a crash mid-write never leaves a torn snapshot
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(SNAPSHOT_DIR, f"{name}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(name, default=None):
+    path = os.path.join(SNAPSHOT_DIR, f"{name}.json")
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
@@ -0,0 +1,86 @@
+import os
+import asyncio
+import time
+
+from tg_dispatch import BACKGROUND, parse_error
+
+LOG_DIGEST_INTERVAL = float(os.getenv("LOG_DIGEST_INTERVAL", "30"))
+LOG_DIGEST_MAX_EVENTS = int(os.getenv("LOG_DIGEST_MAX_EVENTS", "25"))
+MAX_MESSAGE_LENGTH = 4096
+SEPARATOR = "\n\n"
+
+
+def split_digest(entries, limit=MAX_MESSAGE_LENGTH):
+    # Pack whole entries into messages under Telegram's length limit, so Markdown entities never straddle two messages
+    messages = []
+    current = ""
+    for entry in entries:
+        entry = entry[:limit]
+        if current and len(current) + len(SEPARATOR) + len(entry) > limit:
+            messages.append(current)
+            current = ""
+        current = f"{current}{SEPARATOR}{entry}" if current else entry
+    if current:
+        messages.append(current)
+    return messages
+
+
+class LogDigest:
+    # Buffers log-group posts and sends them per chat as one digest message every `interval`
+    # seconds, or sooner once `max_events` posts are waiting
+    def __init__(self, dispatcher, url, interval=LOG_DIGEST_INTERVAL, max_events=LOG_DIGEST_MAX_EVENTS):
+        self.dispatcher = dispatcher
+        self.url = url
+        self.interval = interval
+        self.max_events = max_events
+        self.pending = {}  # (chat_id, parse_mode) -> entries
+        self.count = 0
+        self.wakeup = asyncio.Event()
+        self.paused = False  # Set while the bot sheds load; entries added meanwhile are dropped, not queued
+        self.skipped = 0
+
+    def add(self, payload):
+        # Takes the sendMessage payload that would otherwise have been posted on its own
+        if self.paused:
+            self.skipped += 1
+            return
+        key = (payload["chat_id"], payload.get("parse_mode"))
+        entry = f"🕒 {time.strftime('%H:%M:%S')}\n{payload['text']}"
+        self.pending.setdefault(key, []).append(entry)
+        self.count += 1
+        if self.count >= self.max_events:
+            self.wakeup.set()
+
+    async def flush(self):
+        batch, self.pending, self.count = self.pending, {}, 0
+        for (chat_id, parse_mode), entries in batch.items():
+            for text in split_digest(entries):
+                try:
+                    await self.send(chat_id, text, parse_mode)
+                except Exception as e:
+                    print(f"❌ Failed to send log digest to {chat_id}: {e}\n{text}")
+
+    async def send(self, chat_id, text, parse_mode):
+        payload = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        response = await self.dispatcher.post(self.url, json=payload, priority=BACKGROUND)
+        description = parse_error(response)[0] if response.status_code == 400 else ""
+        if parse_mode and "parse entities" in description:
+            # One raw username with a _ or *, or an entry cut at the length limit, breaks the markup of the
+            # whole digest; plain text still gets every entry through
+            print(f"⚠️ Log digest for {chat_id} rejected as {parse_mode} ({description}), resending as plain text")
+            del payload["parse_mode"]
+            response = await self.dispatcher.post(self.url, json=payload, priority=BACKGROUND)
+        if response.status_code >= 400:
+            description, _ = parse_error(response)
+            print(f"❌ Telegram rejected log digest for {chat_id} ({response.status_code}: {description}):\n{text}")
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
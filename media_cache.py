@@ -0,0 +1,60 @@
+import asyncio
+
+import fast_json
+from local_store import load_snapshot, save_snapshot
+from tg_dispatch import parse_error
+
+
+class MediaCache:
+    # Sends a remote image by URL only until Telegram has it: the file_id from the first successful send is
+    # kept (and snapshotted, so restarts reuse it) and later sends pass that instead, so Telegram no longer
+    # re-downloads the URL each time. A file_id Telegram rejects is dropped and the URL is sent again.
+    def __init__(self, dispatcher, api_base, name):
+        self.dispatcher = dispatcher
+        self.api_base = api_base
+        self.name = name
+        self.file_ids = load_snapshot(name, {})  # URL -> file_id
+        self.locks = {}
+
+    async def send_photo(self, chat_id, url, **fields):
+        return await self.send("photo", chat_id, url, **fields)
+
+    async def send(self, kind, chat_id, url, **fields):
+        send_url = f"{self.api_base}/send{kind.capitalize()}"
+        file_id = self.file_ids.get(url)
+        if file_id:
+            response = await self.dispatcher.post(send_url, json={"chat_id": chat_id, kind: file_id, **fields})
+            if not self.rejected(response):
+                return response
+            print(f"⚠️ Cached file_id for {url} was rejected, sending the URL again")
+            self.forget(url, file_id)
+        # Only one send per URL fetches it; concurrent sends wait and reuse the file_id it captures
+        async with self.locks.setdefault(url, asyncio.Lock()):
+            file_id = self.file_ids.get(url)
+            if file_id:
+                return await self.dispatcher.post(send_url, json={"chat_id": chat_id, kind: file_id, **fields})
+            response = await self.dispatcher.post(send_url, json={"chat_id": chat_id, kind: url, **fields})
+            if response.status_code < 400:
+                self.remember(url, kind, response)
+            return response
+
+    def rejected(self, response):
+        if response.status_code != 400:
+            return False
+        description, _ = parse_error(response)
+        return "file" in description.lower()  # "wrong file identifier", "file reference expired", ...
+
+    def remember(self, url, kind, response):
+        result = fast_json.loads(response.content).get("result", {})
+        media = result.get(kind)
+        if isinstance(media, list):
+            media = media[-1] if media else None  # Photos come back as sizes, largest last
+        if not media:
+            return
+        self.file_ids[url] = media["file_id"]
+        save_snapshot(self.name, self.file_ids)
+
+    def forget(self, url, file_id):
+        if self.file_ids.get(url) == file_id:
+            del self.file_ids[url]
+            save_snapshot(self.name, self.file_ids)
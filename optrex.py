@@ -5,15 +5,14 @@ import threading
 import requests
 import time
 import json
-import gspread
 import re
-from oauth2client.service_account import ServiceAccountCredentials
 from flask import Flask
 from threading import Thread
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
 from dotenv import load_dotenv
+from sheets_session import open_worksheet
+from local_store import load_snapshot, save_snapshot
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, Updater, CallbackContext
-from oauth2client.service_account import ServiceAccountCredentials
 
 # Load environment variables
 load_dotenv()
@@ -21,32 +20,39 @@ TOKEN = os.getenv("TELEGRAM_TOKEN")
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(",")))
 LOG_CHANNEL_ID = int(os.getenv("LOG_CHANNEL_ID", "0"))
 
-# Google Sheets setup
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-spreadsheet = client.open("TelegramBotMembers")
-sheet = spreadsheet.worksheet("Sheet3")  # Us
+sheet = open_worksheet("TelegramBotMembers", "Sheet3")  # Us
+USERS_SNAPSHOT = "TelegramBotMembers-Sheet3"
 
 
 
-def load_users():
+def load_users(fallback=()):
     try:
-        users = sheet.col_values(1)
-        return set(map(int, users)) | set(ADMIN_IDS)
+        users = set(map(int, sheet.col_values(1))) | set(ADMIN_IDS)
+        save_snapshot(USERS_SNAPSHOT, sorted(users))
+        return users
     except Exception as e:
         print(f"Error loading users: {e}")
-        return set(ADMIN_IDS)
+        return set(fallback) | set(ADMIN_IDS)
+
+def reconcile_users():
+    global AUTHORIZED_USERS
+    AUTHORIZED_USERS = load_users(AUTHORIZED_USERS)
+    print(f"✅ Reconciled authorized users: {len(AUTHORIZED_USERS)}")
 
 # Save authorized users to Google Sheets
 def save_users():
+    save_snapshot(USERS_SNAPSHOT, sorted(AUTHORIZED_USERS))  # First, so a restart keeps the change even if Sheets fails
     sheet.clear()
     for idx, user_id in enumerate(AUTHORIZED_USERS):
         sheet.update_cell(idx + 1, 1, user_id)
 
-# Authorized users list
-AUTHORIZED_USERS = load_users()
+# Authorized users list: start from the last snapshot and reconcile with the sheet in the background
+snapshot = load_snapshot(USERS_SNAPSHOT)
+if snapshot:
+    AUTHORIZED_USERS = set(snapshot) | set(ADMIN_IDS)
+    Thread(target=reconcile_users, daemon=True).start()
+else:
+    AUTHORIZED_USERS = load_users()
 
 # List of OTC pairs
 otc_pairs = [
@@ -2,20 +2,13 @@ import asyncio
 import httpx
 from fastapi import FastAPI, Request
 from typing import Optional
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import json
-import os
+from sheets_session import open_worksheet
+from sheet_cache import DepositAccumulator
 
 RENDER_URL = "https://jamespocket2.onrender.com"
 
-# Setup Google Sheets
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-gs_creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-gs_client = gspread.authorize(gs_creds)
-spreadsheet = gs_client.open("TelegramBotMembers")
-sheet = spreadsheet.worksheet("Sheet7")
+sheet = open_worksheet("TelegramBotMembers", "Sheet7")
+deposit_accumulator = DepositAccumulator(sheet, width=7)
 
 # Lifespan hook
 async def lifespan(app: FastAPI):
@@ -30,7 +23,9 @@ async def lifespan(app: FastAPI):
                 print(f"❌ Ping failed: {e}")
             await asyncio.sleep(240)
     asyncio.create_task(self_ping_loop())
+    asyncio.create_task(deposit_accumulator.run())
     yield
+    await deposit_accumulator.flush()
     await ping_client.aclose()
 
 app = FastAPI(lifespan=lifespan)
@@ -67,57 +62,28 @@ async def handle_get_webhook(
             row.append(None)
 
         if trader_id and trader_id != "false":
-            cell = sheet.find(trader_id)
-            if cell:
-                row_number = cell.row
-                existing_row = sheet.row_values(row_number)
-                while len(existing_row) < 7:
-                    existing_row.append("")
-
-                current_sumdep = float(existing_row[1]) if existing_row[1] else 0.0
-                current_totaldep = float(existing_row[2]) if existing_row[2] else 0.0
-                current_reg = int(existing_row[3]) if existing_row[3] else 0
-                current_conf = int(existing_row[4]) if existing_row[4] else 0
-                current_ftd = int(existing_row[5]) if existing_row[5] else 0
-                current_dep = float(existing_row[6]) if existing_row[6] else 0.0
-
-                updated_sumdep = current_sumdep
-                updated_totaldep = current_totaldep
-                updated_reg = current_reg
-                updated_conf = current_conf
-                updated_ftd = current_ftd
-                updated_dep = current_dep
-
-                if reg == "true":
-                    updated_reg = 1
-                if conf == "true":
-                    updated_conf = 1
-                if ftd == "true":
-                    updated_ftd = 1
-                if dep == "true":
-                    try:
-                        new_dep = float(sumdep) if sumdep else 0.0
-                        updated_sumdep += new_dep
-                        updated_totaldep += new_dep
-                        updated_dep = new_dep
-                    except ValueError:
-                        pass
-
-                final_row = [
-                    trader_id,
-                    updated_sumdep,
-                    updated_totaldep,
-                    updated_reg,
-                    updated_conf,
-                    updated_ftd,
-                    updated_dep
-                ]
-
-                sheet.update(f"A{row_number}:G{row_number}", [final_row])
-                print(f"✅ Updated row {row_number} with selective values: {final_row}")
+            increments = {}
+            updates = {}
+            if reg == "true":
+                updates[4] = 1
+            if conf == "true":
+                updates[5] = 1
+            if ftd == "true":
+                updates[6] = 1
+            if dep == "true":
+                try:
+                    new_dep = float(sumdep) if sumdep else 0.0
+                    increments[2] = new_dep  # sumdep
+                    increments[3] = new_dep  # totaldep
+                    updates[7] = new_dep
+                except ValueError:
+                    pass
+
+            status, final_row = await deposit_accumulator.submit(trader_id, row, increments, updates)
+            if status == "updated":
+                print(f"✅ Updated trader {trader_id} with selective values: {final_row}")
             else:
-                sheet.append_row(row)
-                print("✅ Appended to Google Sheet:", row)
+                print("✅ Appended to Google Sheet:", final_row)
 
     except Exception as e:
         print("❌ Error updating/appending to Google Sheet.")
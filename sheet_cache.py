@@ -0,0 +1,363 @@
+import asyncio
+import time
+import zlib
+
+from sheets_async import run_sheets
+from local_store import parse_authorized_rows
+
+
+class DepositIndex:
+    # Mirrors a trader sheet (A = trader ID, B = total deposit) into the local store and serves lookups from it
+    def __init__(self, worksheet, store, name, ttl=60, miss_reload_after=5):
+        self.worksheet = worksheet
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.miss_reload_after = miss_reload_after
+        self.loaded_at = 0.0
+
+    def load(self):
+        rows = self.worksheet.get("A2:B")  # One batched range read instead of two full columns
+        deposits = []
+        for row in rows:
+            trader_id = row[0].strip() if row else ""
+            if not trader_id:
+                continue
+            try:
+                deposit = float(row[1])
+            except (ValueError, IndexError):
+                deposit = None
+            deposits.append((trader_id, deposit))  # First row wins, like the old linear scan
+        self.store.replace_deposits(self.name, deposits)
+        self.loaded_at = time.monotonic()
+        print(f"📥 Loaded deposit index: {len(deposits)} rows from {self.name}")
+
+    def age(self):
+        return time.monotonic() - self.loaded_at
+
+    def get(self, trader_id: str) -> float | None:
+        trader_id = trader_id.strip()
+        if self.age() > self.ttl:
+            self.load()
+        found, deposit = self.store.deposit(self.name, trader_id)
+        if not found and self.age() > self.miss_reload_after:
+            # A trader registered moments ago may not be in the store yet
+            self.load()
+            found, deposit = self.store.deposit(self.name, trader_id)
+        return deposit
+
+    async def refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 2)
+            try:
+                await run_sheets(self.load)
+            except Exception as e:
+                print(f"❌ Failed to refresh deposit index: {e}")
+
+
+def rows_checksum(rows, checksum=0):
+    # Chained CRC, so the checksum of the whole range can be extended with a tail read
+    for row in rows:
+        checksum = zlib.crc32("\x1f".join(row).encode() + b"\n", checksum)
+    return checksum
+
+
+class AuthorizedUserSync:
+    # Keeps the local store in step with an authorized users sheet (A2:D). Each pass is one small read:
+    # the last row seen plus whatever follows it. New rows after it are merged into the store; if the last
+    # row no longer holds what it did, rows above it were deleted, inserted or moved, and the whole range is
+    # reloaded, so revocations show up on the next pass. In-place edits to earlier rows are caught by a full
+    # read every verify_interval seconds, compared by checksum.
+    # The poll interval shrinks while rows keep arriving and backs off when idle.
+    def __init__(self, worksheet, store, name, min_interval=10, max_interval=300, verify_interval=3600):
+        self.worksheet = worksheet
+        self.store = store
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.verify_interval = verify_interval
+        self.interval = min_interval
+        self.seen_rows = 0
+        self.last_row = []  # Values of the last row seen, to tell an append from a shift
+        self.checksum = None
+        self.verified_at = 0.0
+
+    def load(self):
+        # Returns True when the sheet differed from what was last seen
+        rows = self.worksheet.get("A2:D")
+        checksum = rows_checksum(rows)
+        changed = checksum != self.checksum
+        if changed:
+            self.store.replace_users(self.name, parse_authorized_rows(rows))
+            self.checksum = checksum
+        self.seen_rows = len(rows)
+        self.last_row = list(rows[-1]) if rows else []
+        self.verified_at = time.monotonic()
+        return changed
+
+    def sync_tail(self):
+        last = self.seen_rows + 1  # Sheet row of the last row seen; row 1 is the header
+        if self.seen_rows:
+            last_range, tail = self.worksheet.batch_get([f"A{last}:D{last}", f"A{last + 1}:D"])
+            if (list(last_range[0]) if last_range else []) != self.last_row:
+                return None if self.load() else []
+        else:
+            tail = self.worksheet.get("A2:D")
+        rows = [list(row) for row in tail]
+        if not rows:
+            return []
+        users = parse_authorized_rows(rows)
+        self.store.merge_users(self.name, users)
+        self.checksum = rows_checksum(rows, self.checksum)
+        self.seen_rows += len(rows)
+        self.last_row = rows[-1]
+        print(f"📥 Synced {len(users)} new authorized users from {self.name}")
+        return [user[0] for user in users]
+
+    def step(self):
+        # New TG IDs since the last pass, or None after a full reload that changed the store
+        if self.checksum is None or time.monotonic() - self.verified_at > self.verify_interval:
+            return None if self.load() else []
+        return self.sync_tail()
+
+    async def run(self, on_change):
+        # on_change(added) runs on the Sheets pool; added is None when the whole set must be rebuilt
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                added = await run_sheets(self.step)
+                if added is None or added:
+                    await run_sheets(on_change, added)
+                    self.interval = max(self.min_interval, self.interval / 2)
+                else:
+                    self.interval = min(self.max_interval, self.interval * 1.5)
+            except Exception as e:
+                print(f"❌ Failed to sync authorized users: {e}")
+
+
+class AuthorizedUserWriter:
+    # Write-behind queue for the authorized users sheet (A = TG ID, B = username, C = name, D = PO ID)
+    def __init__(self, worksheet, store, name, flush_interval=0.3, retry_delay=5):
+        self.worksheet = worksheet
+        self.store = store
+        self.name = name
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.pending = {}
+        self.rows = None
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+
+    def load_rows(self):
+        tg_ids = self.worksheet.col_values(1)
+        rows = {}
+        for row, tg_id in enumerate(tg_ids, start=1):
+            rows.setdefault(tg_id.strip(), row)
+        self.rows = rows
+
+    def queue(self, tg_id: int, po_id: str, username: str = None, first_name: str = None):
+        # Later saves for the same user replace earlier ones that have not been written yet
+        values = [tg_id, username or "Unknown", first_name or "Trader", po_id]
+        self.store.upsert_user(self.name, *values)  # Marked dirty until the sheet has it
+        self.pending[str(tg_id)] = values
+        self.wakeup.set()
+
+    def requeue_dirty(self):
+        # Push saves that never reached the sheet, e.g. because the process was restarted
+        for values in self.store.dirty_users(self.name):
+            self.pending.setdefault(str(values[0]), values)
+        if self.pending:
+            self.wakeup.set()
+
+    def write(self, batch):
+        # Row numbers are re-read on every flush, since rows may have been deleted or inserted in the sheet
+        # since the last one, and a stale number would overwrite another user's row
+        self.load_rows()
+        updates = []
+        appends = []
+        for key, values in batch.items():
+            row = self.rows.get(key)
+            if row:
+                updates.append({"range": f"B{row}:D{row}", "values": [values[1:]]})
+            else:
+                appends.append(values)
+        if updates:
+            self.worksheet.batch_update(updates)
+        if appends:
+            self.worksheet.append_rows(appends)
+        self.store.mark_clean(self.name, batch.values())
+        print(f"💾 Flushed authorized users: {len(updates)} updated, {len(appends)} added")
+
+    async def flush(self):
+        async with self.lock:  # One writer at a time, so a user pending in both can't be appended twice
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            try:
+                await run_sheets(self.write, batch)
+            except Exception:
+                for key, values in batch.items():
+                    self.pending.setdefault(key, values)
+                raise
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.flush_interval)  # Let a burst of saves coalesce
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Failed to flush authorized users: {e}")
+                await asyncio.sleep(self.retry_delay)
+                self.wakeup.set()
+
+
+def to_float(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class DepositAccumulator:
+    # Serializes per-trader deposit changes from the postback receivers and writes them in batches.
+    # A batch that fails is queued again ahead of newer changes, up to max_attempts flushes per trader.
+    # Column A holds the trader ID; columns are 1-based like update_cell().
+    def __init__(self, worksheet, width=2, flush_interval=0.5, retry_delay=5, max_attempts=5):
+        self.worksheet = worksheet
+        self.width = width
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.pending = {}
+        self.attempts = {}  # trader ID -> failed flushes of its queued changes so far
+        self.rows = None
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+
+    def load_rows(self):
+        trader_ids = self.worksheet.col_values(1)
+        rows = {}
+        for row, trader_id in enumerate(trader_ids, start=1):
+            rows.setdefault(trader_id.strip(), row)
+        self.rows = rows
+
+    def row_range(self, row):
+        return f"A{row}:{chr(64 + self.width)}{row}"
+
+    def submit(self, trader_id, new_row, increments=None, updates=None):
+        # Resolves to ("created" | "updated", row values) once the batch holding it is written
+        future = asyncio.get_running_loop().create_future()
+        ops = self.pending.setdefault(str(trader_id).strip(), [])
+        ops.append((new_row, increments or {}, updates or {}, future))
+        self.wakeup.set()
+        return future
+
+    def read_current(self, batch):
+        # Current values of the batch's existing rows, or None if a row no longer holds its trader
+        existing = [trader_id for trader_id in batch if trader_id in self.rows]
+        current = {}
+        if existing:
+            ranges = [self.row_range(self.rows[trader_id]) for trader_id in existing]
+            for trader_id, value_range in zip(existing, self.worksheet.batch_get(ranges)):
+                values = list(value_range[0]) if value_range else []
+                if not values or str(values[0]).strip() != trader_id:
+                    return None
+                current[trader_id] = values
+        return current
+
+    def write(self, batch, written):
+        # Row numbers are re-read on every flush: the other postback services append to the same sheet,
+        # and admins delete or sort rows, so a cached row number can point at another trader.
+        # Outcomes of the traders whose rows reached the sheet are put in `written`, so that when the
+        # append fails after the updates went through, only the rest are retried
+        for _ in range(3):
+            self.load_rows()
+            current = self.read_current(batch)
+            if current is not None:
+                break
+            print("⚠️ Sheet rows moved while flushing deposits, re-reading trader IDs")
+        else:
+            raise RuntimeError("Sheet rows kept moving, deposits not written")
+        updates = []
+        appends = []
+        updated = {}
+        appended = {}
+        for trader_id, ops in batch.items():
+            values = current.get(trader_id)
+            original = list(values) if values is not None else None
+            outcomes = []
+            for new_row, increments, sets, future in ops:
+                if values is None:
+                    values = list(new_row)
+                    status = "created"
+                else:
+                    values += [""] * (self.width - len(values))
+                    for col, amount in increments.items():
+                        values[col - 1] = to_float(values[col - 1]) + amount
+                    for col, value in sets.items():
+                        values[col - 1] = value
+                    status = "updated"
+                outcomes.append((future, status, list(values)))
+            if original is None:
+                appends.append(values)
+                appended[trader_id] = outcomes
+            else:
+                if values != original:
+                    updates.append({"range": self.row_range(self.rows[trader_id]), "values": [values]})
+                updated[trader_id] = outcomes
+        if updates:
+            self.worksheet.batch_update(updates)
+        written.update(updated)
+        if appends:
+            self.worksheet.append_rows(appends)
+        written.update(appended)
+        print(f"💾 Flushed deposits: {len(updates)} updated, {len(appends)} added")
+
+    def resolve(self, written):
+        for trader_id, outcomes in written.items():
+            self.attempts.pop(trader_id, None)
+            for future, status, values in outcomes:
+                if not future.done():
+                    future.set_result((status, values))
+
+    async def flush(self):
+        async with self.lock:  # One writer at a time, so no increment is read-modified-written twice
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            written = {}
+            try:
+                await run_sheets(self.write, batch, written)
+            except Exception as e:
+                self.resolve(written)
+                for trader_id, ops in batch.items():
+                    if trader_id in written:
+                        continue
+                    attempts = self.attempts.get(trader_id, 0) + 1
+                    # After a timeout the write may still land, so retrying could apply the increments twice
+                    if isinstance(e, asyncio.TimeoutError) or attempts >= self.max_attempts:
+                        self.attempts.pop(trader_id, None)
+                        for *_, future in ops:
+                            if not future.done():
+                                future.set_exception(e)
+                    else:
+                        # Ahead of changes queued since, so they still apply in arrival order
+                        self.attempts[trader_id] = attempts
+                        self.pending[trader_id] = ops + self.pending.get(trader_id, [])
+                raise
+            self.resolve(written)
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.flush_interval)  # Let concurrent postbacks land in the same batch
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Failed to flush deposits: {e}")
+                if self.pending:
+                    await asyncio.sleep(self.retry_delay)
+                    self.wakeup.set()
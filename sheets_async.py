@@ -0,0 +1,58 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# gspread is blocking; every Sheets call from async code goes through this bounded pool
+SHEETS_MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", "8"))
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", "20"))
+
+sheets_executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix="sheets")
+
+
+async def run_sheets(func, *args, timeout=SHEETS_TIMEOUT, **kwargs):
+    # On timeout the caller gets asyncio.TimeoutError; the worker thread finishes the call on its own
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    return await asyncio.wait_for(loop.run_in_executor(sheets_executor, call), timeout)
+
+
+class AsyncWorksheet:
+    # Awaitable versions of the gspread Worksheet methods the bots use
+    def __init__(self, worksheet, timeout=SHEETS_TIMEOUT):
+        self.worksheet = worksheet
+        self.timeout = timeout
+
+    async def col_values(self, col):
+        return await run_sheets(self.worksheet.col_values, col, timeout=self.timeout)
+
+    async def row_values(self, row):
+        return await run_sheets(self.worksheet.row_values, row, timeout=self.timeout)
+
+    async def find(self, query):
+        return await run_sheets(self.worksheet.find, query, timeout=self.timeout)
+
+    async def cell(self, row, col):
+        return await run_sheets(self.worksheet.cell, row, col, timeout=self.timeout)
+
+    async def update(self, range_name, values):
+        return await run_sheets(self.worksheet.update, range_name, values, timeout=self.timeout)
+
+    async def update_cell(self, row, col, value):
+        return await run_sheets(self.worksheet.update_cell, row, col, value, timeout=self.timeout)
+
+    async def append_row(self, values):
+        return await run_sheets(self.worksheet.append_row, values, timeout=self.timeout)
+
+    async def delete_rows(self, index):
+        return await run_sheets(self.worksheet.delete_rows, index, timeout=self.timeout)
+
+
+def run_sheets_in_background(func, label):
+    # Fire-and-forget sync job that logs its failure instead of leaving an unretrieved task exception
+    async def runner():
+        try:
+            await run_sheets(func)
+        except Exception as e:
+            print(f"❌ {label} failed: {e}")
+    return asyncio.create_task(runner())
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+
+import gspread
+from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import Request
+from requests.adapters import HTTPAdapter
+
+from sheets_async import SHEETS_MAX_WORKERS
+
+# One authorized gspread client per credentials env var, shared by everything in the process.
+# Its requests session keeps connections to the Sheets API alive, opened spreadsheets and
+# worksheets are cached by name, and the access token is refreshed by a background thread
+# before it expires so no Sheets call ever waits on a token round trip.
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+TOKEN_REFRESH_MARGIN = int(os.getenv("SHEETS_TOKEN_REFRESH_MARGIN", "600"))
+TOKEN_RETRY_DELAY = 30
+
+
+class SheetsSession:
+    def __init__(self, creds_env="GOOGLE_CREDENTIALS"):
+        creds_dict = json.loads(os.getenv(creds_env))
+        self.creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPE)
+        self.client = gspread.authorize(self.creds)
+        http = getattr(self.client, "http_client", self.client)  # gspread 6 moved the session onto http_client
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SHEETS_MAX_WORKERS)
+        http.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.spreadsheets = {}
+        self.worksheets = {}
+        threading.Thread(target=self.refresh_loop, daemon=True, name=f"sheets-token-{creds_env}").start()
+
+    def spreadsheet(self, name):
+        with self.lock:
+            spreadsheet = self.spreadsheets.get(name)
+            if spreadsheet is None:
+                spreadsheet = self.spreadsheets[name] = self.client.open(name)
+            return spreadsheet
+
+    def worksheet(self, spreadsheet_name, name=None):
+        # name=None is the first worksheet, like Spreadsheet.sheet1
+        key = (spreadsheet_name, name)
+        worksheet = self.worksheets.get(key)
+        if worksheet is None:
+            spreadsheet = self.spreadsheet(spreadsheet_name)
+            with self.lock:
+                worksheet = self.worksheets.get(key)
+                if worksheet is None:
+                    worksheet = spreadsheet.sheet1 if name is None else spreadsheet.worksheet(name)
+                    self.worksheets[key] = worksheet
+        return worksheet
+
+    def refresh_token(self):
+        self.creds.refresh(Request())
+        print("🔑 Refreshed Google Sheets token")
+
+    def refresh_loop(self):
+        while True:
+            try:
+                self.refresh_token()
+                now = datetime.now(timezone.utc).replace(tzinfo=None)  # creds.expiry is naive UTC
+                remaining = (self.creds.expiry - now).total_seconds()
+                time.sleep(max(remaining - TOKEN_REFRESH_MARGIN, TOKEN_RETRY_DELAY))
+            except Exception as e:
+                print(f"❌ Failed to refresh Google Sheets token: {e}")
+                time.sleep(TOKEN_RETRY_DELAY)
+
+
+class WorksheetHandle:
+    # Stands in for a gspread Worksheet and opens it on first use, so importing a bot does no network I/O
+    def __init__(self, session, spreadsheet_name, name=None):
+        self.session = session
+        self.spreadsheet_name = spreadsheet_name
+        self.worksheet_name = name
+
+    def __getattr__(self, attr):
+        return getattr(self.session.worksheet(self.spreadsheet_name, self.worksheet_name), attr)
+
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def get_session(creds_env="GOOGLE_CREDENTIALS"):
+    with sessions_lock:
+        session = sessions.get(creds_env)
+        if session is None:
+            session = sessions[creds_env] = SheetsSession(creds_env)
+        return session
+
+
+def open_worksheet(spreadsheet_name, name=None, creds_env="GOOGLE_CREDENTIALS"):
+    return WorksheetHandle(get_session(creds_env), spreadsheet_name, name)
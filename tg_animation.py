@@ -0,0 +1,31 @@
+import time
+
+
+class EditAnimation:
+    # Plays an editMessageText animation inside the chat's rate budget. A frame is sent only when the
+    # dispatcher has a slot free right now and taking it still leaves one for the final frame at its due
+    # time (final_in seconds from now); otherwise the frame is dropped. finish() is always sent.
+    def __init__(self, dispatcher, url, chat_id, message_id, final_in=None, **fields):
+        self.dispatcher = dispatcher
+        self.url = url
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.final_at = time.monotonic() + final_in if final_in is not None else None
+        self.fields = fields  # Extra payload keys sent with every frame, e.g. parse_mode
+        self.last_text = None
+        self.dropped = 0
+
+    def payload(self, text, fields):
+        return {"chat_id": self.chat_id, "message_id": self.message_id, "text": text, **self.fields, **fields}
+
+    async def frame(self, text, **fields):
+        if text == self.last_text:
+            return  # Telegram rejects edits that don't change the message
+        if not self.dispatcher.try_reserve(self.chat_id, self.final_at):
+            self.dropped += 1
+            return
+        self.last_text = text
+        await self.dispatcher.post(self.url, json=self.payload(text, fields), reserved=True)
+
+    async def finish(self, text, **fields):
+        return await self.dispatcher.post(self.url, json=self.payload(text, fields))
@@ -0,0 +1,227 @@
+import os
+import asyncio
+import random
+import time
+from collections import Counter, deque
+
+import httpx
+
+import fast_json
+from tg_payloads import PreparedPayload
+
+# Telegram's documented send limits
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))       # messages per second across all chats
+CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))            # messages per second in one private chat
+GROUP_RATE = float(os.getenv("TG_GROUP_RATE", str(20 / 60)))  # messages per second in one group or channel
+CHAT_BURST = 3
+GROUP_BURST = 3
+MAX_IDLE_BUCKETS = 10000
+
+# These don't count as messages in a chat, so they only take a global token
+CHATLESS_METHODS = {"answerCallbackQuery", "sendChatAction", "deleteMessage", "getChat"}
+# Safe to resend after a timeout or 5xx: repeating them can't produce a second message
+IDEMPOTENT_METHODS = {"editMessageText", "editMessageReplyMarkup", "deleteMessage", "answerCallbackQuery", "sendChatAction", "getChat"}
+MAX_ATTEMPTS = int(os.getenv("TG_MAX_ATTEMPTS", "4"))
+MAX_RETRY_AFTER = 30  # A signal delivered later than this is worse than none
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
+
+# Priority lanes for the global budget: a free global slot always goes to the lowest lane with a waiter
+INTERACTIVE = 0  # Replies to the user who is waiting on them
+BACKGROUND = 1   # Log-channel posts and digests
+BULK = 2         # Admin broadcasts and media forwards to channels
+
+
+class TokenBucket:
+    # Reservation-style bucket (GCRA): callers book the next free slot and sleep until it, instead of polling
+    def __init__(self, rate, burst=1):
+        self.interval = 1 / rate
+        self.burst = burst
+        self.tat = 0.0  # theoretical arrival time of the next request once the burst is used up
+
+    def ready_at(self, now):
+        return max(now, self.tat - (self.burst - 1) * self.interval)
+
+    def take(self, at):
+        self.tat = max(self.tat, at) + self.interval
+
+    def pause(self, until):
+        # No slot before `until`, e.g. after a 429 with retry_after
+        self.tat = max(self.tat, until + (self.burst - 1) * self.interval)
+
+    def can_take(self, now, keep_free_at=None):
+        # A slot is free now and, if keep_free_at is given, taking it still leaves one free then
+        if self.ready_at(now) > now:
+            return False
+        if keep_free_at is None:
+            return True
+        return max(self.tat, now) + self.interval - (self.burst - 1) * self.interval <= keep_free_at
+
+
+class TelegramDispatcher:
+    # Every Bot API call goes through post(), which waits for a global token and, for messages,
+    # a token from the target chat's bucket. Groups and channels (negative or @name chat IDs)
+    # get the slower group bucket, so a busy log channel only queues behind itself.
+    def __init__(self, client=None):
+        self.client = client
+        self.global_bucket = TokenBucket(GLOBAL_RATE, burst=int(GLOBAL_RATE))
+        self.chat_buckets = {}
+        self.failures = Counter()
+        self.lanes = [deque(), deque(), deque()]  # Futures waiting for a global slot, per priority
+        self.granter = None
+        self.pauses = {}  # (method, chat_id or None) -> monotonic time it may be called again, after a 429
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_IDLE_BUCKETS:
+                self.prune()
+            if str(chat_id).startswith(("-", "@")):
+                bucket = TokenBucket(GROUP_RATE, burst=GROUP_BURST)
+            else:
+                bucket = TokenBucket(CHAT_RATE, burst=CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def prune(self):
+        # A bucket whose last slot is in the past is equivalent to a fresh one
+        now = time.monotonic()
+        self.chat_buckets = {chat_id: b for chat_id, b in self.chat_buckets.items() if b.tat > now}
+        self.pauses = {key: until for key, until in self.pauses.items() if until > now}
+
+    async def wait(self, bucket):
+        now = time.monotonic()
+        at = bucket.ready_at(now)
+        bucket.take(at)
+        if at > now:
+            await asyncio.sleep(at - now)
+
+    async def acquire(self, method, chat_id=None, priority=INTERACTIVE):
+        # Chat slot first, global slot second: a reservation far ahead in one chat must not hold a global slot
+        if chat_id is not None and method not in CHATLESS_METHODS:
+            await self.wait(self.chat_bucket(chat_id))
+        await self.wait_global(priority)
+
+    async def wait_global(self, priority=INTERACTIVE):
+        # Unlike chat slots, global slots are not booked ahead: a waiter queues in its lane and granter()
+        # hands out each slot as it comes free, so a bulk backlog never sits in front of a user reply
+        now = time.monotonic()
+        if self.global_free(now, priority):
+            self.global_bucket.take(now)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.lanes[priority].append(waiter)
+        if self.granter is None or self.granter.done():
+            self.granter = asyncio.create_task(self.grant())
+        await waiter
+
+    async def grant(self):
+        while any(self.lanes):
+            now = time.monotonic()
+            at = self.global_bucket.ready_at(now)
+            if at > now:
+                await asyncio.sleep(at - now)
+                continue
+            waiter = next(lane for lane in self.lanes if lane).popleft()
+            if waiter.done():
+                continue  # Cancelled while queued
+            self.global_bucket.take(now)
+            waiter.set_result(None)
+
+    def global_free(self, now, priority=INTERACTIVE):
+        # A global slot is free now and nobody of the same or higher priority is queued for it
+        return self.global_bucket.ready_at(now) <= now and not any(self.lanes[:priority + 1])
+
+    def throttled(self, method, chat_id, until):
+        # Pause only what Telegram limited: a message's target chat, a non-message call (deleteMessage,
+        # getChat, ...) for just that chat, or a call with no chat (getUpdates, answerCallbackQuery, ...)
+        # for that method alone. A 429 doesn't say whether the limit was global, so no 429 pauses every chat.
+        if chat_id is not None and method not in CHATLESS_METHODS:
+            self.chat_bucket(chat_id).pause(until)
+        else:
+            key = (method, chat_id)
+            self.pauses[key] = max(self.pauses.get(key, 0.0), until)
+
+    async def wait_paused(self, method, chat_id):
+        key = (method, chat_id)
+        until = self.pauses.get(key)
+        if until is None:
+            return
+        delay = until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif self.pauses.get(key) == until:
+            del self.pauses[key]
+
+    def try_reserve(self, chat_id, keep_free_at=None):
+        # Non-blocking: take a chat slot only if nothing is queued globally or in the chat right now
+        now = time.monotonic()
+        bucket = self.chat_bucket(chat_id)
+        if not self.global_free(now) or not bucket.can_take(now, keep_free_at):
+            return False
+        bucket.take(now)
+        return True
+
+    def record_failure(self, method, reason, detail=""):
+        self.failures[(method, reason)] += 1
+        print(f"⚠️ Telegram {method} failed ({reason}): {detail}")
+
+    def failure_counts(self):
+        # JSON-friendly view of `failures` for the healthcheck, e.g. {"sendMessage 429": 3}
+        return {f"{method} {reason}": count for (method, reason), count in self.failures.most_common()}
+
+    async def post(self, url, json=None, reserved=False, priority=INTERACTIVE, **kwargs):
+        # reserved=True: the chat slot was already taken with try_reserve()
+        method = url.rsplit("/", 1)[-1]
+        chat_id = json.get("chat_id") if json else None
+        if json is not None:
+            # Encode here with the fast codec (or send pre-serialized bytes as they are) instead of letting httpx use json.dumps
+            kwargs["content"] = json.content() if isinstance(json, PreparedPayload) else fast_json.dumps(json)
+            kwargs["headers"] = {"content-type": "application/json"}
+            json = None
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self.wait_paused(method, chat_id)
+            if reserved and attempt == 1:
+                await self.wait_global(priority)
+            else:
+                await self.acquire(method, chat_id, priority)
+            try:
+                response = await self.client.post(url, json=json, **kwargs)
+            except httpx.TransportError as e:
+                self.record_failure(method, type(e).__name__, str(e))
+                # A request that never connected never reached Telegram, so any method can be resent
+                unsent = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if attempt < MAX_ATTEMPTS and (unsent or method in IDEMPOTENT_METHODS):
+                    await asyncio.sleep(backoff(attempt))
+                    continue
+                raise
+            if response.status_code < 400:
+                return response
+            description, retry_after = parse_error(response)
+            self.record_failure(method, response.status_code, description)
+            if attempt == MAX_ATTEMPTS:
+                break
+            if response.status_code == 429 and retry_after <= MAX_RETRY_AFTER:
+                # Throttled requests were not delivered, so resending is always safe
+                self.throttled(method, chat_id, time.monotonic() + retry_after)
+                continue
+            if response.status_code >= 500 and method in IDEMPOTENT_METHODS:
+                await asyncio.sleep(backoff(attempt))
+                continue
+            break
+        return response
+
+
+def backoff(attempt):
+    # Full jitter, so clients retrying together don't hit the API in lockstep
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_error(response):
+    # Bot API error body: {"ok": false, "error_code": 429, "description": "...", "parameters": {"retry_after": 5}}
+    try:
+        body = fast_json.loads(response.content)
+    except ValueError:
+        return response.text[:200], 1
+    retry_after = (body.get("parameters") or {}).get("retry_after", 1)
+    return body.get("description", ""), retry_after
@@ -0,0 +1,66 @@
+import os
+
+import httpx
+
+# Shared outbound client for the Bot API. HTTP/2 multiplexes every request to api.telegram.org over
+# a few connections, so a burst of animations no longer opens a socket per request or queues for the pool.
+HTTP2 = os.getenv("TG_HTTP2", "1") == "1"
+MAX_CONNECTIONS = int(os.getenv("TG_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE = int(os.getenv("TG_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("TG_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.getenv("TG_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("TG_READ_TIMEOUT", "10"))
+WRITE_TIMEOUT = float(os.getenv("TG_WRITE_TIMEOUT", "10"))
+POOL_TIMEOUT = float(os.getenv("TG_POOL_TIMEOUT", "5"))
+
+try:
+    import h2  # noqa: F401  httpx only speaks HTTP/2 with the optional h2 package
+except ImportError:
+    if HTTP2:
+        print("⚠️ h2 is not installed; the Bot API client falls back to HTTP/1.1")
+    HTTP2 = False
+
+
+class CountingTransport(httpx.AsyncHTTPTransport):
+    # Tracks request counts and in-flight concurrency so pool pressure shows up in stats()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def handle_async_request(self, request):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.in_flight -= 1
+            self.requests += 1
+
+    def stats(self):
+        connections = list(getattr(self._pool, "connections", []))
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "connections": len(connections),
+            "idle_connections": sum(1 for c in connections if c.is_idle()),
+        }
+
+
+def create_client(http2=None, max_connections=None, max_keepalive=None, **kwargs):
+    http2 = HTTP2 if http2 is None else http2
+    limits = httpx.Limits(
+        max_connections=max_connections or MAX_CONNECTIONS,
+        max_keepalive_connections=max_keepalive or MAX_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=WRITE_TIMEOUT, pool=POOL_TIMEOUT)
+    transport = CountingTransport(http2=http2, limits=limits, **kwargs)
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+def pool_stats(client):
+    transport = getattr(client, "_transport", None)
+    return transport.stats() if isinstance(transport, CountingTransport) else {}
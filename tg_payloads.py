@@ -0,0 +1,33 @@
+from fast_json import dumps as encode
+
+
+class StaticMessage:
+    # A Bot API request body whose fields never change, serialized once at import.
+    # Only chat_id is spliced in per request.
+    def __init__(self, **fields):
+        if not fields:
+            raise ValueError("StaticMessage needs at least one field besides chat_id")
+        self.tail = encode(fields)[1:]  # '"text":...}' without the opening brace
+
+    def to(self, chat_id):
+        return PreparedPayload(self, chat_id)
+
+
+class PreparedPayload:
+    __slots__ = ("message", "chat_id")
+
+    def __init__(self, message, chat_id):
+        self.message = message
+        self.chat_id = chat_id
+
+    def get(self, key, default=None):
+        # Lets the dispatcher read chat_id the same way it does from a dict payload
+        return self.chat_id if key == "chat_id" else default
+
+    def content(self):
+        return b'{"chat_id":' + encode(self.chat_id) + b"," + self.message.tail
+
+
+def static_keyboard(buttons, row_size=3, resize_keyboard=True):
+    # Reply keyboard laid out in rows, as every bot builds for its pair list
+    return {"keyboard": [buttons[i:i + row_size] for i in range(0, len(buttons), row_size)], "resize_keyboard": resize_keyboard}
@@ -0,0 +1,101 @@
+import os
+import asyncio
+
+import httpx
+
+import fast_json
+from tg_dispatch import parse_error
+
+# "webhook" (the default) or "polling": long-poll getUpdates instead, e.g. on a box behind NAT with no public URL
+INGESTION = os.getenv("TG_INGESTION", "webhook")
+POLL_LIMIT = 100  # The most getUpdates returns at once
+POLL_TIMEOUT = int(os.getenv("TG_POLL_TIMEOUT", "50"))
+POLL_RETRY_DELAY = 5
+# Updates queued or in progress at which no new batch is fetched (and the last one stays unconfirmed)
+POLL_MAX_PENDING = int(os.getenv("TG_POLL_MAX_PENDING", str(POLL_LIMIT)))
+POLL_BACKOFF = 0.5
+
+
+class UpdatePoller:
+    # Fetches updates in batches of up to POLL_LIMIT with long-polling getUpdates and hands each one to
+    # receive(), the same path webhook() feeds, so the worker pool handles the batch concurrently. A batch
+    # is confirmed (by asking for the next one with offset past it) only after all of it has been dispatched,
+    # and no next batch is asked for while the queue is backed up, so the backlog waits at Telegram instead
+    # of in memory.
+    def __init__(self, dispatcher, api_base, receive, queue, allowed_updates=("message", "callback_query")):
+        self.dispatcher = dispatcher
+        self.api_base = api_base
+        self.receive = receive
+        self.queue = queue
+        self.allowed_updates = list(allowed_updates)
+        self.offset = None
+        self.task = None
+
+    async def run(self):
+        # getUpdates is refused while a webhook is set; pending updates are kept and fetched below
+        try:
+            await self.dispatcher.post(f"{self.api_base}/deleteWebhook")
+        except httpx.TransportError as e:
+            print(f"❌ deleteWebhook failed, getUpdates will be refused while a webhook is set: {e}")
+        print(f"✅ Polling for updates (up to {POLL_LIMIT} per batch)")
+        while True:
+            while self.queue.pending >= POLL_MAX_PENDING:
+                await asyncio.sleep(POLL_BACKOFF)
+            body = {"limit": POLL_LIMIT, "timeout": POLL_TIMEOUT, "allowed_updates": self.allowed_updates}
+            if self.offset is not None:
+                body["offset"] = self.offset
+            try:
+                response = await self.dispatcher.client.post(
+                    f"{self.api_base}/getUpdates",
+                    content=fast_json.dumps(body),
+                    headers={"content-type": "application/json"},
+                    timeout=httpx.Timeout(POLL_TIMEOUT + 10, connect=10),  # Held open up to POLL_TIMEOUT by design
+                )
+            except httpx.TransportError as e:
+                print(f"❌ getUpdates failed: {e}")
+                await asyncio.sleep(POLL_RETRY_DELAY)
+                continue
+            if response.status_code != 200:
+                description, retry_after = parse_error(response)
+                print(f"❌ getUpdates failed ({response.status_code}): {description}")
+                await asyncio.sleep(max(retry_after, POLL_RETRY_DELAY))
+                continue
+            try:
+                updates = fast_json.loads(response.content).get("result", [])
+            except ValueError as e:
+                print(f"❌ getUpdates returned a malformed body: {e}")
+                await asyncio.sleep(POLL_RETRY_DELAY)
+                continue
+            for data in updates:
+                try:
+                    self.receive(data)
+                except Exception as e:
+                    # Skipped rather than retried: an update that can't be queued would stall every later one
+                    print(f"❌ Skipping update {data.get('update_id')} that could not be queued: {e}")
+                self.offset = data["update_id"] + 1
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if not self.task:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)  # Drops the long poll still held open
+        if self.offset is None:
+            return
+        # Confirm the last dispatched batch, or Telegram hands it out again after a restart and, with the
+        # dedup gone with the process, it is handled twice
+        body = {"offset": self.offset, "limit": 1, "timeout": 0, "allowed_updates": self.allowed_updates}
+        try:
+            response = await self.dispatcher.client.post(
+                f"{self.api_base}/getUpdates",
+                content=fast_json.dumps(body),
+                headers={"content-type": "application/json"},
+            )
+        except httpx.TransportError as e:
+            print(f"❌ Confirming update offset {self.offset} failed: {e}")
+            return
+        if response.status_code != 200:
+            description, _ = parse_error(response)
+            print(f"❌ Confirming update offset {self.offset} failed ({response.status_code}): {description}")
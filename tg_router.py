@@ -0,0 +1,112 @@
+import re
+
+
+class Update:
+    # The parts of a webhook update that handlers read, pulled out once
+    __slots__ = ("data", "message", "callback_query", "text", "callback_data", "chat_id", "message_id", "user", "user_id", "match")
+
+    def __init__(self, data):
+        self.data = data
+        self.message = data.get("message")
+        self.callback_query = data.get("callback_query")
+        self.text = ""
+        self.callback_data = ""
+        self.chat_id = None
+        self.message_id = None
+        self.user = {}
+        self.user_id = None
+        self.match = None  # Set for regex routes
+        if self.message:
+            self.text = self.message.get("text", "")
+            self.chat_id = self.message["chat"]["id"]
+            self.user = self.message.get("from", {})
+        elif self.callback_query:
+            self.callback_data = self.callback_query.get("data", "")
+            self.chat_id = self.callback_query["message"]["chat"]["id"]
+            self.message_id = self.callback_query["message"]["message_id"]
+            self.user = self.callback_query.get("from", {})
+        self.user_id = self.user.get("id")
+
+
+class RouteTable:
+    # Routes one string (message text or callback data). Exact keys are one dict lookup; prefixes are one
+    # lookup per distinct prefix length, longest first; only `when` predicates and regexes are scanned.
+    # Candidates are tried in the order: when, exact, prefix, regex, fallback. A handler that returns
+    # None passes the update on to the next candidate. A key registered twice keeps its first handler,
+    # as the first matching branch of an if/elif chain would.
+    def __init__(self):
+        self.guards = []
+        self.exact = {}
+        self.prefixes = {}
+        self.prefix_lengths = []
+        self.patterns = []
+        self.fallback = None
+
+    def add(self, handler, exact=(), prefix=(), regex=None, when=None, fallback=False):
+        for key in [exact] if isinstance(exact, str) else exact:
+            self.exact.setdefault(key, handler)
+        for key in [prefix] if isinstance(prefix, str) else prefix:
+            self.prefixes.setdefault(key, handler)
+            if len(key) not in self.prefix_lengths:
+                self.prefix_lengths.append(len(key))
+                self.prefix_lengths.sort(reverse=True)
+        if regex is not None:
+            self.patterns.append((re.compile(regex), handler))
+        if when is not None:
+            self.guards.append((when, handler))
+        if fallback:
+            self.fallback = handler
+
+    def candidates(self, update, key):
+        for when, handler in self.guards:
+            if when(update):
+                yield handler
+        handler = self.exact.get(key)
+        if handler:
+            yield handler
+        for length in self.prefix_lengths:
+            handler = self.prefixes.get(key[:length]) if len(key) >= length else None
+            if handler:
+                yield handler
+        for pattern, handler in self.patterns:
+            match = pattern.fullmatch(key)
+            if match:
+                update.match = match
+                yield handler
+        if self.fallback:
+            yield self.fallback
+
+
+class Router:
+    def __init__(self):
+        self.messages = RouteTable()
+        self.callbacks = RouteTable()
+
+    def message(self, text=(), prefix=(), regex=None, when=None, fallback=False):
+        def register(handler):
+            self.messages.add(handler, text, prefix, regex, when, fallback)
+            return handler
+        return register
+
+    def callback(self, data=(), prefix=(), regex=None, when=None, fallback=False):
+        def register(handler):
+            self.callbacks.add(handler, data, prefix, regex, when, fallback)
+            return handler
+        return register
+
+    async def dispatch(self, update, background_tasks):
+        if update.message:
+            table, key = self.messages, update.text
+        elif update.callback_query:
+            table, key = self.callbacks, update.callback_data
+        else:
+            return {"ok": True}
+        tried = set()
+        for handler in table.candidates(update, key):
+            if handler in tried:
+                continue
+            tried.add(handler)
+            result = await handler(update, background_tasks)
+            if result is not None:
+                return result
+        return {"ok": True}
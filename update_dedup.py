@@ -0,0 +1,38 @@
+import os
+from collections import deque
+
+DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))
+
+
+class RecentUpdates:
+    # Telegram redelivers an update whose webhook call timed out or failed, with the same update_id.
+    # The last `size` update_ids and callback_query ids are kept in a ring buffer (with a set for lookups),
+    # so a redelivery is recognised before any work is done and simply acknowledged.
+    def __init__(self, size=DEDUP_SIZE):
+        self.ring = deque(maxlen=size)
+        self.keys = set()
+        self.duplicates = 0
+
+    def update_keys(self, data):
+        keys = [("update", data.get("update_id"))]
+        callback_query = data.get("callback_query")
+        if callback_query:
+            keys.append(("callback_query", callback_query.get("id")))
+        return [key for key in keys if key[1] is not None]
+
+    def seen(self, data):
+        # True if this update was already recorded
+        if any(key in self.keys for key in self.update_keys(data)):
+            self.duplicates += 1
+            return True
+        return False
+
+    def record(self, data):
+        # Called once the update is queued, so one that failed before that is not dropped when Telegram redelivers it
+        for key in self.update_keys(data):
+            if key in self.keys:
+                continue
+            if len(self.ring) == self.ring.maxlen:
+                self.keys.discard(self.ring[0])  # About to fall off the ring
+            self.ring.append(key)
+            self.keys.add(key)
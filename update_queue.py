@@ -0,0 +1,107 @@
+import os
+import asyncio
+import time
+from collections import deque
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "32"))
+DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "20"))
+
+# Degraded modes under load; each one also keeps the cuts of the modes below it
+NORMAL = 0
+NO_ANIMATIONS = 1   # Analysis and checking animations collapse to their final message
+NO_LOGS = 2         # Log-channel posts are skipped
+ESSENTIAL_ONLY = 3  # Replies nobody needs to get a signal, like "Unknown command", are dropped
+MODE_NAMES = ["normal", "no animations", "no log posts", "essential replies only"]
+# A mode starts once updates queued or in progress reach its depth, or an update waited its seconds for a worker
+SHED_QUEUE_DEPTHS = [int(n) for n in os.getenv("SHED_QUEUE_DEPTHS", "100,300,1000").split(",")]
+SHED_WAIT_SECONDS = [float(n) for n in os.getenv("SHED_WAIT_SECONDS", "2,5,15").split(",")]
+RECOVER_RATIO = 0.5  # A mode ends only once both are under this share of its thresholds, so it doesn't flap
+
+
+class UpdateQueue:
+    # Lets webhook() return as soon as the update is parsed. Updates wait in a FIFO per chat and a fixed pool
+    # of workers drains them, one update per chat at a time: a chat's updates are handled strictly in the
+    # order they arrived, while different chats run in parallel up to the pool size.
+    # As the backlog grows, `mode` steps through the degraded modes above for handlers to check, and
+    # on_mode_change(mode) is called on every change.
+    def __init__(self, handle, workers=UPDATE_WORKERS, on_mode_change=None):
+        self.handle = handle
+        self.workers = workers
+        self.on_mode_change = on_mode_change
+        self.mode = NORMAL
+        self.chats = {}  # chat key -> updates waiting; present while the chat is queued or being handled
+        self.ready = asyncio.Queue()  # (chat key, when it became ready) for chats with an update waiting and none in progress
+        self.pending = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.tasks = []
+
+    def put(self, key, update):
+        waiting = self.chats.get(key)
+        if waiting is None:
+            self.chats[key] = deque([update])
+            self.ready.put_nowait((key, time.monotonic()))
+        else:
+            waiting.append(update)  # Its worker picks the chat up again when the current update is done
+        self.pending += 1
+        self.idle.clear()
+        # A backlog behind busy workers shows in the depth before anything is dequeued; only escalate here,
+        # recovery is left to the workers, which also see the wait
+        mode = self.level(self.pending, 0)
+        if mode > self.mode:
+            self.set_mode(mode, self.pending, 0)
+
+    async def worker(self):
+        while True:
+            key, ready_at = await self.ready.get()
+            waiting = self.chats[key]
+            update = waiting.popleft()
+            # Waited for a worker since the chat became ready, not behind its own previous update
+            self.measure(self.pending, time.monotonic() - ready_at)
+            try:
+                await self.handle(update)
+            except Exception as e:
+                print(f"❌ Failed to handle update for chat {key}: {e}")
+            self.pending -= 1
+            if waiting:
+                self.ready.put_nowait((key, time.monotonic()))
+            else:
+                del self.chats[key]
+                if not self.pending:
+                    self.idle.set()
+                    self.set_mode(NORMAL, 0, 0)
+
+    def level(self, depth, wait, scale=1.0):
+        level = NORMAL
+        for mode, (max_depth, max_wait) in enumerate(zip(SHED_QUEUE_DEPTHS, SHED_WAIT_SECONDS), NORMAL + 1):
+            if depth >= max_depth * scale or wait >= max_wait * scale:
+                level = mode
+        return level
+
+    def measure(self, depth, wait):
+        mode = self.level(depth, wait)
+        if mode < self.mode:
+            mode = min(self.mode, self.level(depth, wait, RECOVER_RATIO))
+        self.set_mode(mode, depth, wait)
+
+    def set_mode(self, mode, depth, wait):
+        if mode == self.mode:
+            return
+        arrow = "⚠️" if mode > self.mode else "✅"
+        print(f"{arrow} Load mode: {MODE_NAMES[self.mode]} -> {MODE_NAMES[mode]} ({depth} updates pending, last waited {wait:.1f}s)")
+        self.mode = mode
+        if self.on_mode_change:
+            self.on_mode_change(mode)
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        print(f"✅ Started {self.workers} update workers")
+
+    async def stop(self, timeout=DRAIN_TIMEOUT):
+        # Finish what Telegram has already been told was received, then stop the workers
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Stopping with {self.pending} updates still queued")
+        for task in self.tasks:
+            task.cancel()
@@ -1,11 +1,9 @@
 from fastapi import FastAPI
 from typing import Optional
-import gspread
-import json
 import httpx
 import asyncio
-from oauth2client.service_account import ServiceAccountCredentials
-import os
+from sheets_session import open_worksheet
+from sheet_cache import DepositAccumulator
 
 # Constants
 RENDER_URL = "https://z3ntra-postback.onrender.com"
@@ -27,24 +25,16 @@ async def lifespan(app: FastAPI):
             await asyncio.sleep(300)  # every 5 minutes
 
     asyncio.create_task(self_ping_loop())
+    asyncio.create_task(deposit_accumulator.run())
     yield
+    await deposit_accumulator.flush()
     await ping_client.aclose()
 
 # Initialize FastAPI app
 app = FastAPI(lifespan=lifespan)
 
-# Google Sheets authorization
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive"
-]
-
-creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS"))
-gs_creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-gs_client = gspread.authorize(gs_creds)
-spreadsheet = gs_client.open(SPREADSHEET_NAME)
-sheet = spreadsheet.worksheet(WORKSHEET_NAME)
+sheet = open_worksheet(SPREADSHEET_NAME, WORKSHEET_NAME)
+deposit_accumulator = DepositAccumulator(sheet)
 
 @app.get("/")
 def root():
@@ -68,12 +58,10 @@ async def webhook(
     except ValueError:
         original_amount = 0
 
-    trader_ids = sheet.col_values(1)
-
     try:
         if event == "registration":
-            if trader_id not in trader_ids:
-                sheet.append_row([trader_id, "0"])
+            status, _ = await deposit_accumulator.submit(trader_id, [trader_id, "0"])
+            if status == "created":
                 print(f"🆕 Registered new trader {trader_id}")
                 return {"status": "registered", "trader_id": trader_id}
             else:
@@ -81,20 +69,15 @@ async def webhook(
                 return {"status": "already_registered", "trader_id": trader_id}
 
         elif event in ["ftd", "redeposit"]:
-            if trader_id in trader_ids:
-                row = trader_ids.index(trader_id) + 1
-                current_value = sheet.cell(row, 2).value
-                try:
-                    current_total = float(current_value or 0)
-                except ValueError:
-                    current_total = 0.0
-                new_total = current_total + original_amount
-                sheet.update_cell(row, 2, str(new_total))
-                print(f"✅ Updated {trader_id}: {current_total} + {original_amount} = {new_total}")
+            status, row = await deposit_accumulator.submit(
+                trader_id, [trader_id, str(original_amount)], increments={2: original_amount}
+            )
+            if status == "updated":
+                new_total = row[1]
+                print(f"✅ Updated {trader_id}: +{original_amount} = {new_total}")
                 return {"status": "updated", "trader_id": trader_id, "total": new_total}
             else:
-                # Register and record deposit
-                sheet.append_row([trader_id, str(original_amount)])
+                # Registered and recorded deposit
                 print(f"🆕 Auto-registered {trader_id} | Deposit: {original_amount}")
                 return {"status": "auto_registered", "trader_id": trader_id, "total": original_amount}
 